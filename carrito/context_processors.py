@@ -1,6 +1,6 @@
 from django.db import models
-from django.core.cache import cache
-from .models import Carrito
+from utils.cache_utils import get_or_compute
+from .models import ItemCarrito
 
 def carrito_count(request):
     """
@@ -9,22 +9,16 @@ def carrito_count(request):
     """
     # Solo procesamos para usuarios autenticados
     if request.user.is_authenticated:
-        # Intentamos obtener el conteo desde la caché
-        cache_key = f'carrito_count_{request.user.id}'
-        count = cache.get(cache_key)
-        
-        # Si no está en caché, calculamos el valor
-        if count is None:
-            try:
-                carrito = Carrito.objects.get(usuario=request.user)
-                # Usamos una sola consulta para obtener el total sumando cantidades
-                count = carrito.items.aggregate(total=models.Sum('cantidad'))['total'] or 0
-                
-                # Guardamos en caché por un tiempo corto (2 minutos)
-                cache.set(cache_key, count, 120)
-            except Carrito.DoesNotExist:
-                count = 0
-                
+        def contar():
+            # Usamos una sola consulta para obtener el total sumando cantidades
+            total = ItemCarrito.objects.filter(carrito__usuario=request.user).aggregate(
+                total=models.Sum('cantidad'))['total']
+            return total or 0
+
+        # Desde la caché por un tiempo corto (2 minutos); las señales del
+        # carrito borran la clave en cada cambio
+        count = get_or_compute(f'carrito_count_{request.user.id}', contar, 120)
+
         return {'carrito_count': count}
         
     # Para usuarios no autenticados siempre devolvemos 0
@@ -79,7 +79,7 @@ def actualizar_carrito(request, item_id):
             cantidad = int(request.POST.get('cantidad', 1))
             
             if cantidad > 0:
-                if cantidad <= item.producto.stock:
+                if cantidad <= item.producto.disponibles:
                     # Actualizar la cantidad
                     item.cantidad = cantidad
                     item.save()
@@ -97,7 +97,7 @@ def actualizar_carrito(request, item_id):
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse({
                             'success': False,
-                            'error': f'Solo hay {item.producto.stock} unidades disponibles',
+                            'error': f'Solo hay {item.producto.disponibles} unidades disponibles',
                             'current_quantity': item.cantidad
                         })
             else:
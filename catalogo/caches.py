@@ -0,0 +1,96 @@
+"""
+Entradas de caché del catálogo (ver utils/cache_warming.py).
+
+Las vistas leen estos valores con get(); manage.py precache los recalcula
+todos tras un despliegue o un vaciado de la caché.
+
+Los valores se guardan como filas con los campos que usan las plantillas
+(ver utils/cache_values.py); al añadir a una plantilla un campo que no está
+en el esquema, cada producto lo cargaría con una consulta.
+"""
+from django.db.models import Count
+
+from utils.cache_values import ModelSchema, Schema
+from utils.cache_warming import warmable
+from .models import Categoria, ImagenProducto, Marca, Producto
+
+# Productos populares cuyos relacionados se precalientan
+RELACIONADOS_A_CALENTAR = 12
+
+# Filtros laterales del listado
+CATEGORIA = ModelSchema(Categoria, ['id', 'nombre'])
+MARCA = ModelSchema(Marca, ['id', 'nombre'])
+
+# Tarjetas de producto: imagen_responsive usa la imagen principal y sus variantes
+IMAGEN = ModelSchema(ImagenProducto, ['id', 'producto_id', 'imagen', 'orden', 'es_principal',
+                                      'ultima_modificacion', 'variantes'])
+PRODUCTO = ModelSchema(
+    Producto,
+    ['id', 'nombre', 'precio', 'categoria_id', 'marca_id', 'disponible', 'imagen'],
+    related={'_imagen_principal': (IMAGEN, Producto.get_imagen_principal)},
+)
+PRODUCTO_RELACIONADO = ModelSchema(
+    Producto, ['id', 'nombre', 'precio', 'categoria_id', 'marca_id', 'disponible', 'imagen'])
+
+
+# Sin etiquetas: las señales borran estas claves al cambiar una categoría o marca
+@warmable('todas_categorias', timeout=3600, schema=CATEGORIA)
+def todas_categorias():
+    return list(Categoria.objects.all())
+
+
+@warmable('todas_marcas', timeout=3600, schema=MARCA)
+def todas_marcas():
+    return list(Marca.objects.all())
+
+
+# Al caducar se sirven los anteriores mientras una sola petición los recalcula
+@warmable('productos_populares', tags=['productos'], timeout=60 * 30, schema=PRODUCTO,
+          stale_ttl=60 * 5)
+def productos_populares():
+    # Simula productos populares (en un sistema real se usarían datos de
+    # vistas o compras)
+    return list(Producto.objects
+                .filter(disponible=True)
+                .order_by('-stock')  # Productos más disponibles
+                .select_related('categoria', 'marca')
+                .con_imagen_principal()[:12])
+
+
+@warmable(
+    'productos_relacionados',
+    key='productos_relacionados_{0}',
+    # Ligada a los productos y a su categoría
+    tags=lambda producto_id, categoria_id: ['productos', f'categoria:{categoria_id}'],
+    timeout=3600,
+    params=lambda: [(p.id, p.categoria_id)
+                    for p in productos_populares.get()[:RELACIONADOS_A_CALENTAR]],
+    depends_on=['productos_populares'],
+    schema=PRODUCTO_RELACIONADO,
+    stale_ttl=60 * 5,
+)
+def productos_relacionados(producto_id, categoria_id):
+    return list(
+        Producto.objects.filter(
+            categoria_id=categoria_id,
+            disponible=True
+        ).exclude(id=producto_id)[:4]  # Limitamos a 4 productos relacionados
+    )
+
+
+@warmable('marcas_list_admin', tags=['catalogo', 'productos'], timeout=120,
+          schema=Schema('marcas_list_admin'))
+def marcas_admin():
+    """Marcas ordenadas por nombre con su número de productos (para JSON)"""
+    marcas = Marca.objects.annotate(
+        productos_count=Count('productos')
+    ).order_by('nombre')
+    return [
+        {
+            'id': marca.id,
+            'nombre': marca.nombre,
+            'descripcion': marca.descripcion or '',
+            'productos_count': marca.productos_count
+        }
+        for marca in marcas
+    ]
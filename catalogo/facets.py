@@ -0,0 +1,236 @@
+"""
+Facetas del catálogo: recuentos por categoría, marca, talla y rango de precio.
+
+Todos los recuentos salen de una única consulta (UNION ALL de agregaciones
+agrupadas) y se cachean por firma de filtros bajo las etiquetas del catálogo,
+de modo que cualquier cambio de producto, categoría o marca los invalida.
+
+Cada faceta se calcula sin su propio filtro (facetas disyuntivas): con
+"Honda" marcada, la lista de marcas sigue mostrando cuántos productos
+tendría cada una de las demás.
+"""
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Cast
+from django.http import QueryDict
+
+from utils.cache_warming import warmable
+from .models import Producto
+from .search import buscar_productos
+
+# Tiempo de vida de los recuentos en caché (la invalidación es por etiquetas)
+FACETAS_TIMEOUT = 60 * 15
+
+# Rangos de precio: (clave, mínimo, máximo); el máximo es exclusivo
+RANGOS_PRECIO = (
+    ('0', None, 50),
+    ('1', 50, 100),
+    ('2', 100, 250),
+    ('3', 250, 500),
+    ('4', 500, 1000),
+    ('5', 1000, None),
+)
+
+
+def _decimal(valor):
+    """Convierte un parámetro de precio a Decimal, o None si no es válido"""
+    if valor in (None, ''):
+        return None
+    try:
+        return Decimal(str(valor))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+
+
+def filtros_desde_request(params):
+    """
+    Normaliza los filtros del catálogo a partir de request.GET.
+
+    Returns:
+        dict: nombre, precio_min, precio_max, categorias, marcas, tallas
+            y disponible, con listas ordenadas para que la firma sea estable
+    """
+    return {
+        'nombre': params.get('nombre', '').strip(),
+        'precio_min': _decimal(params.get('precio_min')),
+        'precio_max': _decimal(params.get('precio_max')),
+        'categorias': sorted({c for c in params.getlist('categoria') if c.isdigit()}, key=int),
+        'marcas': sorted({m for m in params.getlist('marca') if m.isdigit()}, key=int),
+        'tallas': sorted(set(t for t in params.getlist('talla') if t)),
+        'disponible': params.get('disponible') == 'true',
+    }
+
+
+def hay_filtros(filtros):
+    """True si algún filtro (o la búsqueda) restringe el catálogo"""
+    return bool(filtros['nombre'] or filtros['categorias'] or filtros['marcas'] or filtros['tallas']
+                or filtros['disponible'] or filtros['precio_min'] is not None
+                or filtros['precio_max'] is not None)
+
+
+def filtrar_productos(queryset, filtros, excluir=()):
+    """
+    Aplica los filtros del catálogo a un queryset de Producto.
+
+    Args:
+        queryset: QuerySet de Producto
+        filtros (dict): Filtros devueltos por filtros_desde_request
+        excluir (iterable): Filtros que no deben aplicarse
+            ('categorias', 'marcas', 'tallas', 'precio')
+
+    Returns:
+        QuerySet filtrado (anotado con `relevancia` si hay búsqueda)
+    """
+    if filtros['nombre']:
+        queryset = buscar_productos(queryset, filtros['nombre'])
+
+    if 'precio' not in excluir:
+        if filtros['precio_min'] is not None:
+            queryset = queryset.filter(precio__gte=filtros['precio_min'])
+        if filtros['precio_max'] is not None:
+            queryset = queryset.filter(precio__lte=filtros['precio_max'])
+
+    if filtros['categorias'] and 'categorias' not in excluir:
+        queryset = queryset.filter(categoria_id__in=filtros['categorias'])
+
+    if filtros['marcas'] and 'marcas' not in excluir:
+        queryset = queryset.filter(marca_id__in=filtros['marcas'])
+
+    if filtros['tallas'] and 'tallas' not in excluir:
+        # Subconsulta para no duplicar filas por cada talla coincidente
+        queryset = queryset.filter(id__in=Producto.objects.filter(
+            tallas__talla__in=filtros['tallas'], tallas__disponible=True
+        ).values('id'))
+
+    if filtros['disponible']:
+        queryset = queryset.filter(disponible=True)
+
+    return queryset
+
+
+def firma_filtros(filtros):
+    """Firma estable de una combinación de filtros para usar en claves de caché"""
+    datos = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.md5(datos.encode('utf-8')).hexdigest()
+
+
+def _expresion_rango_precio():
+    """Expresión que devuelve la clave del rango de precio de cada producto"""
+    casos = []
+    for clave, minimo, maximo in RANGOS_PRECIO:
+        condicion = Q()
+        if minimo is not None:
+            condicion &= Q(precio__gte=minimo)
+        if maximo is not None:
+            condicion &= Q(precio__lt=maximo)
+        casos.append(When(condicion, then=Value(clave)))
+    return Case(*casos, output_field=CharField())
+
+
+def _agrupar(queryset, faceta, clave):
+    """Recuento de productos distintos agrupado por `clave` para una faceta"""
+    return (queryset
+            .order_by()
+            .annotate(faceta=Value(faceta, output_field=CharField()), clave=clave)
+            .values('faceta', 'clave')
+            .annotate(total=Count('id', distinct=True)))
+
+
+def _consultar_facetas(filtros):
+    """Ejecuta la consulta agregada y devuelve los recuentos por faceta"""
+    base = Producto.objects.all()
+    if filtros['nombre']:
+        # La búsqueda va como subconsulta para no arrastrar su anotación
+        # de relevancia a las agrupaciones
+        base = base.filter(id__in=buscar_productos(
+            Producto.objects.all(), filtros['nombre']
+        ).values('id'))
+    filtros = dict(filtros, nombre='')
+
+    consultas = [
+        _agrupar(filtrar_productos(base, filtros, excluir=['categorias']),
+                 'categorias', Cast('categoria_id', CharField())),
+        _agrupar(filtrar_productos(base, filtros, excluir=['marcas']),
+                 'marcas', Cast('marca_id', CharField())),
+        _agrupar(filtrar_productos(base, filtros, excluir=['tallas'])
+                 .filter(tallas__disponible=True),
+                 'tallas', F('tallas__talla')),
+        _agrupar(filtrar_productos(base, filtros, excluir=['precio']),
+                 'precios', _expresion_rango_precio()),
+    ]
+
+    facetas = {'categorias': {}, 'marcas': {}, 'tallas': {}, 'precios': {}}
+    for fila in consultas[0].union(*consultas[1:], all=True):
+        facetas[fila['faceta']][fila['clave']] = fila['total']
+    return facetas
+
+
+def calcular_facetas(filtros):
+    """
+    Devuelve los recuentos de cada faceta para una combinación de filtros.
+
+    Args:
+        filtros (dict): Filtros devueltos por filtros_desde_request
+
+    Returns:
+        dict: {'categorias': {id: total}, 'marcas': {id: total},
+               'tallas': {talla: total}, 'precios': {clave: total}}
+            (las claves de categorías y marcas son cadenas)
+    """
+    return facetas_cacheadas.get(filtros)
+
+
+@warmable(
+    'facetas',
+    key=lambda filtros: f'facetas_{firma_filtros(filtros)}',
+    tags=['productos', 'catalogo'],
+    timeout=FACETAS_TIMEOUT,
+    # El catálogo sin filtrar es la página de entrada más visitada
+    params=lambda: [(filtros_desde_request(QueryDict()),)],
+)
+def facetas_cacheadas(filtros):
+    return _consultar_facetas(filtros)
+
+
+def rangos_precio(facetas, params):
+    """
+    Prepara los rangos de precio para la plantilla.
+
+    Args:
+        facetas (dict): Resultado de calcular_facetas
+        params (QueryDict): request.GET, para construir el enlace de cada rango
+
+    Returns:
+        list: dicts con clave, etiqueta, total, seleccionado y query
+    """
+    rangos = []
+    for clave, minimo, maximo in RANGOS_PRECIO:
+        total = facetas['precios'].get(clave, 0)
+        if not total:
+            continue
+
+        if minimo is None:
+            etiqueta = f'Menos de ${maximo}'
+        elif maximo is None:
+            etiqueta = f'Más de ${minimo}'
+        else:
+            etiqueta = f'${minimo} - ${maximo}'
+
+        query = params.copy()
+        query.pop('page', None)
+        query['precio_min'] = '' if minimo is None else str(minimo)
+        # El filtro de precio máximo es inclusivo y el del rango no
+        query['precio_max'] = '' if maximo is None else str(Decimal(maximo) - Decimal('0.01'))
+
+        rangos.append({
+            'clave': clave,
+            'etiqueta': etiqueta,
+            'total': total,
+            'seleccionado': (params.get('precio_min', '') == query['precio_min'] and
+                             params.get('precio_max', '') == query['precio_max']),
+            'query': query.urlencode(),
+        })
+    return rangos
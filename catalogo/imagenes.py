@@ -0,0 +1,202 @@
+"""
+Variantes de las imágenes de producto.
+
+Cada ImagenProducto se publica en varios perfiles (tabla, nav, tarjeta y
+carrusel), cada uno a varios anchos y en AVIF (si Pillow lo soporta), WebP y
+JPEG; la plantilla elige con <picture>/srcset y el navegador descarga el
+fichero más pequeño que acepta (ver templatetags/catalogo_imagenes.py).
+
+Las variantes y las miniaturas de imagekit (ImageSpecField) se generan en
+segundo plano al subir la imagen (tarea generar_variantes_imagen) o en bloque
+con manage.py generar_variantes. Ninguna petición redimensiona imágenes: las
+miniaturas usan la estrategia SoloEnSegundoPlano y, mientras no existan, se
+sirve la imagen original.
+
+ImagenProducto.variantes registra lo generado:
+
+    {'origen': 'productos/imagenes/casco.jpg', 'formatos': ['webp', 'jpeg'],
+     'anchos': {'tabla': [80, 160], 'carrusel': [400, 800, 1200], ...}}
+
+El almacenamiento nunca sobrescribe ficheros, así que una imagen nueva tiene
+otro nombre: si `origen` no coincide con la imagen actual, las variantes
+están desfasadas y se ignoran.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+from functools import lru_cache
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from pilkit.processors import ResizeToFill, ResizeToFit
+from PIL import Image
+
+from utils.cache_utils import invalidate_model_cache
+
+logger = logging.getLogger('mototienda.performance')
+
+# nombre: tamaño a 1x (ancho, alto), si se recorta al tamaño exacto y anchos
+# que se generan (sin ampliar nunca la imagen original)
+PERFILES = {
+    'tabla': {'tamano': (80, 80), 'recortar': True, 'anchos': (80, 160)},
+    'nav': {'tamano': (100, 100), 'recortar': True, 'anchos': (100, 200)},
+    'tarjeta': {'tamano': (300, 200), 'recortar': False, 'anchos': (300, 600)},
+    'carrusel': {'tamano': (800, 600), 'recortar': False, 'anchos': (400, 800, 1200)},
+}
+
+# Del más ligero al más compatible; JPEG siempre está disponible
+FORMATOS = ('avif', 'webp', 'jpeg')
+OPCIONES = {
+    'avif': {'quality': 60},
+    'webp': {'quality': 80},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+TIPOS_MIME = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONES = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+
+# Miniaturas de imagekit que se generan junto con las variantes
+ESPECIFICACIONES = ('thumbnail_tabla', 'carrusel', 'miniatura_nav')
+
+DIRECTORIO = 'productos/variantes'
+
+
+class SoloEnSegundoPlano:
+    """
+    Estrategia de imagekit que nunca genera un fichero al acceder a él:
+    .url devuelve la ruta sin comprobar nada. Los ficheros los crea
+    generar_variantes() fuera de la petición.
+    """
+    def should_verify_existence(self, file):
+        return False
+
+
+@lru_cache(maxsize=None)
+def formatos():
+    """Formatos que el Pillow instalado sabe escribir (AVIF requiere Pillow 11.2 o un plugin)"""
+    Image.init()
+    return tuple(f for f in FORMATOS if f == 'jpeg' or f.upper() in Image.SAVE)
+
+
+def version(origen):
+    """Identificador corto de una imagen original (por su nombre, que no se reutiliza)"""
+    return hashlib.md5(origen.encode()).hexdigest()[:8]
+
+
+def ruta(imagen_id, origen, perfil, ancho, formato):
+    return posixpath.join(DIRECTORIO, str(imagen_id), version(origen),
+                          f'{perfil}-{ancho}.{EXTENSIONES[formato]}')
+
+
+def vigentes(imagen):
+    """Registro de variantes de la imagen, o None si faltan o están desfasadas"""
+    variantes = imagen.variantes or {}
+    if imagen.imagen and variantes.get('origen') == imagen.imagen.name:
+        return variantes
+    return None
+
+
+def url(imagen, perfil, ancho, formato):
+    origen = imagen.imagen.name
+    return f"{default_storage.url(ruta(imagen.id, origen, perfil, ancho, formato))}?v={version(origen)}"
+
+
+def _anchos(perfil, ancho_original):
+    anchos = [a for a in PERFILES[perfil]['anchos'] if a <= ancho_original]
+    # Con una original más estrecha que todos los anchos, se genera solo el menor
+    return anchos or [PERFILES[perfil]['anchos'][0]]
+
+
+def _redimensionar(original, perfil, ancho):
+    config = PERFILES[perfil]
+    base_ancho, base_alto = config['tamano']
+    alto = round(ancho * base_alto / base_ancho)
+    if config['recortar']:
+        return ResizeToFill(ancho, alto).process(original)
+    return ResizeToFit(ancho, alto, upscale=False).process(original)
+
+
+def _codificar(imagen, formato):
+    if formato == 'jpeg' and imagen.mode not in ('RGB', 'L'):
+        imagen = imagen.convert('RGB')
+    salida = io.BytesIO()
+    imagen.save(salida, format=formato.upper(), **OPCIONES[formato])
+    return salida.getvalue()
+
+
+def _guardar(nombre, contenido):
+    # El almacenamiento no sobrescribe: al regenerar se borra el anterior
+    if default_storage.exists(nombre):
+        default_storage.delete(nombre)
+    default_storage.save(nombre, ContentFile(contenido))
+
+
+def _borrar_anteriores(imagen_id, vigente):
+    """Elimina las variantes de versiones anteriores de la imagen"""
+    carpeta = posixpath.join(DIRECTORIO, str(imagen_id))
+    try:
+        versiones, _ = default_storage.listdir(carpeta)
+    except FileNotFoundError:
+        return
+    for anterior in versiones:
+        if anterior == vigente:
+            continue
+        subcarpeta = posixpath.join(carpeta, anterior)
+        for fichero in default_storage.listdir(subcarpeta)[1]:
+            default_storage.delete(posixpath.join(subcarpeta, fichero))
+        default_storage.delete(subcarpeta)
+
+
+def generar_variantes(imagen_id, forzar=False):
+    """
+    Genera las miniaturas de imagekit y todas las variantes de una imagen.
+
+    Se ejecuta en el worker de tareas o en los procesos de
+    generar_variantes; es idempotente.
+
+    Args:
+        imagen_id (int): ID de la ImagenProducto
+        forzar (bool): Regenerar aunque el registro esté al día
+
+    Returns:
+        int: Ficheros de variantes escritos (0 si no había nada que hacer)
+    """
+    from .models import ImagenProducto
+
+    imagen = ImagenProducto.objects.filter(id=imagen_id).first()
+    if imagen is None or not imagen.imagen:
+        return 0
+    if vigentes(imagen) and not forzar:
+        return 0
+
+    origen = imagen.imagen.name
+    for campo in ESPECIFICACIONES:
+        getattr(imagen, campo).generate(force=forzar)
+
+    with imagen.imagen.open('rb') as fichero:
+        original = Image.open(fichero)
+        original.load()
+
+    escritos = 0
+    anchos = {}
+    for perfil in PERFILES:
+        anchos[perfil] = _anchos(perfil, original.width)
+        for ancho in anchos[perfil]:
+            redimensionada = _redimensionar(original, perfil, ancho)
+            for formato in formatos():
+                _guardar(ruta(imagen.id, origen, perfil, ancho, formato),
+                         _codificar(redimensionada, formato))
+                escritos += 1
+
+    # update() para no tocar ultima_modificacion ni disparar señales; si la
+    # imagen se reemplazó mientras tanto, otra tarea generará las nuevas
+    actualizadas = ImagenProducto.objects.filter(id=imagen.id, imagen=origen).update(variantes={
+        'origen': origen,
+        'formatos': list(formatos()),
+        'anchos': anchos,
+    })
+    if actualizadas:
+        _borrar_anteriores(imagen.id, version(origen))
+        invalidate_model_cache('producto', imagen.producto_id)
+    logger.info(f"Variantes de la imagen {imagen.id}: {escritos} ficheros")
+    return escritos
@@ -0,0 +1,72 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from catalogo import imagenes
+from catalogo.models import ImagenProducto
+
+
+def generar(imagen_id, forzar=False):
+    """Genera las variantes de una imagen (se ejecuta en los procesos hijos)"""
+    try:
+        return imagen_id, imagenes.generar_variantes(imagen_id, forzar=forzar), None
+    except Exception as e:
+        return imagen_id, 0, f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = ('Genera en paralelo las miniaturas y variantes (AVIF/WebP/JPEG a varios anchos) '
+            'de las imágenes de producto que aún no las tienen')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forzar', action='store_true',
+            help='Regenerar también las imágenes cuyas variantes están al día'
+        )
+        parser.add_argument(
+            '--producto', type=int, action='append', dest='productos',
+            help='ID de un producto cuyas imágenes procesar (se puede repetir)'
+        )
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos que redimensionan imágenes (por defecto, uno por CPU)'
+        )
+
+    def handle(self, *args, **options):
+        filas = ImagenProducto.objects.order_by('id')
+        if options['productos']:
+            filas = filas.filter(producto_id__in=options['productos'])
+
+        pendientes = [
+            imagen_id for imagen_id, origen, variantes in filas.values_list('id', 'imagen', 'variantes')
+            if options['forzar'] or (variantes or {}).get('origen') != origen
+        ]
+        if not pendientes:
+            self.stdout.write(self.style.SUCCESS('Todas las imágenes tienen sus variantes.'))
+            return
+        self.stdout.write(f"Generando variantes de {len(pendientes)} imágenes "
+                          f"(formatos: {', '.join(imagenes.formatos())})...")
+
+        tarea = partial(generar, forzar=options['forzar'])
+        procesos = max(1, options['procesos'])
+        inicio = time.monotonic()
+        if procesos > 1:
+            # Los procesos hijos no deben heredar la conexión abierta
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                resultados = list(pool.map(tarea, pendientes))
+        else:
+            resultados = [tarea(imagen_id) for imagen_id in pendientes]
+        segundos = time.monotonic() - inicio
+
+        ficheros = sum(escritos for _, escritos, _ in resultados)
+        errores = [(imagen_id, error) for imagen_id, _, error in resultados if error]
+        for imagen_id, error in errores:
+            self.stderr.write(f'Imagen {imagen_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pendientes) - len(errores)} imágenes procesadas ({ficheros} ficheros) '
+            f'en {segundos:.1f} s; {len(errores)} con errores.'
+        ))
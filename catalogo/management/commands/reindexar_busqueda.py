@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from catalogo.models import Producto
+from catalogo import search
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de texto completo de los productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--producto', type=int, action='append', dest='productos',
+            help='ID de un producto a reindexar (se puede repetir)'
+        )
+
+    def handle(self, *args, **options):
+        productos = Producto.objects.all()
+        if options['productos']:
+            productos = productos.filter(id__in=options['productos'])
+
+        total = search.reindexar(productos)
+        self.stdout.write(self.style.SUCCESS(f'Se reindexaron {total} productos.'))
@@ -0,0 +1,131 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:31
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# Copia fija de catalogo/search.py en el momento de esta migración: las
+# migraciones no deben depender del código de la aplicación, que cambia
+SEARCH_CONFIG = 'simple'
+FTS_TABLE = 'catalogo_busqueda_fts'
+GIN_INDEX_NAME = 'catalogo_busqueda_gin'
+
+STOPWORDS = frozenset("""
+    a al con de del el en es la las lo los o para por que se sin su sus un una
+    unos unas y e u muy mas
+""".split())
+
+SUFIJOS = (
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones',
+    'adoras', 'adores', 'ancias', 'encias', 'idades', 'mente', 'acion',
+    'ucion', 'adora', 'ador', 'ancia', 'encia', 'idad', 'ismos', 'istas',
+    'ismo', 'ista', 'ables', 'ibles', 'able', 'ible', 'ivas', 'ivos',
+    'iva', 'ivo', 'osas', 'osos', 'osa', 'oso', 'ando', 'iendo', 'adas',
+    'ados', 'idas', 'idos', 'ada', 'ado', 'ida', 'ido', 'es', 's',
+)
+
+
+def normalizar(texto):
+    if not texto:
+        return []
+    texto = strip_tags(texto)
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.findall(r'[a-z0-9]+', texto.lower())
+
+
+def raiz(palabra):
+    if len(palabra) <= 3 or palabra.isdigit():
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            palabra = palabra[:-len(sufijo)]
+            break
+    if len(palabra) > 3 and palabra[-1] in 'aeo':
+        palabra = palabra[:-1]
+    return palabra
+
+
+def terminos(texto):
+    return [raiz(p) for p in normalizar(texto) if p not in STOPWORDS]
+
+
+def construir_documento(nombre, descripcion='', categoria='', marca=''):
+    partes = [
+        terminos(nombre) * 2,
+        terminos(marca),
+        terminos(categoria),
+        terminos(descripcion),
+    ]
+    return ' '.join(t for parte in partes for t in parte)
+
+
+def _indice_gin():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(SearchVector('documento', config=SEARCH_CONFIG), name=GIN_INDEX_NAME)
+
+
+def crear_indice(apps, schema_editor):
+    """Crea el índice de texto completo propio de cada motor y lo llena"""
+    Producto = apps.get_model('catalogo', 'Producto')
+    IndiceBusquedaProducto = apps.get_model('catalogo', 'IndiceBusquedaProducto')
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.add_index(IndiceBusquedaProducto, _indice_gin())
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(documento, tokenize='unicode61')"
+        )
+
+    filas = [
+        (p.id, construir_documento(p.nombre, p.descripcion, p.categoria.nombre, p.marca.nombre))
+        for p in Producto.objects.select_related('categoria', 'marca').iterator()
+    ]
+    IndiceBusquedaProducto.objects.bulk_create(
+        [IndiceBusquedaProducto(producto_id=pk, documento=doc) for pk, doc in filas],
+        batch_size=500,
+    )
+    if vendor == 'sqlite' and filas:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, documento) VALUES (%s, %s)', filas
+            )
+
+
+def eliminar_indice(apps, schema_editor):
+    IndiceBusquedaProducto = apps.get_model('catalogo', 'IndiceBusquedaProducto')
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.remove_index(IndiceBusquedaProducto, _indice_gin())
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0010_remove_imagenproducto_unique_product_image_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBusquedaProducto',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='catalogo.producto')),
+                ('documento', models.TextField(blank=True, default='')),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Índice de búsqueda de producto',
+                'verbose_name_plural': 'Índices de búsqueda de productos',
+            },
+        ),
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
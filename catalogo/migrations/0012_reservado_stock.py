@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0011_indicebusquedaproducto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='reservado',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tallaproducto',
+            name='reservado',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
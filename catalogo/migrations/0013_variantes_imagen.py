@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0012_reservado_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagenproducto',
+            name='variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,11 +1,22 @@
+import hashlib
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from imagekit.models import ProcessedImageField, ImageSpecField
 from imagekit.processors import ResizeToFill, ResizeToFit, Adjust
 from django.utils import timezone
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+
+from utils.tracking import FieldTracker
+
+def url_versionada(archivo, version):
+    """
+    URL de un fichero de media con su versión en la query string. La versión
+    solo cambia cuando cambia el fichero, así que la URL puede guardarse en
+    caché indefinidamente (ver core.middleware.MediaCacheControlMiddleware).
+    """
+    return f"{archivo.url}?v={version}"
+
 
 def get_default_date():
     """Función que devuelve la fecha y hora actual como valor predeterminado"""
@@ -21,6 +32,9 @@ class Categoria(models.Model):
     # Fecha en que se creó esta categoría (se llena automáticamente)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    # El nombre forma parte del documento de búsqueda de sus productos
+    tracker = FieldTracker(['nombre'])
+
     def __str__(self):
         # Método que define cómo se muestra la categoría en el admin y otros lugares
         return self.nombre
@@ -29,17 +43,6 @@ class Categoria(models.Model):
         # Clase que permite configurar opciones adicionales del modelo
         verbose_name_plural = "Categorías"  # Nombre correcto en plural para el admin
     
-@receiver(post_save, sender=Categoria)
-def categoria_saved(sender, instance, created, **kwargs):
-        """Invalidar caché cuando se guarda una categoría"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('categoria', instance.id)
-        
-@receiver(post_delete, sender=Categoria)
-def categoria_deleted(sender, instance, **kwargs):
-        """Invalidar caché cuando se elimina una categoría"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('categoria', instance.id)
 
 class Marca(models.Model):
     # Nombre de la marca (Honda, Yamaha, Alpinestars, etc.)
@@ -51,6 +54,9 @@ class Marca(models.Model):
     # Imagen del logo de la marca (se guardará en la carpeta 'marcas/')
     logo = models.ImageField(upload_to='marcas/', blank=True, null=True)
 
+    # El nombre forma parte del documento de búsqueda de sus productos
+    tracker = FieldTracker(['nombre'])
+
     def __str__(self):
         return self.nombre
         
@@ -59,17 +65,21 @@ class Marca(models.Model):
         self.nombre = self.nombre.strip()
         super().save(*args, **kwargs)
     
-@receiver(post_save, sender=Marca)
-def marca_saved(sender, instance, created, **kwargs):
-        """Invalidar caché cuando se guarda una marca"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('marca', instance.id)
-        
-@receiver(post_delete, sender=Marca)
-def marca_deleted(sender, instance, **kwargs):
-        """Invalidar caché cuando se elimina una marca"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('marca', instance.id)
+
+class ProductoQuerySet(models.QuerySet):
+    def con_imagen_principal(self):
+        """
+        Precarga solo la imagen principal de cada producto (o la primera si
+        ninguna está marcada) en una única consulta para todo el listado.
+        La usa get_imagen_principal(); evita traer las 10 imágenes de cada
+        producto cuando solo se muestra una.
+        """
+        return self.prefetch_related(models.Prefetch(
+            'imagenes',
+            queryset=ImagenProducto.objects.order_by('-es_principal', 'orden', 'id')[:1],
+            to_attr='imagenes_principales',
+        ))
+
 
 class Producto(models.Model):
     # Información básica del producto
@@ -90,6 +100,9 @@ class Producto(models.Model):
 
      # Información de inventario
     stock = models.PositiveIntegerField(default=0) # Cantidad de productos disponibles
+    # Unidades retenidas por pedidos pendientes de pago (ver pedidos/reservas.py);
+    # se mantiene con UPDATE atómicos para leer lo disponible sin sumar reservas
+    reservado = models.PositiveIntegerField(default=0, editable=False)
     disponible = models.BooleanField(default=True) # Indica si el producto está disponible
      
      # Fecha en que se añadió el producto al catálogo
@@ -97,88 +110,118 @@ class Producto(models.Model):
 
      # Imagen principal del producto (se guardará en la carpeta 'productos/')
     imagen = models.ImageField(upload_to='productos/', blank=True, null=True)
+
+    objects = ProductoQuerySet.as_manager()
     
     def get_imagen_principal(self):
         """
         Devuelve la imagen principal del producto, o la primera imagen,
         o None si no hay imágenes.
+
+        Aprovecha las imágenes precargadas (con_imagen_principal() o
+        prefetch_related('imagenes')) y recuerda el resultado en la
+        instancia, ya que las plantillas llaman a varios helpers de imagen.
         """
-        # Primero intentar obtener la imagen marcada como principal
-        principal = self.imagenes.filter(es_principal=True).first()
-        if principal:
-            return principal
-            
-        # Si no hay imagen principal, devolver la primera imagen
-        return self.imagenes.first() or None
+        try:
+            return self._imagen_principal
+        except AttributeError:
+            pass
+
+        if hasattr(self, 'imagenes_principales'):
+            principal = next(iter(self.imagenes_principales), None)
+        elif 'imagenes' in getattr(self, '_prefetched_objects_cache', {}):
+            imagenes = self.imagenes.all()
+            # Primero la marcada como principal; si no hay, la primera
+            principal = (next((i for i in imagenes if i.es_principal), None)
+                         or next(iter(imagenes), None))
+        else:
+            # Sin precarga, una sola consulta con el mismo criterio
+            principal = self.imagenes.order_by('-es_principal', 'orden', 'id').first()
+
+        self._imagen_principal = principal
+        return principal
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Las imágenes precargadas se descartan; la principal recordada también
+        self.__dict__.pop('_imagen_principal', None)
         
     def get_imagen_url(self):
         """
-        Devuelve la URL de la imagen principal con un timestamp para evitar caché.
+        Devuelve la URL versionada de la imagen principal (o un placeholder).
         """
-        import time
-        timestamp = int(time.time())
-        
         # Primero intentar con las imágenes nuevas
         principal = self.get_imagen_principal()
         if principal and principal.imagen:
-            return f"{principal.imagen.url}?v={timestamp}"
+            return principal.get_imagen_url()
             
         # Luego intentar con la imagen original
         if self.imagen:
-            return f"{self.imagen.url}?v={timestamp}"
+            return url_versionada(self.imagen, self.version_imagen)
             
         # Si no hay imágenes, devolver un placeholder
         return "https://via.placeholder.com/300x200?text=Sin+imagen"
     
     def get_thumbnail_url(self):
         """
-        Devuelve la URL de la miniatura para la tabla, con un timestamp anti-caché.
+        Devuelve la URL versionada de la miniatura para la tabla.
         """
-        import time
-        timestamp = int(time.time())
-        
-        # Intentar obtener la miniatura desde la imagen principal
+        from . import imagenes
+
+        # Intentar obtener la miniatura desde la imagen principal; solo
+        # existe cuando el worker ya generó sus variantes
         principal = self.get_imagen_principal()
-        if principal and hasattr(principal, 'thumbnail_tabla'):
+        if principal and imagenes.vigentes(principal):
             try:
-                # Generar la URL con acceso a través de .url para verificar que exista
-                return f"{principal.thumbnail_tabla.url}?v={timestamp}"
+                return url_versionada(principal.thumbnail_tabla, principal.version)
             except Exception:
                 pass  # Si hay error, seguir con el siguiente método
                 
         # Si no hay miniatura específica, intentar con la imagen normal
         if principal and principal.imagen:
-            return f"{principal.imagen.url}?v={timestamp}"
+            return principal.get_imagen_url()
             
         # Si no hay imagen principal pero hay imagen en el producto
         if self.imagen:
-            return f"{self.imagen.url}?v={timestamp}"
+            return url_versionada(self.imagen, self.version_imagen)
         
         # Si no hay nada, devolver un placeholder
         return "/static/img/placeholder.png"
 
+    @property
+    def version_imagen(self):
+        """
+        Versión de la imagen original. El almacenamiento nunca sobrescribe
+        ficheros (una imagen nueva recibe otro nombre), así que basta un
+        hash corto del nombre.
+        """
+        return hashlib.md5(self.imagen.name.encode()).hexdigest()[:8]
+
+    def save(self, *args, **kwargs):
+        # `reservado` solo cambia con UPDATE atómicos; al guardar una instancia
+        # cargada antes (p. ej. desde el admin) se excluye para no pisarlo
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'reservado']
+        super().save(*args, **kwargs)
+
+    @property
+    def disponibles(self):
+        """Unidades que se pueden vender: stock menos las reservadas"""
+        return max(self.stock - self.reservado, 0)
+
     def __str__(self):
         # Representación textual del producto
         return self.nombre
     
-@receiver(post_save, sender=Producto)
-def producto_saved(sender, instance, created, **kwargs):
-        """Invalidar caché cuando se guarda un producto"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.id)
-        
-@receiver(post_delete, sender=Producto)
-def producto_deleted(sender, instance, **kwargs):
-        """Invalidar caché cuando se elimina un producto"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.id)
-        
 # En catalogo/models.py, añade este nuevo modelo
 class TallaProducto(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='tallas')
     talla = models.CharField(max_length=20)  # Puede ser "S", "M", "42", "54", etc.
     disponible = models.BooleanField(default=True)  # Indica si esta talla está disponible
     stock = models.PositiveIntegerField(default=0)  # Stock para esta talla específica
+    reservado = models.PositiveIntegerField(default=0, editable=False)  # Retenido por pedidos sin pagar
 
     class Meta:
         # Asegura que no pueda haber duplicados de talla para un mismo producto
@@ -186,20 +229,38 @@ class TallaProducto(models.Model):
         verbose_name = "Talla de producto"
         verbose_name_plural = "Tallas de productos"
 
+    def save(self, *args, **kwargs):
+        # Igual que en Producto: no pisar `reservado` con un valor desfasado
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'reservado']
+        super().save(*args, **kwargs)
+
+    @property
+    def disponibles(self):
+        return max(self.stock - self.reservado, 0)
+
     def __str__(self):
         return f"{self.producto.nombre} - Talla {self.talla}"
-    
-@receiver(post_save, sender=TallaProducto)
-def talla_producto_saved(sender, instance, created, **kwargs):
-        """Invalidar caché de producto cuando se guarda una talla"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.producto.id)
-        
-@receiver(post_delete, sender=TallaProducto)
-def talla_producto_deleted(sender, instance, **kwargs):
-        """Invalidar caché de producto cuando se elimina una talla"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.producto.id)
+
+
+class IndiceBusquedaProducto(models.Model):
+    # Documento de búsqueda precalculado (ver catalogo/search.py): texto sin
+    # acentos, en minúsculas y con raíces en español. En PostgreSQL lleva un
+    # índice GIN sobre su SearchVector; en SQLite se replica en una tabla FTS5.
+    producto = models.OneToOneField(Producto, on_delete=models.CASCADE,
+                                    primary_key=True, related_name='busqueda')
+    documento = models.TextField(blank=True, default='')
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Índice de búsqueda de producto"
+        verbose_name_plural = "Índices de búsqueda de productos"
+
+    def __str__(self):
+        return f"Índice de búsqueda de {self.producto_id}"
+
 
 
 def validate_image_size(image):
@@ -288,6 +349,9 @@ class ImagenProducto(models.Model):
     help_text="Fecha de creación de la imagen"
     )   
     ultima_modificacion = models.DateTimeField(auto_now=True)
+
+    # Variantes (perfiles, anchos y formatos) ya generadas; ver catalogo/imagenes.py
+    variantes = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['orden', '-es_principal']  # Ordenar primero por orden, luego principal
@@ -324,6 +388,17 @@ class ImagenProducto(models.Model):
         # Guardar normalmente
         super().save(*args, **kwargs)
     
+    @property
+    def version(self):
+        """Cambia cada vez que se guarda la imagen (y con ella sus miniaturas)"""
+        if self.ultima_modificacion is None:
+            return '0'
+        return format(int(self.ultima_modificacion.timestamp() * 1000), 'x')
+
+    def get_imagen_url(self):
+        """URL versionada de la imagen, cacheable indefinidamente"""
+        return url_versionada(self.imagen, self.version)
+
     def get_thumbnail_url(self):
         """Método auxiliar para obtener la URL de la miniatura"""
         return self.thumbnail.url if hasattr(self, 'thumbnail') else self.imagen.url
@@ -332,15 +407,4 @@ class ImagenProducto(models.Model):
         """Método auxiliar para obtener la URL de la imagen de carrusel"""
         return self.carrusel.url if hasattr(self, 'carrusel') else self.imagen.url
     
-@receiver(post_save, sender=ImagenProducto)
-def imagen_producto_saved(sender, instance, created, **kwargs):
-        """Invalidar caché de producto cuando se guarda una imagen"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.producto.id)
-        
-@receiver(post_delete, sender=ImagenProducto)
-def imagen_producto_deleted(sender, instance, **kwargs):
-        """Invalidar caché de producto cuando se elimina una imagen"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('producto', instance.producto.id)
 
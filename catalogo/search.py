@@ -0,0 +1,242 @@
+"""
+Índice de búsqueda de texto completo para el catálogo.
+
+Cada Producto tiene un documento de búsqueda precalculado (IndiceBusquedaProducto)
+con su texto normalizado: sin acentos, en minúsculas y con raíces en español.
+El documento se indexa con SearchVector/GIN en PostgreSQL y con una tabla
+virtual FTS5 en SQLite; en cualquier otro motor se usa un filtro por contenido.
+"""
+import logging
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, IntegerField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+logger = logging.getLogger('mototienda.performance')
+
+# Configuración de texto de PostgreSQL: el documento ya viene normalizado
+# y con raíces, así que no debe aplicarse otro diccionario encima
+SEARCH_CONFIG = 'simple'
+
+# Tabla virtual FTS5 usada en SQLite (rowid = id del producto)
+FTS_TABLE = 'catalogo_busqueda_fts'
+
+# Palabras vacías que no aportan a la búsqueda
+STOPWORDS = frozenset("""
+    a al con de del el en es la las lo los o para por que se sin su sus un una
+    unos unas y e u muy mas
+""".split())
+
+# Sufijos del español ordenados de más largo a más corto
+SUFIJOS = (
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones',
+    'adoras', 'adores', 'ancias', 'encias', 'idades', 'mente', 'acion',
+    'ucion', 'adora', 'ador', 'ancia', 'encia', 'idad', 'ismos', 'istas',
+    'ismo', 'ista', 'ables', 'ibles', 'able', 'ible', 'ivas', 'ivos',
+    'iva', 'ivo', 'osas', 'osos', 'osa', 'oso', 'ando', 'iendo', 'adas',
+    'ados', 'idas', 'idos', 'ada', 'ado', 'ida', 'ido', 'es', 's',
+)
+
+
+def normalizar(texto):
+    """
+    Quita acentos y HTML, pasa a minúsculas y devuelve la lista de palabras.
+    """
+    if not texto:
+        return []
+    texto = strip_tags(texto)
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.findall(r'[a-z0-9]+', texto.lower())
+
+
+def raiz(palabra):
+    """
+    Devuelve la raíz aproximada de una palabra en español (stemmer ligero).
+
+    Se aplica igual a documentos y consultas, de modo que "cascos", "casco"
+    y "Cascós" comparten la raíz "casc".
+    """
+    if len(palabra) <= 3 or palabra.isdigit():
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            palabra = palabra[:-len(sufijo)]
+            break
+    # Vocal final (casco -> casc, chaqueta -> chaquet)
+    if len(palabra) > 3 and palabra[-1] in 'aeo':
+        palabra = palabra[:-1]
+    return palabra
+
+
+def terminos(texto):
+    """Normaliza un texto y devuelve sus raíces sin palabras vacías"""
+    return [raiz(p) for p in normalizar(texto) if p not in STOPWORDS]
+
+
+def construir_documento(nombre, descripcion='', categoria='', marca=''):
+    """
+    Construye el documento de búsqueda de un producto.
+
+    El nombre se repite para que pese más en el ranking que la descripción.
+    """
+    partes = [
+        terminos(nombre) * 2,
+        terminos(marca),
+        terminos(categoria),
+        terminos(descripcion),
+    ]
+    return ' '.join(t for parte in partes for t in parte)
+
+
+def documento_producto(producto):
+    """Documento de búsqueda de una instancia de Producto"""
+    return construir_documento(
+        producto.nombre,
+        producto.descripcion,
+        producto.categoria.nombre if producto.categoria_id else '',
+        producto.marca.nombre if producto.marca_id else '',
+    )
+
+
+# === Mantenimiento del índice ===
+
+def _fts_disponible():
+    return connection.vendor == 'sqlite'
+
+
+def _escribir_fts(filas):
+    """Sustituye en la tabla FTS5 los documentos de los productos indicados"""
+    if not filas or not _fts_disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(producto_id,) for producto_id, _ in filas]
+        )
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, documento) VALUES (%s, %s)',
+            filas
+        )
+
+
+def indexar_productos(productos):
+    """
+    Recalcula y guarda el documento de búsqueda de varios productos.
+
+    Args:
+        productos: Iterable de Producto (idealmente con select_related
+            de categoria y marca)
+
+    Returns:
+        int: Número de productos indexados
+    """
+    from .models import IndiceBusquedaProducto
+
+    filas = [(producto.id, documento_producto(producto)) for producto in productos]
+    if not filas:
+        return 0
+
+    with transaction.atomic():
+        IndiceBusquedaProducto.objects.bulk_create(
+            [IndiceBusquedaProducto(producto_id=pk, documento=doc) for pk, doc in filas],
+            update_conflicts=True,
+            unique_fields=['producto'],
+            update_fields=['documento'],
+        )
+        _escribir_fts(filas)
+    return len(filas)
+
+
+def indexar_producto(producto):
+    """Recalcula el documento de búsqueda de un producto"""
+    return indexar_productos([producto])
+
+
+def reindexar(queryset):
+    """
+    Reindexa los productos de un queryset en lotes.
+
+    Returns:
+        int: Número de productos indexados
+    """
+    total = 0
+    lote = []
+    for producto in queryset.select_related('categoria', 'marca').iterator(chunk_size=500):
+        lote.append(producto)
+        if len(lote) >= 500:
+            total += indexar_productos(lote)
+            lote = []
+    total += indexar_productos(lote)
+    return total
+
+
+def eliminar_del_indice(producto_id):
+    """Elimina un producto de la tabla FTS5 (el índice ORM se borra en cascada)"""
+    if _fts_disponible():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [producto_id])
+
+
+# === Consultas ===
+
+def _consulta_fts(raices):
+    """Expresión MATCH de FTS5 con coincidencia por prefijo en cada término"""
+    return ' '.join(f'"{r}"*' for r in raices)
+
+
+def _consulta_tsquery(raices):
+    """Expresión to_tsquery de PostgreSQL con coincidencia por prefijo"""
+    return ' & '.join(f'{r}:*' for r in raices)
+
+
+def buscar_productos(queryset, texto):
+    """
+    Filtra un queryset de Producto por texto completo y lo anota con
+    `relevancia` (mayor es mejor).
+
+    La coincidencia es por prefijo en cada término, de modo que sirve para
+    búsquedas mientras se escribe ("cas" encuentra "Casco integral").
+
+    Args:
+        queryset: QuerySet de Producto
+        texto (str): Texto introducido por el usuario
+
+    Returns:
+        QuerySet filtrado y anotado; ordenar por '-relevancia' para el ranking
+    """
+    raices = terminos(texto)
+    if not raices:
+        return queryset.annotate(relevancia=Value(0, output_field=IntegerField()))
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        consulta = SearchQuery(_consulta_tsquery(raices), search_type='raw', config=SEARCH_CONFIG)
+        return (queryset
+                .annotate(vector_busqueda=SearchVector('busqueda__documento', config=SEARCH_CONFIG))
+                .filter(vector_busqueda=consulta)
+                .annotate(relevancia=SearchRank(F('vector_busqueda'), consulta)))
+
+    if _fts_disponible():
+        consulta = _consulta_fts(raices)
+        tabla = queryset.model._meta.db_table
+        # Sin límite de resultados: el filtro y la relevancia son subconsultas
+        # sobre la tabla FTS5, así que el recuento, las facetas y todas las
+        # páginas ven todas las coincidencias. bm25() es menor cuanto más
+        # relevante, de ahí el signo
+        return (queryset
+                .filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [consulta]))
+                .annotate(relevancia=RawSQL(
+                    f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+                    f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = "{tabla}"."id"',
+                    [consulta], output_field=FloatField(),
+                )))
+
+    # Otros motores: coincidencia por contenido sobre el documento normalizado
+    for r in raices:
+        queryset = queryset.filter(busqueda__documento__contains=r)
+    return queryset.annotate(relevancia=Value(0, output_field=IntegerField()))
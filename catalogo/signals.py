@@ -2,12 +2,18 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import Categoria, Marca, Producto, TallaProducto, ImagenProducto
 from utils.cache_utils import invalidate_model_cache
+from . import imagenes, search
 
 # Signals para Categoria
 @receiver(post_save, sender=Categoria)
 def categoria_saved(sender, instance, created, **kwargs):
     """Invalidar caché cuando se guarda una categoría"""
     invalidate_model_cache('categoria', instance.id)
+    if not created and instance.tracker.has_changed('nombre'):
+        # El nombre de la categoría forma parte del documento de búsqueda; sus
+        # productos se reindexan en segundo plano
+        from .tareas import reindexar_productos
+        reindexar_productos.encolar(categoria_id=instance.id)
     
 @receiver(post_delete, sender=Categoria)
 def categoria_deleted(sender, instance, **kwargs):
@@ -19,6 +25,11 @@ def categoria_deleted(sender, instance, **kwargs):
 def marca_saved(sender, instance, created, **kwargs):
     """Invalidar caché cuando se guarda una marca"""
     invalidate_model_cache('marca', instance.id)
+    if not created and instance.tracker.has_changed('nombre'):
+        # El nombre de la marca forma parte del documento de búsqueda; sus
+        # productos se reindexan en segundo plano
+        from .tareas import reindexar_productos
+        reindexar_productos.encolar(marca_id=instance.id)
     
 @receiver(post_delete, sender=Marca)
 def marca_deleted(sender, instance, **kwargs):
@@ -28,32 +39,37 @@ def marca_deleted(sender, instance, **kwargs):
 # Signals para Producto
 @receiver(post_save, sender=Producto)
 def producto_saved(sender, instance, created, **kwargs):
-    """Invalidar caché cuando se guarda un producto"""
+    """Invalidar caché y reindexar la búsqueda cuando se guarda un producto"""
     invalidate_model_cache('producto', instance.id)
+    search.indexar_producto(instance)
     
 @receiver(post_delete, sender=Producto)
 def producto_deleted(sender, instance, **kwargs):
-    """Invalidar caché cuando se elimina un producto"""
+    """Invalidar caché y sacar el producto del índice cuando se elimina"""
     invalidate_model_cache('producto', instance.id)
+    search.eliminar_del_indice(instance.id)
 
 # Signals para TallaProducto
 @receiver(post_save, sender=TallaProducto)
 def talla_producto_saved(sender, instance, created, **kwargs):
     """Invalidar caché de producto cuando se guarda una talla"""
-    invalidate_model_cache('producto', instance.producto.id)
+    invalidate_model_cache('producto', instance.producto_id)
     
 @receiver(post_delete, sender=TallaProducto)
 def talla_producto_deleted(sender, instance, **kwargs):
     """Invalidar caché de producto cuando se elimina una talla"""
-    invalidate_model_cache('producto', instance.producto.id)
+    invalidate_model_cache('producto', instance.producto_id)
 
 # Signals para ImagenProducto
 @receiver(post_save, sender=ImagenProducto)
 def imagen_producto_saved(sender, instance, created, **kwargs):
-    """Invalidar caché de producto cuando se guarda una imagen"""
-    invalidate_model_cache('producto', instance.producto.id)
+    """Invalidar caché de producto y encolar sus variantes si la imagen es nueva"""
+    invalidate_model_cache('producto', instance.producto_id)
+    if instance.imagen and imagenes.vigentes(instance) is None:
+        from .tareas import generar_variantes_imagen
+        generar_variantes_imagen.encolar(instance.id)
     
 @receiver(post_delete, sender=ImagenProducto)
 def imagen_producto_deleted(sender, instance, **kwargs):
     """Invalidar caché de producto cuando se elimina una imagen"""
-    invalidate_model_cache('producto', instance.producto.id)
\ No newline at end of file
+    invalidate_model_cache('producto', instance.producto_id)
\ No newline at end of file
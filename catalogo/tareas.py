@@ -0,0 +1,23 @@
+"""
+Tareas en segundo plano del catálogo (ver tareas/cola.py).
+"""
+from tareas.cola import tarea
+from . import imagenes, search
+from .models import Producto
+
+
+@tarea(max_intentos=3)
+def generar_variantes_imagen(imagen_id):
+    """Genera las miniaturas y variantes de una imagen recién subida"""
+    imagenes.generar_variantes(imagen_id)
+
+
+@tarea(max_intentos=3)
+def reindexar_productos(categoria_id=None, marca_id=None):
+    """Reindexa la búsqueda de los productos de una categoría o marca renombrada"""
+    productos = Producto.objects.all()
+    if categoria_id:
+        productos = productos.filter(categoria_id=categoria_id)
+    if marca_id:
+        productos = productos.filter(marca_id=marca_id)
+    search.reindexar(productos)
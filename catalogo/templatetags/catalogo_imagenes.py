@@ -0,0 +1,59 @@
+"""
+Etiquetas para servir las imágenes de producto con <picture>/srcset.
+
+    {% load catalogo_imagenes %}
+    {% imagen_responsive producto 'tarjeta' sizes='(max-width: 768px) 100vw, 300px' class='card-img-top' %}
+
+Acepta un Producto (usa su imagen principal) o una ImagenProducto. Emite una
+<source> por formato (AVIF, WebP) con todos los anchos generados y un <img>
+JPEG de respaldo; el navegador elige el primer formato que acepta y el ancho
+adecuado a `sizes` y a la densidad de la pantalla. Si las variantes aún no
+existen se emite un <img> con la imagen original.
+"""
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from catalogo import imagenes
+from catalogo.models import Producto
+
+register = template.Library()
+
+
+def _atributos(atributos):
+    return format_html_join('', ' {}="{}"', atributos.items())
+
+
+@register.simple_tag
+def imagen_responsive(objeto, perfil, sizes=None, **atributos):
+    """
+    Args:
+        objeto: Producto o ImagenProducto
+        perfil (str): Perfil de catalogo.imagenes.PERFILES
+        sizes (str, optional): Ancho que ocupará la imagen en la página; por
+            defecto, el ancho a 1x del perfil
+        **atributos: Atributos HTML del <img> (class, alt, style, loading...)
+    """
+    imagen = objeto.get_imagen_principal() if isinstance(objeto, Producto) else objeto
+    atributos.setdefault('alt', '')
+    variantes = imagenes.vigentes(imagen) if imagen else None
+
+    if variantes is None:
+        src = imagen.get_imagen_url() if imagen else objeto.get_imagen_url()
+        return format_html('<img src="{}"{}>', src, _atributos(atributos))
+
+    anchos = variantes['anchos'].get(perfil) or imagenes.PERFILES[perfil]['anchos'][:1]
+    sizes = sizes or f"{imagenes.PERFILES[perfil]['tamano'][0]}px"
+
+    def srcset(formato):
+        return ', '.join(f'{imagenes.url(imagen, perfil, ancho, formato)} {ancho}w' for ancho in anchos)
+
+    fuentes = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((imagenes.TIPOS_MIME[formato], srcset(formato), sizes)
+         for formato in variantes['formatos'] if formato != 'jpeg'),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        fuentes, imagenes.url(imagen, perfil, anchos[0], 'jpeg'), srcset('jpeg'), sizes,
+        _atributos(atributos),
+    )
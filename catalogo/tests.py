@@ -1,4 +1,7 @@
-from django.test import TestCase, Client
+from datetime import timedelta
+
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from catalogo.models import Categoria, Marca, Producto, TallaProducto, ImagenProducto
@@ -72,6 +75,68 @@ class ProductoModelTest(TestCase):
         # Test para el método get_imagen_url cuando no hay imagen
         self.assertTrue("placeholder" in self.producto.get_imagen_url())
 
+
+class ImagenPrincipalTest(TestCase):
+    """
+    Tests para la resolución de la imagen principal sin consultas por producto
+    """
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre="Cascos")
+        marca = Marca.objects.create(nombre="Shoei")
+        productos = Producto.objects.bulk_create([
+            Producto(nombre=f"Casco {i}", descripcion="Casco", precio=100,
+                     categoria=categoria, marca=marca)
+            for i in range(50)
+        ])
+        # bulk_create no pasa por ImagenProducto.save ni procesa los ficheros
+        imagenes = []
+        for producto in productos:
+            imagenes.append(ImagenProducto(producto=producto, orden=0,
+                                           imagen=f'productos/imagenes/{producto.id}-a.jpg'))
+            imagenes.append(ImagenProducto(producto=producto, orden=1, es_principal=True,
+                                           imagen=f'productos/imagenes/{producto.id}-b.jpg'))
+        ImagenProducto.objects.bulk_create(imagenes)
+
+    def test_listado_con_imagen_principal_consultas_constantes(self):
+        with self.assertNumQueries(2):
+            productos = list(Producto.objects.con_imagen_principal())
+            for producto in productos:
+                self.assertIn(f'{producto.id}-b.jpg', producto.get_imagen_url())
+                producto.get_thumbnail_url()
+        self.assertEqual(len(productos), 50)
+
+    def test_usa_imagenes_precargadas(self):
+        with self.assertNumQueries(2):
+            for producto in Producto.objects.prefetch_related('imagenes'):
+                self.assertIn(f'{producto.id}-b.jpg', producto.get_imagen_url())
+
+    def test_sin_precarga_una_consulta_memorizada(self):
+        producto = Producto.objects.first()
+        with self.assertNumQueries(1):
+            principal = producto.get_imagen_principal()
+            producto.get_imagen_url()
+            producto.get_thumbnail_url()
+        self.assertTrue(principal.es_principal)
+
+    def test_url_versionada_estable(self):
+        producto = Producto.objects.con_imagen_principal().first()
+        url = producto.get_imagen_url()
+        self.assertRegex(url, r'-b\.jpg\?v=[0-9a-f]+$')
+        self.assertEqual(Producto.objects.get(id=producto.id).get_imagen_url(), url)
+
+        # Al reemplazar la imagen cambia la versión
+        principal = producto.get_imagen_principal()
+        principal.ultima_modificacion = principal.ultima_modificacion - timedelta(minutes=1)
+        self.assertNotEqual(principal.get_imagen_url(), url)
+
+    def test_sin_principal_marcada_usa_la_primera(self):
+        producto = Producto.objects.first()
+        producto.imagenes.update(es_principal=False)
+        esperado = f'{producto.id}-a.jpg'
+        self.assertIn(esperado, producto.get_imagen_principal().imagen.name)
+        self.assertIn(esperado, Producto.objects.con_imagen_principal()
+                      .get(id=producto.id).get_imagen_principal().imagen.name)
+
 class CatalogoViewsTest(TestCase):
     """
     Tests para las vistas de la aplicación catalogo
@@ -197,4 +262,562 @@ class CatalogoViewsTestAvanzado(TestCase):
         response = self.client.get(url, filtros)
         
         self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, 'catalogo/lista_productos.html')
\ No newline at end of file
+        self.assertTemplateUsed(response, 'catalogo/lista_productos.html')
+
+class CacheEtiquetasTest(TestCase):
+    """Tests para la invalidación de caché por etiquetas"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.categoria = Categoria.objects.create(nombre='Cascos')
+        self.marca = Marca.objects.create(nombre='Shoei')
+        self.producto = Producto.objects.create(
+            nombre='GT-Air',
+            descripcion='Casco integral',
+            precio=450,
+            categoria=self.categoria,
+            marca=self.marca,
+            stock=5
+        )
+
+    def test_get_tagged_devuelve_valor_guardado(self):
+        from utils.cache_utils import get_tagged, set_tagged
+        set_tagged('productos_prueba', [1, 2, 3], ['productos'])
+        self.assertEqual(get_tagged('productos_prueba'), [1, 2, 3])
+
+    def test_guardar_producto_invalida_etiquetas(self):
+        from utils.cache_utils import get_tagged, set_tagged
+        set_tagged('productos_prueba', 'valor', ['productos'])
+        set_tagged('producto_prueba', 'valor', [f'producto:{self.producto.id}'])
+        set_tagged('otra_marca', 'valor', ['marca:999'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.precio = 400
+            self.producto.save()
+
+        self.assertIsNone(get_tagged('productos_prueba'))
+        self.assertIsNone(get_tagged('producto_prueba'))
+        # Las entradas con etiquetas no relacionadas siguen siendo válidas
+        self.assertEqual(get_tagged('otra_marca'), 'valor')
+
+    def test_guardar_talla_invalida_producto(self):
+        from utils.cache_utils import get_tagged, set_tagged
+        set_tagged('producto_prueba', 'valor', [f'producto:{self.producto.id}'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TallaProducto.objects.create(producto=self.producto, talla='M', stock=2)
+
+        self.assertIsNone(get_tagged('producto_prueba'))
+
+    def test_guardar_categoria_elimina_clave_exacta(self):
+        from django.core.cache import cache
+        cache.set('todas_categorias', ['Cascos'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.categoria.save()
+
+        self.assertIsNone(cache.get('todas_categorias'))
+
+    def test_version_perdida_no_revive_entradas(self):
+        from django.core.cache import cache
+        from utils.cache_utils import get_tagged, set_tagged, TAG_VERSION_PREFIX
+        set_tagged('productos_prueba', 'valor', ['productos'])
+
+        # Simular el desalojo de la versión de la etiqueta
+        cache.delete(f'{TAG_VERSION_PREFIX}productos')
+
+        self.assertIsNone(get_tagged('productos_prueba'))
+
+    def test_invalidaciones_se_agrupan_en_la_transaccion(self):
+        from unittest import mock
+        from utils import cache_utils
+
+        with mock.patch.object(cache_utils, 'invalidate_tags',
+                               wraps=cache_utils.invalidate_tags) as invalidate_tags:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.producto.save()
+                for i in range(10):
+                    TallaProducto.objects.create(producto=self.producto, talla=f'T{i}')
+                # Nada se invalida antes de confirmar la transacción
+                self.assertEqual(invalidate_tags.call_count, 0)
+
+        # Producto y tallas comparten (producto, id): un único vaciado
+        self.assertEqual(invalidate_tags.call_count, 1)
+
+    def test_invalidation_batch_fuera_de_transaccion(self):
+        from unittest import mock
+        from utils import cache_utils
+
+        with mock.patch.object(cache_utils, 'transaction') as transaction_mock, \
+             mock.patch.object(cache_utils, 'invalidate_tags') as invalidate_tags:
+            transaction_mock.get_connection.return_value.in_atomic_block = False
+            with cache_utils.invalidation_batch():
+                cache_utils.invalidate_model_cache('producto', self.producto.id)
+                cache_utils.invalidate_model_cache('producto', self.producto.id)
+                cache_utils.invalidate_model_cache('marca', self.marca.id)
+                self.assertEqual(invalidate_tags.call_count, 0)
+
+        invalidate_tags.assert_called_once()
+
+
+class BusquedaProductosTest(TestCase):
+    """
+    Tests para el índice de búsqueda de texto completo
+    """
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nombre="Cascos")
+        self.marca = Marca.objects.create(nombre="Shoei")
+        self.integral = Producto.objects.create(
+            nombre="Casco Integral Carbono", descripcion="<p>Protección máxima</p>",
+            precio=450.00, categoria=self.categoria, marca=self.marca
+        )
+        self.chaqueta = Producto.objects.create(
+            nombre="Chaqueta de cuero", descripcion="Chaqueta con protecciones",
+            precio=300.00, categoria=Categoria.objects.create(nombre="Ropa"),
+            marca=Marca.objects.create(nombre="Dainese")
+        )
+
+    def _buscar(self, texto):
+        from catalogo.search import buscar_productos
+        return list(buscar_productos(Producto.objects.all(), texto).order_by('-relevancia'))
+
+    def test_normalizacion_y_raices(self):
+        from catalogo.search import terminos
+        self.assertEqual(terminos("Cascos"), terminos("casco"))
+        self.assertEqual(terminos("PROTECCIÓN"), terminos("proteccion"))
+        self.assertEqual(terminos("<b>de</b> la"), [])
+
+    def test_busqueda_por_prefijo_y_acentos(self):
+        self.assertEqual(self._buscar("cas"), [self.integral])
+        self.assertEqual(self._buscar("carbóno"), [self.integral])
+        self.assertEqual(self._buscar("cascos shoei"), [self.integral])
+        self.assertEqual(self._buscar("dainese integral"), [])
+
+    def test_relevancia_prioriza_nombre(self):
+        # "protec" aparece en ambas descripciones; "chaqueta" sólo en un nombre
+        self.assertEqual(set(self._buscar("protec")), {self.integral, self.chaqueta})
+        self.assertEqual(self._buscar("chaquetas")[0], self.chaqueta)
+
+    def test_reindexado_incremental(self):
+        self.integral.nombre = "Casco Modular"
+        self.integral.save()
+        self.assertEqual(self._buscar("modular"), [self.integral])
+        self.assertEqual(self._buscar("carbono"), [])
+
+        # Renombrar la marca reindexa sus productos (en la cola, al confirmar)
+        from unittest import mock
+        from catalogo.tareas import reindexar_productos
+        with mock.patch.object(reindexar_productos, 'encolar') as encolar:
+            self.marca.descripcion = "Cascos japoneses"
+            self.marca.save()
+        encolar.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marca.nombre = "Arai"
+            self.marca.save()
+        self.assertEqual(self._buscar("arai"), [self.integral])
+
+        producto_id = self.chaqueta.id
+        self.chaqueta.delete()
+        self.assertEqual(self._buscar("chaqueta"), [])
+        self.assertFalse(Producto.objects.filter(id=producto_id).exists())
+
+    def test_busqueda_amplia_no_se_trunca(self):
+        Producto.objects.bulk_create([
+            Producto(nombre=f"Casco jet {i}", descripcion="Casco abierto", precio=90,
+                     categoria=self.categoria, marca=self.marca)
+            for i in range(600)
+        ])
+        from catalogo.search import reindexar
+        reindexar(Producto.objects.all())
+
+        resultados = self._buscar("casco")
+        self.assertEqual(len(resultados), 601)
+        # Antes se cortaba en 500 resultados
+        self.assertEqual(len(self._buscar("casco jet")), 600)
+
+    def test_lista_productos_usa_indice(self):
+        response = Client().get(reverse('catalogo:lista_productos'), {'nombre': 'chaq'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['productos']), [self.chaqueta])
+
+
+class FacetasCatalogoTest(TestCase):
+    """
+    Tests para los recuentos de facetas del catálogo
+    """
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.cascos = Categoria.objects.create(nombre="Cascos")
+        self.ropa = Categoria.objects.create(nombre="Ropa")
+        self.honda = Marca.objects.create(nombre="Honda")
+        self.shoei = Marca.objects.create(nombre="Shoei")
+        self.casco = Producto.objects.create(
+            nombre="Casco", descripcion="Casco", precio=80,
+            categoria=self.cascos, marca=self.shoei
+        )
+        self.chaqueta = Producto.objects.create(
+            nombre="Chaqueta", descripcion="Chaqueta", precio=300,
+            categoria=self.ropa, marca=self.honda
+        )
+        self.guantes = Producto.objects.create(
+            nombre="Guantes", descripcion="Guantes", precio=40,
+            categoria=self.ropa, marca=self.honda
+        )
+        for talla in ('M', 'L'):
+            TallaProducto.objects.create(producto=self.chaqueta, talla=talla)
+            TallaProducto.objects.create(producto=self.guantes, talla=talla)
+        TallaProducto.objects.create(producto=self.casco, talla='M')
+
+    def _facetas(self, **params):
+        from django.http import QueryDict
+        from catalogo.facets import calcular_facetas, filtros_desde_request
+        query = QueryDict(mutable=True)
+        for clave, valor in params.items():
+            query.setlist(clave, valor if isinstance(valor, list) else [valor])
+        return calcular_facetas(filtros_desde_request(query))
+
+    def test_recuentos_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            facetas = self._facetas()
+        self.assertEqual(facetas['categorias'], {str(self.cascos.id): 1, str(self.ropa.id): 2})
+        self.assertEqual(facetas['marcas'], {str(self.shoei.id): 1, str(self.honda.id): 2})
+        # Cada producto cuenta una vez por talla aunque tenga varias
+        self.assertEqual(facetas['tallas'], {'M': 3, 'L': 2})
+        self.assertEqual(facetas['precios'], {'0': 1, '1': 1, '3': 1})
+
+    def test_facetas_disyuntivas(self):
+        facetas = self._facetas(marca=str(self.honda.id))
+        # La faceta de marca ignora su propio filtro; el resto lo aplica
+        self.assertEqual(facetas['marcas'], {str(self.shoei.id): 1, str(self.honda.id): 2})
+        self.assertEqual(facetas['categorias'], {str(self.ropa.id): 2})
+        self.assertEqual(facetas['tallas'], {'M': 2, 'L': 2})
+
+    def test_recuentos_cacheados_e_invalidados(self):
+        self._facetas(talla='L')
+        with self.assertNumQueries(0):
+            self._facetas(talla='L')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TallaProducto.objects.create(producto=self.casco, talla='L')
+        self.assertEqual(self._facetas(talla='L')['categorias'],
+                         {str(self.cascos.id): 1, str(self.ropa.id): 2})
+
+    def test_lista_productos_muestra_recuentos(self):
+        response = Client().get(reverse('catalogo:lista_productos'), {'talla': 'L'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.context['productos']), {self.chaqueta, self.guantes})
+        self.assertContains(response, 'Honda <span class="text-muted">(2)</span>')
+
+    def test_total_exacto_con_filtros(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        # Estimación muy desviada, como la del planificador con búsqueda
+        with mock.patch('utils.pagination.estimar_total', return_value=999):
+            pagina = Client().get(reverse('catalogo:lista_productos'), {'talla': 'L'}).context['productos']
+            self.assertEqual((pagina.paginator.count, pagina.paginator.estimado), (2, False))
+            pagina = Client().get(reverse('catalogo:lista_productos')).context['productos']
+            self.assertTrue(pagina.paginator.estimado)
+
+            User.objects.create_superuser(username='admin', password='adminpass', email='a@example.com')
+            admin = Client()
+            admin.login(username='admin', password='adminpass')
+            url = reverse('catalogo:admin_productos_data')
+            datos = admin.post(url, {'draw': 1, 'start': 0, 'length': 10, 'marca_id': self.honda.id}).json()
+            self.assertEqual((datos['recordsTotal'], datos['recordsFiltered']), (3, 2))
+            datos = admin.post(url, {'draw': 1, 'start': 0, 'length': 10}).json()
+            self.assertEqual(datos['recordsFiltered'], 3)
+
+    def test_lista_productos_paginada_por_cursor(self):
+        for i in range(7):
+            Producto.objects.create(
+                nombre=f"Producto {i}", descripcion="Extra", precio=10,
+                categoria=self.ropa, marca=self.honda
+            )
+        response = Client().get(reverse('catalogo:lista_productos'))
+        pagina = response.context['productos']
+        self.assertEqual(len(pagina), 6)
+        self.assertTrue(pagina.has_next)
+
+        siguiente = Client().get(reverse('catalogo:lista_productos'), {'cursor': pagina.next_cursor})
+        ids = [p.id for p in pagina] + [p.id for p in siguiente.context['productos']]
+        self.assertEqual(ids, list(Producto.objects.order_by('-id').values_list('id', flat=True)))
+
+
+class MediaCacheControlTest(TestCase):
+    """
+    Tests para las cabeceras de caché de los ficheros de media
+    """
+    def _respuesta(self, url):
+        from core.middleware import MediaCacheControlMiddleware
+        middleware = MediaCacheControlMiddleware(lambda request: HttpResponse('imagen'))
+        return middleware(RequestFactory().get(url))
+
+    def test_media_versionada_inmutable(self):
+        response = self._respuesta('/media/productos/imagenes/casco.jpg?v=18c5a')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_media_sin_version(self):
+        response = self._respuesta('/media/productos/imagenes/casco.jpg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    def test_otras_rutas_sin_cambios(self):
+        self.assertFalse(self._respuesta('/catalogo/?v=1').has_header('Cache-Control'))
+
+
+class VariantesImagenTest(TestCase):
+    """
+    Tests para la generación de variantes de imagen en segundo plano
+    """
+    def setUp(self):
+        import tempfile
+        from django.core.cache import cache
+        # imagekit recuerda en la caché qué miniaturas existen
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        categoria = Categoria.objects.create(nombre="Cascos")
+        marca = Marca.objects.create(nombre="Shoei")
+        self.producto = Producto.objects.create(nombre="Casco", descripcion="Casco", precio=100,
+                                                categoria=categoria, marca=marca)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _subir(self, nombre='casco.png'):
+        import io
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        contenido = io.BytesIO()
+        Image.new('RGB', (750, 1000), (200, 30, 30)).save(contenido, format='PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return ImagenProducto.objects.create(
+                producto=self.producto,
+                imagen=SimpleUploadedFile(nombre, contenido.getvalue(), content_type='image/png'),
+            )
+
+    def test_variantes_generadas_al_subir(self):
+        from django.core.files.storage import default_storage
+        from catalogo import imagenes
+
+        imagen = self._subir()
+        imagen.refresh_from_db()
+        variantes = imagenes.vigentes(imagen)
+        self.assertIsNotNone(variantes)
+        self.assertIn('webp', variantes['formatos'])
+        # El original queda en 900x1200 y no se amplía: el carrusel no llega a 1200
+        self.assertEqual(variantes['anchos']['carrusel'], [400, 800])
+        for formato in variantes['formatos']:
+            self.assertTrue(default_storage.exists(
+                imagenes.ruta(imagen.id, imagen.imagen.name, 'carrusel', 800, formato)))
+        self.assertTrue(default_storage.exists(imagen.thumbnail_tabla.name))
+
+    def test_picture_con_srcset(self):
+        from django.template import Context, Template
+
+        imagen = self._subir()
+        plantilla = Template("{% load catalogo_imagenes %}{% imagen_responsive producto 'tarjeta' class='card-img-top' alt=producto.nombre %}")
+        html = plantilla.render(Context({'producto': Producto.objects.get(id=self.producto.id)}))
+        self.assertIn('<picture><source type="image/webp"', html)
+        self.assertIn('tarjeta-300.webp?v=', html)
+        self.assertIn('tarjeta-600.jpg?v=', html)
+        self.assertIn(' 600w', html)
+        self.assertIn('class="card-img-top" alt="Casco"></picture>', html)
+
+        # Sin variantes todavía: la imagen original, sin redimensionar en la petición
+        ImagenProducto.objects.filter(id=imagen.id).update(variantes={})
+        html = plantilla.render(Context({'producto': Producto.objects.get(id=self.producto.id)}))
+        self.assertNotIn('<picture>', html)
+        self.assertIn(imagen.imagen.url, html)
+
+    def test_comando_rellena_variantes_pendientes(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from catalogo import imagenes
+
+        imagen = self._subir()
+        ImagenProducto.objects.filter(id=imagen.id).update(variantes={})
+        salida = StringIO()
+        call_command('generar_variantes', '--procesos', '1', stdout=salida)
+        self.assertIn('1 imágenes procesadas', salida.getvalue())
+        self.assertIsNotNone(imagenes.vigentes(ImagenProducto.objects.get(id=imagen.id)))
+
+        salida = StringIO()
+        call_command('generar_variantes', '--procesos', '1', stdout=salida)
+        self.assertIn('Todas las imágenes tienen sus variantes', salida.getvalue())
+
+
+class PrecalentamientoCacheTest(TestCase):
+    """Tests para el registro de entradas de caché y el comando precache"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.categoria = Categoria.objects.create(nombre='Cascos')
+        self.marca = Marca.objects.create(nombre='Shoei')
+        self.productos = [
+            Producto.objects.create(
+                nombre=f'Casco {i}', descripcion='Casco integral', precio=400 + i,
+                categoria=self.categoria, marca=self.marca, stock=10 - i
+            )
+            for i in range(3)
+        ]
+
+    def test_dependencias_antes_que_dependientes(self):
+        from utils.cache_warming import warm_order
+
+        etapas = [[entrada.name for entrada in etapa]
+                  for etapa in warm_order(['productos_relacionados'])]
+        self.assertEqual(etapas, [['productos_populares'], ['productos_relacionados']])
+
+    def test_dependencias_circulares(self):
+        from unittest import mock
+        from utils import cache_warming
+
+        with mock.patch.dict(cache_warming._registry, clear=True):
+            cache_warming.warmable('a', depends_on=['b'])(lambda: 1)
+            cache_warming.warmable('b', depends_on=['a'])(lambda: 2)
+            with self.assertRaises(ValueError):
+                cache_warming.warm_order()
+            with self.assertRaises(ValueError):
+                cache_warming.warmable('a')(lambda: 3)
+
+    def test_get_usa_el_valor_calentado(self):
+        from catalogo import caches
+
+        caches.productos_relacionados.warm(self.productos[0].id, self.categoria.id)
+        with self.assertNumQueries(0):
+            relacionados = caches.productos_relacionados.get(self.productos[0].id, self.categoria.id)
+        self.assertEqual(len(relacionados), 2)
+
+        # Cambiar un producto invalida la entrada por sus etiquetas
+        with self.captureOnCommitCallbacks(execute=True):
+            self.productos[1].save()
+        with self.assertNumQueries(1):
+            caches.productos_relacionados.get(self.productos[0].id, self.categoria.id)
+
+    def test_comando_calienta_entradas_y_paginas(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        from catalogo import caches
+
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            linea = '1.2.3.4 - - [18/Oct/2026:10:00:00 +0000] "GET {} HTTP/1.1" {} 512 "-" "Mozilla"\n'
+            log.write(linea.format('/catalogo/productos/', 200) * 3)
+            log.write(linea.format('/static/css/main.css', 200) * 5)
+            log.write(linea.format('/no-existe/', 404) * 5)
+        self.addCleanup(os.remove, log.name)
+
+        salida = StringIO()
+        call_command('precache', '--hilos', '1', '--log', log.name, '--top', '5', stdout=salida)
+        self.assertIn('0 errores', salida.getvalue())
+        self.assertIn('/catalogo/productos/: ', salida.getvalue())
+        self.assertNotIn('/static/', salida.getvalue())
+
+        # Los relacionados de cada popular ya están en caché
+        with self.assertNumQueries(0):
+            caches.productos_populares.get()
+            for producto in self.productos:
+                caches.productos_relacionados.get(producto.id, self.categoria.id)
+            caches.todas_categorias.get()
+
+    def test_comando_entrada_inexistente(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            call_command('precache', '--entrada', 'no_existe', stdout=StringIO())
+
+
+class ValoresCacheTest(TestCase):
+    """Tests para los valores compactos y versionados de la caché"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.categoria = Categoria.objects.create(nombre='Cascos', descripcion='Cascos de moto ' * 20)
+        self.marca = Marca.objects.create(nombre='Shoei')
+        self.productos = [
+            Producto.objects.create(
+                nombre=f'Casco {i}', descripcion='Casco integral de fibra ' * 30, precio='449.90',
+                categoria=self.categoria, marca=self.marca, stock=20 - i
+            )
+            for i in range(12)
+        ]
+
+    def test_ida_y_vuelta_sin_consultas(self):
+        from decimal import Decimal
+        from catalogo import caches
+        from utils.cache_values import decode, encode
+
+        ImagenProducto.objects.filter(producto=self.productos[0]).delete()
+        populares = caches.productos_populares()
+        datos = encode(caches.PRODUCTO, populares)
+
+        with self.assertNumQueries(0):
+            productos = decode(caches.PRODUCTO, datos)
+            self.assertEqual([p.id for p in productos], [p.id for p in populares])
+            self.assertEqual(productos[0].precio, Decimal('449.90'))
+            self.assertIsNone(productos[0].get_imagen_principal())
+            self.assertIn('via.placeholder.com', productos[0].get_imagen_url())
+
+        # Un campo fuera del esquema se carga bajo demanda
+        with self.assertNumQueries(1):
+            self.assertEqual(productos[0].stock, self.productos[0].stock)
+
+    def test_mas_compacto_que_pickle(self):
+        import pickle
+        from catalogo import caches
+        from utils.cache_values import encode
+
+        populares = caches.productos_populares()
+        self.assertLess(len(encode(caches.PRODUCTO, populares)), len(pickle.dumps(populares)) / 3)
+
+    def test_compresion_por_encima_del_umbral(self):
+        from utils.cache_values import FLAG_ZLIB, HEADER, Schema, decode, encode
+
+        esquema = Schema('prueba')
+        grande = [{'nombre': 'Casco integral', 'precio': '449.90'}] * 200
+        with self.settings(CACHE_COMPRESION_MIN_BYTES=1024):
+            datos = encode(esquema, grande)
+            self.assertTrue(HEADER.unpack_from(datos)[0] & FLAG_ZLIB)
+            self.assertFalse(HEADER.unpack_from(encode(esquema, grande[:1]))[0] & FLAG_ZLIB)
+        self.assertEqual(decode(esquema, datos), grande)
+
+    def test_otra_version_del_esquema_es_un_fallo(self):
+        from catalogo import caches
+        from utils.cache_values import ModelSchema, decode, encode
+
+        datos = encode(caches.CATEGORIA, [self.categoria])
+        # Cambiar los campos cambia la versión: los datos antiguos no se leen
+        nuevo = ModelSchema(Categoria, ['id', 'nombre', 'descripcion'])
+        self.assertIsNone(decode(nuevo, datos))
+        self.assertIsNone(decode(caches.CATEGORIA, b'basura'))
+        self.assertIsNone(decode(caches.CATEGORIA, [self.categoria]))
+
+        # get() recalcula y sobrescribe el valor ilegible
+        from django.core.cache import cache
+        cache.set('todas_categorias', datos[:-3])
+        self.assertEqual(caches.todas_categorias.get()[0].nombre, 'Cascos')
+        with self.assertNumQueries(0):
+            self.assertEqual(caches.todas_categorias.get()[0].nombre, 'Cascos')
+
+    def test_vista_populares_desde_la_cache(self):
+        from catalogo import caches
+
+        caches.productos_populares.warm()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('catalogo:productos_populares'))
+        self.assertContains(response, 'Casco 0')
+        self.assertContains(response, '$449,90')
@@ -1,22 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.http import JsonResponse
 from django.urls import reverse
 from .models import Producto, Categoria, Marca, ImagenProducto
 from .forms import ProductoForm, TallaFormSet, ImagenFormSet
 from .filters import ProductoFilter
+from .search import buscar_productos
+from . import caches
+from .facets import calcular_facetas, filtrar_productos, filtros_desde_request, hay_filtros, rangos_precio
 import time
 from django.views.decorators.http import require_POST
 from .models import Marca
 import os
-from django.db.models import Count
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.cache import cache_page
 from django.db import models, IntegrityError, transaction
 from utils.performance import query_debugger
+from utils.cache_utils import get_or_compute
+from utils.pagination import InvalidCursor, KeysetPage, KeysetPaginator, querystring_sin_cursor
 from django.core.cache import cache
 from django.views.decorators.cache import cache_page
 import logging
@@ -67,11 +71,14 @@ def crear_producto(request):
         print(f"Principal: {form_valid}, Tallas: {tallas_valid}, Imágenes: {imagenes_valid}")
         
         if form_valid and tallas_valid and imagenes_valid:
-            producto = form.save()
-            talla_formset.instance = producto
-            imagen_formset.instance = producto
-            talla_formset.save()
-            imagen_formset.save()
+            # Una sola transacción: las invalidaciones de caché de producto,
+            # tallas e imágenes se aplican una vez al confirmar
+            with transaction.atomic():
+                producto = form.save()
+                talla_formset.instance = producto
+                imagen_formset.instance = producto
+                talla_formset.save()
+                imagen_formset.save()
             
             messages.success(request, f'Producto "{producto.nombre}" creado correctamente')
             return redirect('catalogo:admin_lista_productos')
@@ -124,10 +131,11 @@ def editar_producto(request, producto_id):
         ])
         
         if todos_validos:
-            # Guardar todo
-            producto = form.save()
-            talla_formset.save()
-            imagen_formset.save()
+            # Guardar todo en una transacción (una sola invalidación de caché)
+            with transaction.atomic():
+                producto = form.save()
+                talla_formset.save()
+                imagen_formset.save()
             
             # COMPORTAMIENTO CORREGIDO: Solo redirigir si es "guardar y salir"
             if debe_redirigir:
@@ -192,96 +200,56 @@ def lista_productos(request):
     # prefetch_related para las relaciones ManyToMany e imágenes
     productos_base = (Producto.objects
                      .select_related('categoria', 'marca')  # Carga en una sola consulta
-                     .prefetch_related(
-                         'imagenes',  # Carga todas las imágenes en una sola consulta
-                         'tallas'     # Carga todas las tallas en una sola consulta
-                     ))
-    
-    # Inicializar productos_filtrados con productos_base
-    productos_filtrados = productos_base  # Esta es la línea clave que faltaba
-    
-    # Aplicamos filtros según los parámetros de GET
-    # Nota: Aquí usamos el procesamiento diferido de Django ORM,
-    # que no ejecuta consultas hasta que realmente se necesiten los datos
-    
-    # Filtrar por nombre
-    nombre_busqueda = request.GET.get('nombre', '')
-    if nombre_busqueda:
-        productos_filtrados = productos_filtrados.filter(nombre__icontains=nombre_busqueda)
-    
-    # Categorías y marcas para los filtros laterales (esto se puede cachear)
-    from django.core.cache import cache
-    
-    # Intentar obtener categorías de la caché
-    categorias = cache.get('todas_categorias')
-    if categorias is None:
-        categorias = Categoria.objects.all()
-        # Guardar en caché por 1 hora (3600 segundos)
-        cache.set('todas_categorias', categorias, 3600)
-    
-    # Intentar obtener marcas de la caché
-    marcas = cache.get('todas_marcas')
-    if marcas is None:
-        marcas = Marca.objects.all()
-        # Guardar en caché por 1 hora
-        cache.set('todas_marcas', marcas, 3600)
-    
-    # Filtros adicionales por precio, categoría, marca y disponibilidad
-    # Filtrar por rango de precios
-    precio_min = request.GET.get('precio_min')
-    if precio_min:
-        try:
-            productos_filtrados = productos_filtrados.filter(precio__gte=float(precio_min))
-        except (ValueError, TypeError):
-            pass  # Ignorar si no es un número válido
-    
-    precio_max = request.GET.get('precio_max')
-    if precio_max:
-        try:
-            productos_filtrados = productos_filtrados.filter(precio__lte=float(precio_max))
-        except (ValueError, TypeError):
-            pass  # Ignorar si no es un número válido
-    
-    # Filtrar por categorías seleccionadas
-    categorias_seleccionadas = request.GET.getlist('categoria')
-    if categorias_seleccionadas:
-        productos_filtrados = productos_filtrados.filter(categoria__id__in=categorias_seleccionadas)
-    
-    # Filtrar por marcas seleccionadas
-    marcas_seleccionadas = request.GET.getlist('marca')
-    if marcas_seleccionadas:
-        productos_filtrados = productos_filtrados.filter(marca__id__in=marcas_seleccionadas)
-    
-    # Filtrar por disponibilidad
-    disponible = request.GET.get('disponible')
-    if disponible == 'true':
-        productos_filtrados = productos_filtrados.filter(disponible=True)
-    
-    # Añadir orden explícito antes de paginar para evitar la advertencia
-    productos_filtrados = productos_filtrados.order_by('-id')
-    
-    # Paginar los resultados - usamos el paginador eficiente de Django
-    paginator = Paginator(productos_filtrados, 6)  # 6 productos por página
-    page_number = request.GET.get('page', 1)
+                     .prefetch_related('tallas')  # Carga todas las tallas en una sola consulta
+                     .con_imagen_principal())     # Solo la imagen que se muestra, en otra
+    
+    # Filtros normalizados: nombre (texto completo), precio, categorías,
+    # marcas, tallas y disponibilidad
+    filtros = filtros_desde_request(request.GET)
+    productos_filtrados = filtrar_productos(productos_base, filtros)
+    
+    # Categorías y marcas para los filtros laterales (cacheadas 1 hora)
+    categorias = caches.todas_categorias.get()
+    marcas = caches.todas_marcas.get()
+    
+    # Recuentos de cada faceta en una sola consulta (cacheados por filtros)
+    facetas = calcular_facetas(filtros)
+    for cat in categorias:
+        cat.total_productos = facetas['categorias'].get(str(cat.id), 0)
+    for m in marcas:
+        m.total_productos = facetas['marcas'].get(str(m.id), 0)
+    tallas = sorted(facetas['tallas'].items())
+    
+    # Orden explícito para la paginación por cursor; con búsqueda, los
+    # resultados más relevantes van primero
+    if filtros['nombre']:
+        ordering = ['-relevancia', '-id']
+    else:
+        ordering = ['-id']
     
-    try:
-        productos_paginados = paginator.page(page_number)
-    except PageNotAnInteger:
-        productos_paginados = paginator.page(1)
-    except EmptyPage:
-        productos_paginados = paginator.page(paginator.num_pages)
+    # Paginación por cursor: cada página filtra por la clave de la anterior
+    # en lugar de usar OFFSET. Sin filtros, el total sale de las estadísticas
+    # del planificador en lugar de un COUNT(*); con filtros o búsqueda esa
+    # estimación puede desviarse mucho, así que se cuenta
+    paginator = KeysetPaginator(productos_filtrados, 6, ordering=ordering,
+                                contar='exacto' if hay_filtros(filtros) else 'estimado')
+    productos_paginados = paginator.get_page(request.GET.get('cursor'))
     
     # El contexto que se pasa a la plantilla
     context = {
         'productos': productos_paginados,
         'categorias': categorias,
         'marcas': marcas,
-        'categorias_seleccionadas': categorias_seleccionadas,
-        'marcas_seleccionadas': marcas_seleccionadas,
-        'nombre_busqueda': nombre_busqueda,
-        'precio_min': precio_min or '',
-        'precio_max': precio_max or '',
-        'disponible_seleccionado': disponible == 'true'
+        'tallas': tallas,
+        'rangos_precio': rangos_precio(facetas, request.GET),
+        'querystring_filtros': querystring_sin_cursor(request.GET),
+        'categorias_seleccionadas': filtros['categorias'],
+        'marcas_seleccionadas': filtros['marcas'],
+        'tallas_seleccionadas': filtros['tallas'],
+        'nombre_busqueda': filtros['nombre'],
+        'precio_min': request.GET.get('precio_min', ''),
+        'precio_max': request.GET.get('precio_max', ''),
+        'disponible_seleccionado': filtros['disponible']
     }
     
     return render(request, 'catalogo/lista_productos.html', context)
@@ -305,21 +273,8 @@ def detalle_producto(request, producto_id):
     # Obtenemos directamente las imágenes ya ordenadas gracias al Prefetch
     imagenes = list(producto.imagenes.all()[:10])
     
-    # Clave de caché única para productos relacionados
-    cache_key = f'productos_relacionados_{producto_id}'
-    
-    # Intentar obtener productos relacionados de la caché
-    productos_relacionados = cache.get(cache_key)
-    if productos_relacionados is None:
-        # Si no están en caché, ejecutamos la consulta
-        productos_relacionados = list(
-            Producto.objects.filter(
-                categoria=producto.categoria,
-                disponible=True
-            ).exclude(id=producto_id)[:4]  # Limitamos a 4 productos relacionados
-        )
-        # Guardamos en caché por 1 hora
-        cache.set(cache_key, productos_relacionados, 3600)
+    # Productos relacionados, cacheados 1 hora por producto
+    productos_relacionados = caches.productos_relacionados.get(producto.id, producto.categoria_id)
     
     return render(request, 'catalogo/detalle_producto.html', {
         'producto': producto,
@@ -333,22 +288,8 @@ def productos_populares(request):
     Vista optimizada que muestra productos populares o más vistos
     con caché eficiente
     """
-    # Intentar obtener datos de caché
-    cache_key = 'productos_populares'
-    productos = cache.get(cache_key)
-    
-    if productos is None:
-        # Si no están en caché, consultar la base de datos
-        # Esta consulta simula productos populares (en un sistema real
-        # se usarían datos de vistas o compras)
-        productos = list(Producto.objects
-                        .filter(disponible=True)
-                        .order_by('-stock')  # Productos más disponibles
-                        .select_related('categoria', 'marca')
-                        .prefetch_related('imagenes')[:12])
-        
-        # Guardar en caché por 30 minutos
-        cache.set(cache_key, productos, 60 * 30)
+    # Desde la caché (30 minutos) o, si falta, desde la base de datos
+    productos = caches.productos_populares.get()
     
     return render(request, 'catalogo/productos_populares.html', {
         'productos': productos,
@@ -418,7 +359,7 @@ def admin_productos_data(request):
             # Consulta base optimizada
             queryset = (Producto.objects
                         .select_related('categoria', 'marca')
-                        .prefetch_related('imagenes'))
+                        .con_imagen_principal())
             
             # Aplicar filtros
             if categoria_id and categoria_id != '':
@@ -430,27 +371,45 @@ def admin_productos_data(request):
             if disponibilidad in ['0', '1']:
                 queryset = queryset.filter(disponible=(disponibilidad == '1'))
             
-            # Filtrar por término de búsqueda
+            # Filtrar por término de búsqueda (el documento indexado ya incluye
+            # nombre, descripción, categoría y marca)
             if search_value:
-                queryset = queryset.filter(
-                    Q(nombre__icontains=search_value) |
-                    Q(descripcion__icontains=search_value) |
-                    Q(categoria__nombre__icontains=search_value) |
-                    Q(marca__nombre__icontains=search_value)
-                )
-            
-            # Contar registros una sola vez y cachear resultados
-            cache_key = f'productos_total_count_{categoria_id}_{marca_id}_{disponibilidad}'
-            total_records = cache.get(cache_key)
-            if total_records is None:
-                total_records = Producto.objects.count()
-                cache.set(cache_key, total_records, 60 * 15)  # 15 minutos
-            
-            # Total filtrado - esto es más dinámico y difícil de cachear
-            total_records_filtered = queryset.count()
+                queryset = buscar_productos(queryset, search_value)
             
-            # Aplicar ordenamiento y paginación eficientemente
-            paginated_queryset = queryset.order_by(order_column)[start:start + length]
+            # Contar registros una sola vez y cachear resultados (15 minutos)
+            cache_key = f'productos_total_count_{categoria_id}_{marca_id}_{disponibilidad}'
+            total_records = get_or_compute(cache_key, Producto.objects.count, 60 * 15,
+                                           tags=['productos'], stale_ttl=60)
+            
+            # Total filtrado: DataTables dibuja con él las páginas, así que con
+            # filtros o búsqueda se cuenta; sin ellos coincide con el total
+            filtrado = bool(categoria_id or marca_id or disponibilidad in ['0', '1'] or search_value)
+            ordering = [order_column, '-relevancia'] if search_value else [order_column]
+            paginador = KeysetPaginator(queryset, max(length, 1), ordering=ordering,
+                                        contar='exacto' if filtrado else None)
+            total_records_filtered = paginador.count if filtrado else total_records
+            
+            # Paginación por cursor: el cliente envía el cursor que recibió al
+            # cargar la página anterior; si salta a una página arbitraria (o el
+            # cursor no vale para esta ordenación) se recurre a OFFSET
+            cursor = request.POST.get('cursor', '')
+            pagina = None
+            if length > 0 and (start == 0 or cursor):
+                try:
+                    pagina = paginador.page(cursor or None)
+                except InvalidCursor:
+                    pass
+            
+            if pagina is not None:
+                paginated_queryset = pagina.object_list
+            elif length <= 0:
+                # Opción "Todos" de DataTables
+                paginated_queryset = queryset.order_by(*paginador.ordering)
+            else:
+                paginated_queryset = list(queryset.order_by(*paginador.ordering)[start:start + length])
+                if len(paginated_queryset) == length:
+                    # Cursor para que la página siguiente ya no use OFFSET
+                    pagina = KeysetPage(paginated_queryset, paginador, has_next=True, has_previous=start > 0)
             
             # Preparar datos para JSON (optimizando la generación de HTML)
             data = []
@@ -481,7 +440,8 @@ def admin_productos_data(request):
                 'draw': draw,
                 'recordsTotal': total_records,
                 'recordsFiltered': total_records_filtered,
-                'data': data
+                'data': data,
+                'cursor_siguiente': pagina.next_cursor if pagina else None
             }
             
             # Configurar headers CORS para permitir peticiones desde cualquier origen
@@ -716,29 +676,8 @@ def listar_marcas_ajax(request):
     ordenadas por nombre y con conteo de productos.
     """
     try:
-        # Caché de 2 minutos para la lista de marcas (mejora rendimiento)
-        cache_key = 'marcas_list_admin'
-        marcas_list = cache.get(cache_key)
-        
-        if marcas_list is None:
-            # Obtener todas las marcas con anotación de conteo de productos
-            marcas = Marca.objects.annotate(
-                productos_count=Count('productos')
-            ).order_by('nombre')
-            
-            # Crear lista de diccionarios con id, nombre, descripción y conteo de productos
-            marcas_list = [
-                {
-                    'id': marca.id, 
-                    'nombre': marca.nombre,
-                    'descripcion': marca.descripcion or '',
-                    'productos_count': marca.productos_count
-                } 
-                for marca in marcas
-            ]
-            
-            # Guardar en caché por 2 minutos
-            cache.set(cache_key, marcas_list, 120)  # 120 segundos = 2 minutos
+        # Caché de 2 minutos para la lista de marcas con su conteo de productos
+        marcas_list = caches.marcas_admin.get()
         
         # Retornar como JSON
         return JsonResponse({'success': True, 'marcas': marcas_list})
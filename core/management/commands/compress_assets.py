@@ -2,10 +2,122 @@
 from django.core.management.base import BaseCommand
 from django.core.management import call_command
 from django.conf import settings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import json
 import os
 import subprocess
 import time
 
+# Directorios de MEDIA_ROOT con imágenes a optimizar
+DIRECTORIOS_IMAGENES = ['productos', 'marcas']
+EXTENSIONES_IMAGENES = ('.jpg', '.jpeg', '.png')
+# Calidad JPEG objetivo: solo se recomprimen (con pérdida) las imágenes de
+# calidad mayor; el resto se optimiza sin volver a cuantizar
+CALIDAD_JPEG = 85
+
+# Tabla de cuantización de luminancia estándar (JPEG Anexo K, calidad 50)
+_TABLA_LUMINANCIA = [
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+]
+
+
+def huella(datos):
+    """Hash del contenido de un fichero"""
+    return hashlib.blake2b(datos, digest_size=16).hexdigest()
+
+
+def calidad_jpeg(img):
+    """
+    Estima la calidad (1-100) con la que se codificó un JPEG a partir de su
+    tabla de luminancia, invirtiendo el escalado de libjpeg. None si no se
+    puede estimar.
+    """
+    tabla = getattr(img, 'quantization', None) or {}
+    if 0 not in tabla:
+        return None
+    escala = sum(tabla[0]) * 100 / sum(_TABLA_LUMINANCIA)
+    if escala <= 100:
+        return round((200 - escala) / 2)
+    return round(5000 / escala)
+
+
+def _recodificar(datos, calidad):
+    """
+    Vuelve a codificar una imagen en memoria.
+
+    Returns:
+        tuple: (modo, bytes codificados o None si el formato no se optimiza)
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(datos)) as img:
+        opciones = {'optimize': True}
+        for clave in ('exif', 'icc_profile'):
+            if img.info.get(clave):
+                opciones[clave] = img.info[clave]
+        if img.format == 'JPEG':
+            estimada = calidad_jpeg(img)
+            if estimada is None or estimada > calidad:
+                opciones['quality'] = calidad
+                modo = 'recomprimida'
+            else:
+                # Mismas tablas de cuantización: no se pierde más calidad
+                opciones['quality'] = 'keep'
+                modo = 'sin pérdida'
+            opciones['progressive'] = True
+        elif img.format == 'PNG':
+            modo = 'sin pérdida'
+        else:
+            return 'omitida', None
+        salida = io.BytesIO()
+        img.save(salida, format=img.format, **opciones)
+    return modo, salida.getvalue()
+
+
+def optimizar_imagen(ruta, huella_anterior=None, calidad=CALIDAD_JPEG):
+    """
+    Optimiza una imagen en su sitio (se ejecuta en los procesos hijos).
+
+    Los JPEG de calidad mayor que `calidad` se recomprimen a esa calidad; los
+    demás (ya comprimidos) se reescriben con sus mismas tablas de
+    cuantización, Huffman optimizado y modo progresivo, así que repetir la
+    optimización no los degrada. Los PNG se optimizan sin pérdida. El
+    resultado solo sustituye al original si ocupa menos.
+
+    Returns:
+        tuple: (ruta, bytes antes, bytes después, modo, entrada del
+        manifiesto [tamaño, mtime_ns, huella] o None, error o None)
+    """
+    try:
+        with open(ruta, 'rb') as fichero:
+            datos = fichero.read()
+        antes = len(datos)
+        if huella(datos) == huella_anterior:
+            # Solo cambió la fecha (copia, restauración...): ya está optimizada
+            modo = 'sin cambios'
+        else:
+            modo, optimizados = _recodificar(datos, calidad)
+            if optimizados is not None and len(optimizados) < antes:
+                temporal = f'{ruta}.optimizando'
+                with open(temporal, 'wb') as fichero:
+                    fichero.write(optimizados)
+                os.replace(temporal, ruta)
+                datos = optimizados
+            elif optimizados is not None:
+                modo = 'ya óptima'
+
+        estado = os.stat(ruta)
+        return ruta, antes, len(datos), modo, [estado.st_size, estado.st_mtime_ns, huella(datos)], None
+    except Exception as e:
+        return ruta, 0, 0, 'error', None, f'{type(e).__name__}: {e}'
+
+
 class Command(BaseCommand):
     help = 'Comprime y optimiza todos los assets para producción'
     
@@ -15,7 +127,24 @@ class Command(BaseCommand):
             action='store_true',
             dest='force',
             default=False,
-            help='Forzar la recompresión de todos los archivos',
+            help='Forzar la recompresión de todos los archivos (las imágenes se revisan aunque no hayan cambiado)',
+        )
+        parser.add_argument(
+            '--images-only',
+            action='store_true',
+            default=False,
+            help='Optimizar solo las imágenes de media (sin collectstatic ni compress)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Procesos que optimizan imágenes (por defecto, uno por CPU)',
+        )
+        parser.add_argument(
+            '--manifest',
+            default=os.path.join(settings.BASE_DIR, 'logs', 'compress_assets.json'),
+            help='Fichero con las huellas de las imágenes ya optimizadas',
         )
     
     def handle(self, *args, **options):
@@ -25,81 +154,139 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS('Iniciando compresión de assets...'))
         
-        # 1. Collect static files
-        self.stdout.write('Colectando archivos estáticos...')
-        call_command('collectstatic', interactive=False, verbosity=0)
-        
-        # 2. Compress using django-compressor
-        self.stdout.write('Comprimiendo archivos CSS y JS...')
-        if force:
-            # Eliminar archivos comprimidos anteriores
-            compressed_dir = os.path.join(settings.STATIC_ROOT, 'CACHE')
-            if os.path.exists(compressed_dir):
-                for root, dirs, files in os.walk(compressed_dir):
-                    for file in files:
-                        os.remove(os.path.join(root, file))
-                self.stdout.write('Caché de compresión eliminada')
-        
-        # Comprimir
-        call_command('compress', force=force, verbosity=2)
-        
-        # 3. Optimizar imágenes si el paquete pillow está instalado
-        try:
-            from PIL import Image
-            self.stdout.write('Optimizando imágenes...')
-            
-            # Media dirs to optimize
-            media_dirs = [
-                os.path.join(settings.MEDIA_ROOT, 'productos'),
-                os.path.join(settings.MEDIA_ROOT, 'marcas'),
-            ]
+        if not options['images_only']:
+            # 1. Collect static files
+            self.stdout.write('Colectando archivos estáticos...')
+            call_command('collectstatic', interactive=False, verbosity=0)
             
-            total_saved = 0
-            images_processed = 0
+            # 2. Compress using django-compressor
+            self.stdout.write('Comprimiendo archivos CSS y JS...')
+            if force:
+                # Eliminar archivos comprimidos anteriores
+                compressed_dir = os.path.join(settings.STATIC_ROOT, 'CACHE')
+                if os.path.exists(compressed_dir):
+                    for root, dirs, files in os.walk(compressed_dir):
+                        for file in files:
+                            os.remove(os.path.join(root, file))
+                    self.stdout.write('Caché de compresión eliminada')
             
-            for media_dir in media_dirs:
-                if not os.path.exists(media_dir):
-                    continue
-                    
-                for root, dirs, files in os.walk(media_dir):
-                    for file in files:
-                        if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                            file_path = os.path.join(root, file)
-                            try:
-                                # Get original size
-                                original_size = os.path.getsize(file_path)
-                                
-                                # Optimize image
-                                with Image.open(file_path) as img:
-                                    # Preserve EXIF data if present
-                                    exif = img.info.get('exif')
-                                    
-                                    # Optimize quality
-                                    img.save(file_path, optimize=True, quality=85, exif=exif if exif else "")
-                                
-                                # Get new size
-                                new_size = os.path.getsize(file_path)
-                                saved = original_size - new_size
-                                total_saved += saved
-                                images_processed += 1
-                                
-                                if saved > 0:
-                                    self.stdout.write(f'  ✓ {file}: {saved/1024:.1f}KB ahorrados')
-                            except Exception as e:
-                                self.stdout.write(self.style.WARNING(f'  ✗ Error al optimizar {file}: {str(e)}'))
-            
-            if images_processed > 0:
-                self.stdout.write(self.style.SUCCESS(
-                    f'Optimizadas {images_processed} imágenes, ahorrando {total_saved/1024/1024:.2f}MB en total'
-                ))
-            else:
-                self.stdout.write('No se encontraron imágenes para optimizar')
-                
-        except ImportError:
-            self.stdout.write(self.style.WARNING('Pillow no está instalado, omitiendo optimización de imágenes'))
+            # Comprimir
+            call_command('compress', force=force, verbosity=2)
+        
+        # 3. Optimizar imágenes si el paquete pillow está instalado
+        self._optimizar_imagenes(options)
         
         # Mostrar tiempo total
         end_time = time.time()
         self.stdout.write(self.style.SUCCESS(
             f'Compresión completada en {end_time - start_time:.2f} segundos'
-        ))
\ No newline at end of file
+        ))
+
+    def _optimizar_imagenes(self, options):
+        """
+        Optimiza en paralelo las imágenes nuevas o modificadas desde la
+        última ejecución. El manifiesto guarda, por ruta relativa a
+        MEDIA_ROOT, el tamaño, la fecha de modificación y la huella del
+        contenido ya optimizado: si tamaño y fecha coinciden el fichero ni
+        siquiera se lee, así que repasar una biblioteca sin cambios solo
+        cuesta recorrer los directorios.
+        """
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            self.stdout.write(self.style.WARNING('Pillow no está instalado, omitiendo optimización de imágenes'))
+            return
+        self.stdout.write('Optimizando imágenes...')
+
+        inicio = time.monotonic()
+        anterior = self._cargar_manifiesto(options['manifest'])
+        manifiesto = {}
+        pendientes = []
+        for nombre in DIRECTORIOS_IMAGENES:
+            for entrada in self._recorrer(os.path.join(settings.MEDIA_ROOT, nombre)):
+                relativa = os.path.relpath(entrada.path, settings.MEDIA_ROOT)
+                registrada = anterior.get(relativa)
+                estado = entrada.stat()
+                if (registrada and not options['force']
+                        and registrada[:2] == [estado.st_size, estado.st_mtime_ns]):
+                    manifiesto[relativa] = registrada
+                    continue
+                pendientes.append((entrada.path, registrada[2] if registrada and not options['force'] else None))
+        sin_cambios = len(manifiesto)
+
+        if pendientes:
+            self.stdout.write(f'  {len(pendientes)} imágenes nuevas o modificadas; {sin_cambios} sin cambios')
+            resultados = self._ejecutar(pendientes, max(1, options['workers']))
+        else:
+            resultados = []
+
+        por_directorio = defaultdict(lambda: {'imagenes': 0, 'antes': 0, 'despues': 0})
+        modos = defaultdict(int)
+        errores = 0
+        for ruta, antes, despues, modo, entrada, error in resultados:
+            modos[modo] += 1
+            relativa = os.path.relpath(ruta, settings.MEDIA_ROOT)
+            if error:
+                errores += 1
+                self.stdout.write(self.style.WARNING(f'  ✗ Error al optimizar {relativa}: {error}'))
+                continue
+            if entrada:
+                manifiesto[relativa] = entrada
+            totales = por_directorio[os.path.dirname(relativa)]
+            totales['imagenes'] += 1
+            totales['antes'] += antes
+            totales['despues'] += despues
+        self._guardar_manifiesto(options['manifest'], manifiesto)
+
+        if modos:
+            self.stdout.write('  ' + ', '.join(f'{modo}: {total}' for modo, total in sorted(modos.items())))
+        for directorio, totales in sorted(por_directorio.items()):
+            ahorro = totales['antes'] - totales['despues']
+            self.stdout.write(
+                f'  {directorio}: {totales["imagenes"]} imágenes, {ahorro / 1024:.1f}KB ahorrados '
+                f'({ahorro * 100 / (totales["antes"] or 1):.1f}%)'
+            )
+        segundos = time.monotonic() - inicio
+        leidos = sum(totales['antes'] for totales in por_directorio.values())
+        ahorrados = leidos - sum(totales['despues'] for totales in por_directorio.values())
+        procesadas = len(resultados) - errores
+        self.stdout.write(self.style.SUCCESS(
+            f'Optimizadas {procesadas} imágenes ({sin_cambios} omitidas sin cambios, {errores} errores), '
+            f'ahorrando {ahorrados / 1024 / 1024:.2f}MB en {segundos:.2f} s '
+            f'({procesadas / segundos if segundos else 0:.0f} imágenes/s, '
+            f'{leidos / 1024 / 1024 / segundos if segundos else 0:.1f}MB/s)'
+        ))
+
+    def _recorrer(self, directorio):
+        """Entradas de las imágenes bajo `directorio` (os.scandir reutiliza el stat)"""
+        try:
+            entradas = list(os.scandir(directorio))
+        except FileNotFoundError:
+            return
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                yield from self._recorrer(entrada.path)
+            elif entrada.name.lower().endswith(EXTENSIONES_IMAGENES):
+                yield entrada
+
+    def _ejecutar(self, pendientes, workers):
+        if workers == 1 or len(pendientes) == 1:
+            return [optimizar_imagen(ruta, huella_anterior) for ruta, huella_anterior in pendientes]
+        rutas, huellas = zip(*pendientes)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(optimizar_imagen, rutas, huellas,
+                                 chunksize=max(1, len(pendientes) // (workers * 4))))
+
+    def _cargar_manifiesto(self, ruta):
+        try:
+            with open(ruta, encoding='utf-8') as fichero:
+                return json.load(fichero)
+        except (OSError, ValueError):
+            return {}
+
+    def _guardar_manifiesto(self, ruta, manifiesto):
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        temporal = f'{ruta}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as fichero:
+            json.dump(manifiesto, fichero, separators=(',', ':'))
+        os.replace(temporal, ruta)
@@ -1,68 +1,167 @@
-from django.core.management.base import BaseCommand
-from django.core.cache import cache
-from catalogo.models import Producto, Categoria, Marca
-from django.db.models import Prefetch
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.utils.module_loading import autodiscover_modules
+from utils import cache_warming
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
 import time
 import logging
 
 logger = logging.getLogger('mototienda.performance')
 
+# Petición GET en una línea de log con formato common/combined de nginx o gunicorn
+PETICION_LOG = re.compile(r'"GET (?P<ruta>/\S*) HTTP/[\d.]+" (?P<estado>\d{3})')
+# Rutas que no pasan por la caché de páginas
+RUTAS_EXCLUIDAS = ('/static/', '/media/', '/admin/', '/pagos/', '/carrito/', '/usuarios/', '/__debug__/')
+
+
+def rutas_mas_visitadas(ruta_log, limite):
+    """
+    Cuenta las peticiones GET con respuesta 200 de un log de accesos y
+    devuelve las `limite` rutas más pedidas (con su query string).
+    """
+    visitas = Counter()
+    with open(ruta_log, encoding='utf-8', errors='replace') as fichero:
+        for linea in fichero:
+            coincidencia = PETICION_LOG.search(linea)
+            if (coincidencia and coincidencia['estado'] == '200'
+                    and not coincidencia['ruta'].startswith(RUTAS_EXCLUIDAS)):
+                visitas[coincidencia['ruta']] += 1
+    return [ruta for ruta, _ in visitas.most_common(limite)]
+
+
 class Command(BaseCommand):
-    help = 'Precarga las cachés más importantes para mejorar el rendimiento inicial'
-    
+    help = ('Precalienta en paralelo las entradas de caché registradas (utils/cache_warming.py) '
+            'y, opcionalmente, las páginas más visitadas según un log de accesos')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--entrada', action='append', dest='entradas',
+            help='Nombre de una entrada a calentar, con sus dependencias (se puede repetir)'
+        )
+        parser.add_argument(
+            '--hilos', type=int, default=4,
+            help='Hilos de calentamiento; cada uno usa como mucho una conexión a la base de datos'
+        )
+        parser.add_argument(
+            '--log',
+            help='Log de accesos (formato common/combined) del que sacar las páginas a calentar'
+        )
+        parser.add_argument(
+            '--top', type=int, default=50,
+            help='Número de páginas más visitadas a calentar con --log (por defecto 50)'
+        )
+        parser.add_argument(
+            '--host',
+            help='Host de las peticiones a las páginas (por defecto, el primero de ALLOWED_HOSTS); '
+                 'forma parte de la clave de la caché de páginas'
+        )
+
     def handle(self, *args, **options):
         """Ejecuta la precarga de cachés"""
         start_time = time.time()
         self.stdout.write(self.style.SUCCESS('Iniciando precarga de cachés...'))
-        
-        # 1. Cachear categorías
-        self.stdout.write('Cacheando categorías...')
-        categorias = list(Categoria.objects.all())
-        cache.set('todas_categorias', categorias, 3600 * 12)  # 12 horas
-        
-        # 2. Cachear marcas
-        self.stdout.write('Cacheando marcas...')
-        marcas = list(Marca.objects.all())
-        cache.set('todas_marcas', marcas, 3600 * 12)  # 12 horas
-        
-        # 3. Cachear productos populares
-        self.stdout.write('Cacheando productos populares...')
-        productos_populares = list(Producto.objects
-                                  .filter(disponible=True)
-                                  .order_by('-stock')
-                                  .select_related('categoria', 'marca')
-                                  .prefetch_related('imagenes')[:12])
-        cache.set('productos_populares', productos_populares, 3600 * 3)  # 3 horas
-        
-        # 4. Cachear productos por categoría
-        self.stdout.write('Cacheando productos por categoría...')
-        for categoria in categorias:
-            productos = list(Producto.objects
-                            .filter(categoria=categoria, disponible=True)
-                            .select_related('marca')
-                            .prefetch_related('imagenes')[:20])  # 20 productos por categoría
-            cache_key = f'categoria_{categoria.id}_productos'
-            cache.set(cache_key, productos, 3600 * 6)  # 6 horas
-        
-        # 5. Cachear productos por marca
-        self.stdout.write('Cacheando productos por marca...')
-        for marca in marcas:
-            productos = list(Producto.objects
-                            .filter(marca=marca, disponible=True)
-                            .select_related('categoria')
-                            .prefetch_related('imagenes')[:20])
-            cache_key = f'marca_{marca.id}_productos'
-            cache.set(cache_key, productos, 3600 * 6)  # 6 horas
-        
-        # Tiempo total
-        end_time = time.time()
-        total_time = end_time - start_time
-        
+
+        # Las vistas importan los módulos donde se registran las entradas
+        autodiscover_modules('views')
+        try:
+            etapas = cache_warming.warm_order(options['entradas'])
+        except KeyError as e:
+            raise CommandError(f'No existe la entrada de caché {e}')
+
+        hilos = max(1, options['hilos'])
+        claves, errores = 0, 0
+        for etapa in etapas:
+            # Los argumentos de una entrada pueden depender de las ya calentadas
+            trabajos = []
+            for entrada in etapa:
+                try:
+                    trabajos.extend((entrada, params) for params in entrada.warm_params())
+                except Exception as e:
+                    logger.exception(f'Error al obtener los argumentos de la caché {entrada.name}')
+                    errores += 1
+                    self.stdout.write(self.style.WARNING(f'  ✗ {entrada.name}: {type(e).__name__}: {e}'))
+            for entrada, params, segundos, error in self._ejecutar(self._calentar, trabajos, hilos):
+                etiqueta = f"{entrada.name}{list(params) if params else ''}"
+                if error:
+                    errores += 1
+                    self.stdout.write(self.style.WARNING(f'  ✗ {etiqueta}: {error}'))
+                else:
+                    claves += 1
+                    self.stdout.write(f'  {etiqueta}: {segundos * 1000:.0f} ms')
+
+        paginas = 0
+        if options['log']:
+            paginas, errores_paginas = self._calentar_paginas(options, hilos)
+            errores += errores_paginas
+
+        total_time = time.time() - start_time
         self.stdout.write(self.style.SUCCESS(
-            f'Precarga de cachés completada en {total_time:.2f} segundos'
+            f'Precarga de cachés completada en {total_time:.2f} segundos: '
+            f'{claves} entradas, {paginas} páginas, {errores} errores'
         ))
-        
-        # Mostrar estadísticas
-        self.stdout.write(f"Categorías cacheadas: {len(categorias)}")
-        self.stdout.write(f"Marcas cacheadas: {len(marcas)}")
-        self.stdout.write(f"Total de cachés creadas: {len(categorias) + len(marcas) + 1 + len(categorias) + len(marcas)}")
\ No newline at end of file
+
+    def _ejecutar(self, funcion, trabajos, hilos):
+        """Ejecuta los trabajos con `hilos` hilos y cierra sus conexiones al terminar"""
+        if hilos == 1 or len(trabajos) <= 1:
+            return [funcion(*trabajo) for trabajo in trabajos]
+
+        hilos = min(hilos, len(trabajos))
+        # Las conexiones son por hilo: la barrera obliga a que cada hilo
+        # ejecute exactamente uno de los cierres
+        barrera = threading.Barrier(hilos)
+
+        def cerrar_conexion(_):
+            barrera.wait()
+            connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            resultados = list(pool.map(lambda trabajo: funcion(*trabajo), trabajos))
+            list(pool.map(cerrar_conexion, range(hilos)))
+        return resultados
+
+    def _calentar(self, entrada, params):
+        inicio = time.monotonic()
+        try:
+            entrada.warm(*params)
+        except Exception as e:
+            logger.exception(f'Error al calentar la caché {entrada.name}')
+            return entrada, params, 0, f'{type(e).__name__}: {e}'
+        return entrada, params, time.monotonic() - inicio, None
+
+    def _calentar_paginas(self, options, hilos):
+        """Pide las páginas más visitadas para llenar la caché de páginas"""
+        try:
+            rutas = rutas_mas_visitadas(options['log'], options['top'])
+        except OSError as e:
+            raise CommandError(f'No se pudo leer el log de accesos: {e}')
+        host = options['host'] or next(
+            (h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.stdout.write(f'Calentando {len(rutas)} páginas en {host}...')
+
+        local = threading.local()
+
+        def pedir(ruta):
+            # Un cliente por hilo: el de pruebas no es seguro entre hilos
+            if not hasattr(local, 'cliente'):
+                local.cliente = Client(HTTP_HOST=host)
+            inicio = time.monotonic()
+            try:
+                respuesta = local.cliente.get(ruta, secure=settings.SECURE_SSL_REDIRECT)
+                return ruta, respuesta.status_code, time.monotonic() - inicio
+            except Exception as e:
+                logger.exception(f'Error al calentar la página {ruta}')
+                return ruta, f'{type(e).__name__}: {e}', 0
+
+        errores = 0
+        for ruta, estado, segundos in self._ejecutar(pedir, [(ruta,) for ruta in rutas], hilos):
+            if estado != 200:
+                errores += 1
+                self.stdout.write(self.style.WARNING(f'  ✗ {ruta}: {estado}'))
+            else:
+                self.stdout.write(f'  {ruta}: {segundos * 1000:.0f} ms')
+        return len(rutas) - errores, errores
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.http import HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from utils.cache_utils import invalidation_batch
 import time
 import logging
 import re
@@ -171,4 +174,39 @@ class SecurityAuditMiddleware:
             ip = x_forwarded_for.split(',')[0]
         else:
             ip = request.META.get('REMOTE_ADDR')
-        return ip
\ No newline at end of file
+        return ip
+
+class CacheInvalidationBatchMiddleware:
+    """
+    Middleware que agrupa todas las invalidaciones de caché de una petición
+    y las aplica una sola vez al terminarla (o al confirmar la transacción).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with invalidation_batch():
+            return self.get_response(request)
+
+
+class MediaCacheControlMiddleware:
+    """
+    Middleware que añade Cache-Control a los ficheros de media servidos por
+    Django. Las URLs versionadas (?v=..., ver catalogo.models.url_versionada)
+    no cambian de contenido, así que se cachean un año como inmutables; el
+    resto durante MEDIA_CACHE_SIN_VERSION_SEGUNDOS. Si el servidor web sirve
+    /media/ directamente, debe aplicar la misma regla.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.path.startswith(settings.MEDIA_URL) and response.status_code in (200, 304):
+            if request.GET.get('v'):
+                patch_cache_control(response, public=True, immutable=True,
+                                    max_age=settings.MEDIA_CACHE_SEGUNDOS)
+            else:
+                patch_cache_control(response, public=True,
+                                    max_age=settings.MEDIA_CACHE_SIN_VERSION_SEGUNDOS)
+        return response
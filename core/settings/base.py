@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     'pedidos',
     'pagos',
     'core',
+    'tareas',
     # Bibliotecas de terceros
     'crispy_forms',
     'crispy_bootstrap5',
@@ -50,6 +51,10 @@ CACHES = {
     }
 }
 
+# Los valores con esquema (utils/cache_values.py) se comprimen con zlib a
+# partir de este tamaño
+CACHE_COMPRESION_MIN_BYTES = 1024
+
 # La configuración correcta del middleware de caché
 MIDDLEWARE = [
     'django.middleware.cache.UpdateCacheMiddleware',  # Debe estar primero
@@ -63,7 +68,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'core.middleware.LoginRateLimitMiddleware',
     'core.middleware.SecurityHeadersMiddleware',
+    'core.middleware.MediaCacheControlMiddleware',
     'core.middleware.SecurityAuditMiddleware',
+    'core.middleware.CacheInvalidationBatchMiddleware',
     'utils.exception_middleware.GlobalExceptionMiddleware',
     'utils.monitoring.PerformanceMonitorMiddleware',
     'django.middleware.cache.FetchFromCacheMiddleware',  # Debe estar último
@@ -186,6 +193,42 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Las miniaturas de imagekit se generan en segundo plano (catalogo/imagenes.py);
+# acceder a ellas nunca redimensiona dentro de una petición
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'catalogo.imagenes.SoloEnSegundoPlano'
+
+# Caché de navegador/CDN para media: las URLs versionadas (?v=) son inmutables
+MEDIA_CACHE_SEGUNDOS = 60 * 60 * 24 * 365
+MEDIA_CACHE_SIN_VERSION_SEGUNDOS = 60 * 60
+
+# Exportaciones generadas en segundo plano (fuera de MEDIA_ROOT: contienen
+# datos personales y solo se descargan a través de una vista de staff)
+EXPORTACIONES_ROOT = os.path.join(BASE_DIR, 'exportaciones')
+
+# Facturas PDF renderizadas (ver pedidos/facturas.py), también privadas
+FACTURAS_ROOT = os.path.join(BASE_DIR, 'facturas')
+
+# Minutos que un pedido retiene su stock mientras se paga (pedidos/reservas.py)
+RESERVA_STOCK_MINUTOS = 15
+
+# Pasarela de pago (pagos/pasarelas.py): en local se simula la latencia y
+# los rechazos de una pasarela real
+PAGOS_PASARELA = {
+    'BACKEND': 'pagos.pasarelas.PasarelaSimulada',
+    'OPCIONES': {'latencia': (1, 2)},
+}
+# Clave compartida con la pasarela para firmar sus notificaciones (webhook);
+# sin clave se rechazan todas
+PAGOS_WEBHOOK_SECRETO = os.environ.get('PAGOS_WEBHOOK_SECRETO', '')
+# Tiempo máximo de un pago en 'procesando' (pagos/confirmacion.py): minutos
+# hasta obtener respuesta de la pasarela y horas hasta recibir su notificación
+PAGOS_PROCESANDO_MINUTOS = 15
+PAGOS_NOTIFICACION_HORAS = 24
+
+# Cola de tareas (tareas/cola.py): con True las tareas se ejecutan en el
+# propio proceso al confirmar la transacción, sin worker
+TAREAS_SINCRONAS = False
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
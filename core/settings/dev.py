@@ -44,6 +44,9 @@ CSRF_COOKIE_HTTPONLY = True
 # Email backend para desarrollo (envía a la consola)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# En desarrollo las tareas se ejecutan sin worker (ver tareas/cola.py)
+TAREAS_SINCRONAS = True
+
 # Tiempo de vigencia de la sesión más largo para desarrollo (4 horas)
 SESSION_COOKIE_AGE = 14400  
 # En segundos
@@ -44,6 +44,17 @@ DATABASES = {
     }
 }
 
+# Pasarela de pago real si está configurada (si no, se mantiene la simulada)
+if os.environ.get('PAGOS_PASARELA_URL'):
+    PAGOS_PASARELA = {
+        'BACKEND': 'pagos.pasarelas.PasarelaHTTP',
+        'OPCIONES': {
+            'url': os.environ['PAGOS_PASARELA_URL'],
+            'api_key': os.environ.get('PAGOS_PASARELA_API_KEY', ''),
+            'timeout': float(os.environ.get('PAGOS_PASARELA_TIMEOUT', 10)),
+        },
+    }
+
 # Configuración para archivos estáticos
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
@@ -202,9 +213,30 @@ LOGGING = {
     },
 }
 
-# Configuración de caché para producción - Redis
+# Configuración de caché para producción: Redis, con una copia en memoria de
+# cada worker (L1) para las claves más leídas. Las escrituras se anuncian por
+# Redis pub/sub para que los demás workers descarten su copia
 CACHES = {
     'default': {
+        'BACKEND': 'utils.cache_backends.TwoTierCache',
+        'LOCATION': 'mototienda',
+        'OPTIONS': {
+            'L2': 'redis',
+            'L1_TIMEOUT': 30,  # Desfase máximo si se pierde un mensaje del bus
+            'L1_MAX_ENTRIES': 500,
+            'L1_KEY_PREFIXES': [
+                'todas_categorias',
+                'todas_marcas',
+                'marcas_list_admin',
+                'productos_populares',
+                'cache_tag_version:',  # Se leen en cada get_tagged
+            ],
+            'BUS': 'utils.cache_backends.RedisBus',
+            'BUS_CHANNEL': 'mototienda:cache-l1',
+            'BUS_OPTIONS': {'alias': 'redis'},
+        },
+    },
+    'redis': {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
         'OPTIONS': {
@@ -219,6 +251,10 @@ CACHES = {
     }
 }
 
-# Usar Redis también para las sesiones
+# Cerrojos de get_or_compute (utils/cache_utils.py) compartidos por todos
+# los workers: al caducar una clave solo uno la recalcula
+CACHE_LOCK_REDIS_ALIAS = 'redis'
+
+# Usar Redis también para las sesiones (directamente, sin pasar por L1)
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
-SESSION_CACHE_ALIAS = 'default'
\ No newline at end of file
+SESSION_CACHE_ALIAS = 'redis'
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""
+Tareas en segundo plano generales del sitio (ver tareas/cola.py).
+"""
+from django.core.mail import mail_admins
+
+from tareas.cola import tarea
+
+
+@tarea(max_intentos=3)
+def notificar_admins(asunto, mensaje):
+    """Envía un correo a los ADMINS fuera del ciclo de la petición"""
+    mail_admins(asunto, mensaje)
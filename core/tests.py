@@ -0,0 +1,255 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+
+class CompressAssetsImagenesTest(SimpleTestCase):
+    """
+    Tests para la optimización incremental de imágenes de compress_assets
+    """
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.manifiesto = os.path.join(self.media, 'manifiesto.json')
+        os.makedirs(os.path.join(self.media, 'productos', 'imagenes'))
+        self.foto = self._imagen('productos/imagenes/foto.jpg', quality=98)
+        self.comprimida = self._imagen('productos/imagenes/comprimida.jpg', quality=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _imagen(self, nombre, **opciones):
+        ruta = os.path.join(self.media, nombre)
+        img = Image.effect_noise((300, 200), 40).convert('RGB')
+        img.save(ruta, format='JPEG', **opciones)
+        return ruta
+
+    def _ejecutar(self, *args):
+        salida = io.StringIO()
+        call_command('compress_assets', '--images-only', '--workers', '1',
+                     '--manifest', self.manifiesto, *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_recomprime_solo_las_de_calidad_alta(self):
+        from core.management.commands.compress_assets import calidad_jpeg
+
+        tamano = os.path.getsize(self.foto)
+        salida = self._ejecutar()
+        self.assertIn('Optimizadas 2 imágenes', salida)
+        self.assertIn('productos/imagenes: 2 imágenes', salida)
+        self.assertLess(os.path.getsize(self.foto), tamano)
+        with Image.open(self.foto) as img:
+            self.assertEqual(calidad_jpeg(img), 85)
+        # La ya comprimida conserva su cuantización
+        with Image.open(self.comprimida) as img:
+            self.assertEqual(calidad_jpeg(img), 60)
+
+    def test_segunda_ejecucion_omite_las_que_no_cambiaron(self):
+        self._ejecutar()
+        with open(self.manifiesto) as fichero:
+            self.assertEqual(len(json.load(fichero)), 2)
+
+        salida = self._ejecutar()
+        self.assertIn('Optimizadas 0 imágenes (2 omitidas sin cambios', salida)
+
+        self._imagen('productos/imagenes/nueva.jpg', quality=95)
+        salida = self._ejecutar()
+        self.assertIn('Optimizadas 1 imágenes (2 omitidas sin cambios', salida)
+
+
+def _nodo(nombre):
+    return {
+        'BACKEND': 'utils.cache_backends.TwoTierCache',
+        'LOCATION': nombre,
+        'OPTIONS': {
+            'L2': 'compartida',
+            'L1_MAX_ENTRIES': 3,
+            'L1_KEY_PREFIXES': ['todas_categorias', 'todas_marcas', 'cache_tag_version:'],
+            'BUS_CHANNEL': 'pruebas-l1',
+        },
+    }
+
+
+@override_settings(CACHES={
+    # Dos workers con su propia L1 sobre la misma caché compartida
+    'default': _nodo('nodo-a'),
+    'nodo_b': _nodo('nodo-b'),
+    'compartida': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'compartida'},
+})
+class TwoTierCacheTest(SimpleTestCase):
+    """Tests para la caché de dos niveles y la invalidación entre workers"""
+
+    def setUp(self):
+        self.a, self.b = caches['default'], caches['nodo_b']
+        self.a.clear()
+        for nodo in (self.a, self.b):
+            nodo._l1.stats.clear()
+
+    def test_segunda_lectura_desde_l1(self):
+        self.a.set('todas_categorias', ['Cascos'])
+        self.a.set('carrito_count_1', 3)
+        for _ in range(3):
+            self.assertEqual(self.a.get('todas_categorias'), ['Cascos'])
+            self.assertEqual(self.a.get('carrito_count_1'), 3)
+        self.assertIsNone(self.a.get('todas_marcas'))
+
+        # Las claves sin prefijo de L1 van siempre a L2
+        self.assertEqual(self.a.stats(), {'l1_hits': 2, 'l2_hits': 4, 'misses': 1, 'l1_entries': 1})
+
+        # El valor de L1 no se comparte con quien lo lee
+        self.a.get('todas_categorias').append('Guantes')
+        self.assertEqual(self.a.get('todas_categorias'), ['Cascos'])
+
+    def test_escritura_en_otro_worker_descarta_l1(self):
+        self.a.set('todas_categorias', ['Cascos'])
+        self.b.get('todas_categorias')
+        caches['compartida'].set('todas_categorias', ['Cascos', 'Guantes'])
+        # Sin aviso, el worker b sigue sirviendo su copia en memoria
+        self.assertEqual(self.b.get('todas_categorias'), ['Cascos'])
+
+        self.a.set('todas_categorias', ['Cascos', 'Botas'])
+        self.assertEqual(self.b.get('todas_categorias'), ['Cascos', 'Botas'])
+        self.a.delete('todas_categorias')
+        self.assertIsNone(self.b.get('todas_categorias'))
+
+    def test_invalidaciones_de_cache_utils_llegan_a_todos(self):
+        from utils.cache_utils import get_tag_versions, invalidate_model_cache, invalidate_tags
+
+        self.a.set('todas_marcas', ['Shoei'])
+        self.assertEqual(self.b.get('todas_marcas'), ['Shoei'])
+        version = get_tag_versions(['productos'])['productos']
+        self.assertEqual(self.b.get('cache_tag_version:productos'), version)
+
+        invalidate_model_cache('marca')
+        invalidate_tags('productos')
+
+        self.assertIsNone(self.b.get('todas_marcas'))
+        self.assertNotEqual(self.b.get('cache_tag_version:productos'), version)
+
+    def test_lectura_anterior_a_una_invalidacion_no_entra_en_l1(self):
+        memoria = self.a._l1
+        generacion = memoria.generacion
+        memoria.descartar([self.a.make_key('todas_categorias')])
+        memoria.set(self.a.make_key('todas_categorias'), b'antiguo', 30, generacion)
+        self.assertEqual(self.a.stats()['l1_entries'], 0)
+
+    def test_l1_no_supera_la_caducidad_de_l2(self):
+        import time
+        self.a.set('todas_categorias', ['Cascos'], 1)
+        for nodo in (self.a, self.b):
+            self.assertEqual(nodo.get('todas_categorias'), ['Cascos'])
+        time.sleep(1.1)
+        for nodo in (self.a, self.b):
+            self.assertIsNone(nodo.get('todas_categorias'))
+
+        # Con timeout=0 no llega a entrar en L1
+        self.a.set('todas_marcas', ['Shoei'], 0)
+        self.assertIsNone(self.b.get('todas_marcas'))
+        self.assertEqual(self.b.stats()['l1_entries'], 0)
+
+    def test_l1_limitada(self):
+        for i in range(5):
+            self.a.set(f'todas_categorias_{i}', i)
+            self.a.get(f'todas_categorias_{i}')
+        self.assertEqual(self.a.stats()['l1_entries'], 3)
+        self.assertEqual(self.a.get('todas_categorias_0'), 0)
+
+
+class GetOrComputeTest(SimpleTestCase):
+    """Tests para la protección contra estampidas de get_or_compute"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.calculos = 0
+
+    def _calcular(self, valor='nuevo', segundos=0):
+        def calcular():
+            import time
+            self.calculos += 1
+            time.sleep(segundos)
+            return valor
+        return calcular
+
+    def test_un_solo_calculo_con_peticiones_concurrentes(self):
+        import threading
+        from utils.cache_utils import get_or_compute
+
+        barrera = threading.Barrier(8)
+        resultados = []
+
+        def peticion():
+            barrera.wait()
+            resultados.append(get_or_compute('productos_populares', self._calcular(segundos=0.2), 60))
+
+        hilos = [threading.Thread(target=peticion) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(self.calculos, 1)
+        self.assertEqual(resultados, ['nuevo'] * 8)
+
+    def test_caducado_se_sirve_mientras_otro_recalcula(self):
+        import time
+        from django.core.cache import cache
+        from utils.cache_utils import Computed, _compute_lock, get_or_compute
+
+        cache.set('productos_populares', Computed('anterior', time.time() - 1, 0.01), 600)
+        cerrojo = _compute_lock('productos_populares', 10)
+        self.assertTrue(cerrojo.acquire(0))
+        try:
+            valor = get_or_compute('productos_populares', self._calcular(), 60, stale_ttl=300)
+        finally:
+            cerrojo.release()
+        self.assertEqual((valor, self.calculos), ('anterior', 0))
+
+        # Sin nadie recalculando, la petición lo recalcula ella misma
+        self.assertEqual(get_or_compute('productos_populares', self._calcular(), 60, stale_ttl=300), 'nuevo')
+        self.assertEqual(get_or_compute('productos_populares', self._calcular(), 60, stale_ttl=300), 'nuevo')
+        self.assertEqual(self.calculos, 1)
+
+    def test_refresco_anticipado(self):
+        import time
+        from unittest import mock
+        from django.core.cache import cache
+        from utils.cache_utils import Computed, get_or_compute
+
+        # Caduca en 1 s y tarda 100 s en calcularse: casi seguro que se adelanta
+        cache.set('productos_populares', Computed('anterior', time.time() + 1, 100), 600)
+        with mock.patch('random.random', return_value=0.5):
+            self.assertEqual(get_or_compute('productos_populares', self._calcular(), 60, beta=0), 'anterior')
+            self.assertEqual(get_or_compute('productos_populares', self._calcular(), 60), 'nuevo')
+        self.assertEqual(self.calculos, 1)
+
+    def test_invalidado_no_se_sirve_caducado(self):
+        from utils.cache_utils import get_or_compute, invalidate_tags
+
+        get_or_compute('productos_total_count', self._calcular('anterior'), 60, tags=['productos'], stale_ttl=300)
+        invalidate_tags('productos')
+        self.assertEqual(get_or_compute('productos_total_count', self._calcular(), 60,
+                                        tags=['productos'], stale_ttl=300), 'nuevo')
+        self.assertEqual(self.calculos, 2)
+
+    def test_invalidacion_durante_el_calculo(self):
+        from utils.cache_utils import get_or_compute, invalidate_tags
+
+        def calcular_con_invalidacion():
+            # Los datos leídos ya no son los últimos cuando termina el cálculo
+            invalidate_tags('productos')
+            return self._calcular('desfasado')()
+
+        get_or_compute('productos_total_count', calcular_con_invalidacion, 60, tags=['productos'])
+        self.assertEqual(get_or_compute('productos_total_count', self._calcular(), 60,
+                                        tags=['productos']), 'nuevo')
+        self.assertEqual(self.calculos, 2)
@@ -34,18 +34,16 @@ class PagoAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         """
         Sobrescribe el método save_model para registrar cambios de estado
-        cuando se edita desde el admin.
+        cuando se edita desde el admin. Pago.save escribe la entrada del
+        historial; aquí solo se añaden la IP y el administrador.
         """
+        historial = None
         if change and 'status' in form.changed_data:
-            # Si se cambió el estado, crear una entrada en el historial
-            HistorialPago.objects.create(
-                pago=obj,
-                estado_anterior=Pago.objects.get(pk=obj.pk).status,
-                estado_nuevo=obj.status,
-                ip_usuario=get_client_ip(request),
-                notas=f"Cambio realizado por el administrador {request.user.username}"
-            )
-        super().save_model(request, obj, form, change)
+            historial = {
+                'ip_usuario': get_client_ip(request),
+                'notas': f"Cambio realizado por el administrador {request.user.username}"
+            }
+        obj.save(historial=historial)
 
 @admin.register(HistorialPago)
 class HistorialPagoAdmin(admin.ModelAdmin):
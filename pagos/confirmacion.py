@@ -0,0 +1,239 @@
+"""
+Confirmación de pagos en dos fases.
+
+1. La petición del cliente valida el formulario, deja el pago en
+   'procesando', encola la autorización y responde al momento con una
+   página que consulta el estado (vista estado_pago).
+2. El worker de tareas llama a la pasarela (autorizar). Si la pasarela
+   responde ya, el pago se cierra allí; si queda pendiente, lo cierra la
+   notificación firmada que la pasarela envía a la vista webhook_pago.
+
+Los datos de la tarjeta no se guardan en la tabla de tareas: se dejan en la
+caché, cifrados (Fernet, con una clave derivada de SECRET_KEY), bajo la
+referencia del pago durante DATOS_TTL segundos y se borran al usarlos. La
+caché compartida nunca ve el número ni el CVV en claro, y un token más
+antiguo que DATOS_TTL no se descifra aunque la caché lo conserve.
+finalizar() bloquea el pago y solo actúa si sigue en 'procesando', de modo
+que el worker y un webhook repetido no pueden cerrarlo dos veces. Un error
+del worker también cierra el pago (como fallido), y vencer_en_proceso(),
+que se ejecuta con liberar_reservas, cierra los que se quedan atascados.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from datetime import timedelta
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from pedidos import reservas
+from .models import Pago
+from .services import PaymentProcessor
+
+logger = logging.getLogger('mototienda.security')
+
+# Segundos que se conservan los datos del método de pago para el worker
+DATOS_TTL = 300
+
+
+def _clave_datos(pago):
+    return f'pagos:datos:{pago.referencia}'
+
+
+def _cifrador():
+    clave = salted_hmac('pagos.confirmacion.datos', 'fernet', algorithm='sha256').digest()
+    return Fernet(base64.urlsafe_b64encode(clave))
+
+
+def _guardar_datos(pago, datos):
+    token = _cifrador().encrypt(json.dumps(datos).encode())
+    cache.set(_clave_datos(pago), token, DATOS_TTL)
+
+
+def _leer_datos(pago):
+    """Datos del método de pago, o None si faltan, caducaron o no se pueden descifrar"""
+    token = cache.get(_clave_datos(pago))
+    if token is None:
+        return None
+    try:
+        return json.loads(_cifrador().decrypt(token, ttl=DATOS_TTL))
+    except InvalidToken:
+        return None
+
+
+def registrar_resultado(pago, success, transaction_id, nombre_metodo, mensaje=''):
+    """
+    Guarda el resultado del cobro en el pago y en el pedido, y confirma o
+    libera el stock reservado. Pago.save registra el cambio en HistorialPago.
+    """
+    with transaction.atomic():
+        pago.status = 'completado' if success else 'fallido'
+        pago.transaccion_id = transaction_id if transaction_id else ''
+        if mensaje:
+            pago.notas = mensaje
+        pago.save()
+
+        if success:
+            pago.pedido.pagado = True
+            pago.pedido.referencia_pago = transaction_id
+            pago.pedido.metodo_pago = nombre_metodo
+            pago.pedido.save()
+            reservas.confirmar(pago.pedido)
+        else:
+            reservas.liberar(pago.pedido)
+
+
+def iniciar_cobro(pago, datos_metodo):
+    """
+    Primera fase: marca el pago como en proceso y encola su autorización.
+
+    Args:
+        pago: Pago pendiente
+        datos_metodo (dict): Datos propios del método (tarjeta, email de
+            PayPal...), que solo se conservan cifrados en caché
+
+    Returns:
+        bool: False si el pago ya no estaba pendiente (doble envío)
+    """
+    from .tareas import autorizar_pago
+
+    with transaction.atomic():
+        if Pago.objects.select_for_update().filter(id=pago.id).values_list('status', flat=True).first() != 'pendiente':
+            return False
+        _guardar_datos(pago, datos_metodo)
+        pago.status = 'procesando'
+        pago.save()
+        autorizar_pago.encolar(pago.id)
+    return True
+
+
+def autorizar(pago_id):
+    """
+    Segunda fase (worker): solicita el cargo a la pasarela y cierra el pago
+    si la respuesta es definitiva.
+    """
+    pago = (Pago.objects.select_related('pedido', 'usuario', 'metodo_pago')
+            .filter(id=pago_id).first())
+    if pago is None or pago.status != 'procesando':
+        return
+
+    datos = _leer_datos(pago)
+    if datos is None:
+        finalizar(pago.id, False, None, "Los datos del pago caducaron. Vuelve a intentarlo.")
+        return
+
+    processor = PaymentProcessor.get_processor(pago.metodo_pago.tipo)
+    try:
+        success, message, transaction_id = processor.process_payment({
+            'monto': pago.monto,
+            'pedido': pago.pedido,
+            'usuario': pago.usuario,
+            'referencia': str(pago.referencia),
+            **datos,
+        })
+    except Exception:
+        # Sin cerrar el pago, la página de espera consultaría para siempre
+        logger.exception(f"Error al autorizar el pago {pago.id}")
+        finalizar(pago.id, False, None, "No se pudo procesar el pago. Inténtalo de nuevo.")
+        return
+    finally:
+        cache.delete(_clave_datos(pago))
+
+    if success is None:
+        # La pasarela confirmará el resultado por webhook
+        Pago.objects.filter(id=pago.id).update(transaccion_id=transaction_id or '')
+        return
+    finalizar(pago.id, success, transaction_id, message)
+
+
+def finalizar(pago_id, success, transaction_id, mensaje=''):
+    """
+    Cierra un pago en proceso con el resultado de la pasarela.
+
+    Returns:
+        bool: False si el pago ya estaba cerrado (notificación repetida)
+    """
+    with transaction.atomic():
+        pago = (Pago.objects.select_for_update()
+                .select_related('pedido', 'metodo_pago').get(id=pago_id))
+        if pago.status != 'procesando':
+            return False
+        registrar_resultado(pago, success, transaction_id, pago.metodo_pago.nombre, mensaje)
+    return True
+
+
+def vencer_en_proceso():
+    """
+    Da por fallidos los pagos que llevan demasiado tiempo en 'procesando'
+    (worker caído, tarea perdida o notificación que no llega), para que
+    liberen su stock y el cliente pueda volver a pagar.
+
+    Los que no llegaron a la pasarela vencen a los PAGOS_PROCESANDO_MINUTOS;
+    los que esperan su notificación (con transaccion_id), a las
+    PAGOS_NOTIFICACION_HORAS, y quedan en el log para revisarlos en la
+    pasarela.
+
+    Returns:
+        int: Pagos cerrados
+    """
+    ahora = timezone.now()
+    sin_respuesta = Q(transaccion_id__isnull=True) | Q(transaccion_id='')
+    vencidos = (Pago.objects.filter(status='procesando')
+                .filter((sin_respuesta & Q(fecha_actualizacion__lt=ahora - timedelta(
+                            minutes=settings.PAGOS_PROCESANDO_MINUTOS)))
+                        | (~sin_respuesta & Q(fecha_actualizacion__lt=ahora - timedelta(
+                            hours=settings.PAGOS_NOTIFICACION_HORAS))))
+                .only('id', 'referencia', 'transaccion_id'))
+
+    cerrados = 0
+    for pago in vencidos:
+        cache.delete(_clave_datos(pago))
+        if pago.transaccion_id:
+            logger.error(f"El pago {pago.id} ({pago.transaccion_id}) no recibió la notificación "
+                         f"de la pasarela; se da por fallido, revisar su estado en la pasarela")
+        else:
+            logger.warning(f"El pago {pago.id} no se llegó a autorizar; se da por fallido")
+        if finalizar(pago.id, False, None, "El pago no se completó a tiempo. Vuelve a intentarlo."):
+            cerrados += 1
+    return cerrados
+
+
+def firmar(cuerpo):
+    """Firma HMAC-SHA256 (hex) de un cuerpo de notificación"""
+    secreto = settings.PAGOS_WEBHOOK_SECRETO.encode()
+    return hmac.new(secreto, cuerpo, hashlib.sha256).hexdigest()
+
+
+def verificar_firma(cuerpo, firma):
+    if not settings.PAGOS_WEBHOOK_SECRETO or not firma:
+        return False
+    return hmac.compare_digest(firmar(cuerpo), firma)
+
+
+def procesar_notificacion(datos):
+    """
+    Aplica una notificación de la pasarela ya verificada.
+
+    Args:
+        datos (dict): referencia, estado ('aprobado' o 'rechazado'),
+            transaccion_id y mensaje
+
+    Returns:
+        bool: True si la notificación cerró el pago
+    """
+    pago = Pago.objects.filter(referencia=datos['referencia']).only('id', 'status').first()
+    if pago is None:
+        logger.warning(f"Notificación de pago con referencia desconocida: {datos['referencia']}")
+        return False
+    aprobado = datos['estado'] == 'aprobado'
+    cerrado = finalizar(pago.id, aprobado, datos.get('transaccion_id'), datos.get('mensaje', ''))
+    if not cerrado:
+        logger.info(f"Notificación repetida para el pago {pago.id} (estado {pago.status})")
+    return cerrado
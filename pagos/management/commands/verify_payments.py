@@ -0,0 +1,170 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from pagos.models import Pago, checksum_pago
+
+logger = logging.getLogger('mototienda.security')
+
+CAMPOS = ('id', 'referencia', 'pedido_id', 'monto', 'status', 'checksum')
+
+
+def verificar_bloque(filas):
+    """
+    Recalcula el checksum de un bloque de pagos (se ejecuta en los procesos hijos).
+
+    Args:
+        filas (list): tuplas con CAMPOS
+
+    Returns:
+        tuple: (filas manipuladas, número de pagos sin checksum)
+    """
+    manipuladas, sin_checksum = [], 0
+    for pago_id, referencia, pedido_id, monto, status, checksum in filas:
+        if not checksum:
+            # Pagos creados y nunca actualizados: todavía no tienen checksum
+            sin_checksum += 1
+        elif checksum_pago(referencia, pedido_id, monto, status) != checksum:
+            manipuladas.append((pago_id, str(referencia), pedido_id, str(monto), status))
+    return manipuladas, sin_checksum
+
+
+class Command(BaseCommand):
+    help = ('Verifica el checksum de todos los pagos en bloques y en paralelo, e informa '
+            'de los que no coinciden (posible manipulación)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Solo los pagos actualizados desde la última ejecución. Los cambios hechos '
+                 'fuera del ORM no tocan fecha_actualizacion: conviene una pasada completa periódica'
+        )
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos que calculan los checksums (por defecto, uno por CPU)'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help='Pagos leídos y verificados por bloque (por defecto 5000)'
+        )
+        parser.add_argument(
+            '--informe',
+            help='Fichero CSV donde escribir los pagos que no coinciden'
+        )
+        parser.add_argument(
+            '--estado', default=os.path.join(settings.BASE_DIR, 'logs', 'verify_payments.json'),
+            help='Fichero donde se guardan la fecha de la última ejecución y los pagos que no '
+                 'coincidieron, que el modo incremental vuelve a verificar siempre'
+        )
+
+    def handle(self, *args, **options):
+        inicio_ejecucion = timezone.now()
+        pagos = Pago.objects.order_by('id')
+        desde, pendientes = self._ultima_ejecucion(options['estado']) if options['incremental'] else (None, [])
+        if desde:
+            # Los que ya no coincidían se verifican hasta que se corrijan,
+            # aunque no se hayan vuelto a actualizar
+            pagos = pagos.filter(Q(fecha_actualizacion__gte=desde) | Q(id__in=pendientes))
+            self.stdout.write(f'Modo incremental: pagos actualizados desde {desde.isoformat()}'
+                              + (f' y {len(pendientes)} que no coincidían' if pendientes else ''))
+        elif options['incremental']:
+            self.stdout.write('Sin ejecuciones anteriores: se verifican todos los pagos')
+
+        procesos = max(1, options['procesos'])
+        pool = None
+        if procesos > 1:
+            # Los procesos hijos no deben heredar la conexión abierta
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=procesos)
+
+        inicio = time.monotonic()
+        total = sin_checksum = 0
+        manipuladas = []
+        try:
+            for resultado, num_filas in self._verificar(pagos, options['lote'], pool, procesos):
+                filas_manipuladas, sin = resultado
+                manipuladas.extend(filas_manipuladas)
+                sin_checksum += sin
+                total += num_filas
+        finally:
+            if pool:
+                pool.shutdown()
+        segundos = time.monotonic() - inicio
+
+        if options['informe']:
+            self._escribir_informe(options['informe'], manipuladas)
+        self._guardar_ejecucion(options['estado'], inicio_ejecucion, [fila[0] for fila in manipuladas])
+
+        velocidad = total / segundos if segundos else total
+        self.stdout.write(
+            f'Pagos verificados: {total} en {segundos:.1f} s ({velocidad:.0f} pagos/s); '
+            f'sin checksum: {sin_checksum}; no coinciden: {len(manipuladas)}.'
+        )
+        if manipuladas:
+            for pago_id, referencia, *_ in manipuladas[:20]:
+                logger.warning(f"Checksum no válido en el pago {pago_id} ({referencia})")
+            raise CommandError(f'{len(manipuladas)} pagos con checksum no válido')
+        self.stdout.write(self.style.SUCCESS('Todos los checksums coinciden.'))
+
+    def _bloques(self, pagos, lote):
+        """Lee los pagos como tuplas con un cursor por bloques (memoria constante)"""
+        bloque = []
+        for fila in pagos.values_list(*CAMPOS).iterator(chunk_size=lote):
+            bloque.append(fila)
+            if len(bloque) >= lote:
+                yield bloque
+                bloque = []
+        if bloque:
+            yield bloque
+
+    def _verificar(self, pagos, lote, pool, procesos):
+        """
+        Verifica los bloques a medida que se leen. Con pool se mantienen como
+        mucho dos bloques por proceso en vuelo, para no cargar toda la tabla.
+        """
+        if not pool:
+            for bloque in self._bloques(pagos, lote):
+                yield verificar_bloque(bloque), len(bloque)
+            return
+
+        en_vuelo = deque()
+        for bloque in self._bloques(pagos, lote):
+            en_vuelo.append((pool.submit(verificar_bloque, bloque), len(bloque)))
+            if len(en_vuelo) >= procesos * 2:
+                futuro, num_filas = en_vuelo.popleft()
+                yield futuro.result(), num_filas
+        while en_vuelo:
+            futuro, num_filas = en_vuelo.popleft()
+            yield futuro.result(), num_filas
+
+    def _escribir_informe(self, ruta, manipuladas):
+        with open(ruta, 'w', newline='', encoding='utf-8') as fichero:
+            escritor = csv.writer(fichero)
+            escritor.writerow(['pago_id', 'referencia', 'pedido_id', 'monto', 'status'])
+            escritor.writerows(manipuladas)
+        self.stdout.write(f'Informe escrito en {ruta}')
+
+    def _ultima_ejecucion(self, ruta):
+        """Fecha de la última ejecución y pagos que no coincidían, o (None, [])"""
+        try:
+            with open(ruta, encoding='utf-8') as fichero:
+                estado = json.load(fichero)
+            return (datetime.datetime.fromisoformat(estado['ultima_ejecucion']),
+                    [int(pago_id) for pago_id in estado.get('no_coinciden', [])])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, []
+
+    def _guardar_ejecucion(self, ruta, momento, manipuladas):
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as fichero:
+            json.dump({'ultima_ejecucion': momento.isoformat(), 'no_coinciden': manipuladas}, fichero)
@@ -4,8 +4,10 @@ from django.db import models
 from django.db import models
 from django.contrib.auth.models import User
 from pedidos.models import Pedido
+from utils.tracking import FieldTracker
 import uuid
 import hashlib
+from decimal import Decimal
 from django.utils import timezone
 from django.conf import settings
 import logging
@@ -32,6 +34,19 @@ class MetodoPago(models.Model):
     def __str__(self):
         return self.nombre
 
+def checksum_pago(referencia, pedido_id, monto, status):
+    """
+    Hash SHA-512 de los datos críticos de un pago.
+    
+    Es una función de módulo para poder calcularlo sin instanciar el modelo
+    (comando verify_payments). El monto se normaliza a dos decimales para que
+    10, 10.0 y Decimal('10.00') den el mismo resultado.
+    """
+    monto = Decimal(str(monto)).quantize(Decimal('0.01'))
+    data_string = f"{referencia}:{pedido_id}:{monto}:{status}"
+    salt = settings.SECRET_KEY[:16]  # Usamos parte de la clave secreta como sal
+    return hashlib.sha512((data_string + salt).encode('utf-8')).hexdigest()
+
 class Pago(models.Model):
     """
     Modelo que registra los pagos realizados, sin almacenar datos sensibles
@@ -69,45 +84,52 @@ class Pago(models.Model):
     # Suma de verificación para detectar manipulaciones (seguridad adicional)
     checksum = models.CharField(max_length=128, blank=True)
     
-    def save(self, *args, **kwargs):
-        """Sobrescribimos el método save para crear un checksum de verificación"""
+    # Valores cargados de la BD: evitan releer el pago en save()
+    tracker = FieldTracker(['status'])
+    
+    def calcular_checksum(self):
+        """Hash de los datos críticos del pago (usa pedido_id: no carga el pedido)"""
+        return checksum_pago(self.referencia, self.pedido_id, self.monto, self.status)
+    
+    def save(self, *args, historial=None, **kwargs):
+        """
+        Sobrescribimos el método save para crear un checksum de verificación
+        y registrar en HistorialPago los cambios de estado.
+        
+        El estado anterior sale de `tracker`, de modo que un cambio de estado
+        es un UPDATE y un INSERT, sin releer el pago.
+        
+        Args:
+            historial (dict, optional): ip_usuario y notas para la entrada del
+                historial; al crear el pago, si se indica, se registra también
+                el estado inicial
+        """
+        creado = self._state.adding
+        estado_anterior = '' if creado else self.tracker.previous('status')
+        registrar = historial is not None if creado else self.tracker.has_changed('status')
+        
         # Solo creamos checksum para pagos existentes
         if self.pk:
-            # Crear un hash con datos críticos
-            data_string = f"{self.referencia}:{self.pedido.id}:{self.monto}:{self.status}"
-            salt = settings.SECRET_KEY[:16]  # Usamos parte de la clave secreta como sal
-            
-            # Creamos el hash
-            self.checksum = hashlib.sha512((data_string + salt).encode('utf-8')).hexdigest()
-            
-            # Registrar cambio de estado si ha cambiado
-            if self.pk and self._state.adding is False:
-                try:
-                    old_pago = Pago.objects.get(pk=self.pk)
-                    if old_pago.status != self.status:
-                        # Registrar el cambio en el historial
-                        HistorialPago.objects.create(
-                            pago=self,
-                            estado_anterior=old_pago.status,
-                            estado_nuevo=self.status
-                        )
-                        
-                        # Registrar en log de seguridad si es completado o fallido
-                        if self.status in ['completado', 'fallido', 'reembolsado']:
-                            logger.info(f"Pago {self.referencia} cambió de {old_pago.status} a {self.status}")
-                except Pago.DoesNotExist:
-                    pass
-                
+            self.checksum = self.calcular_checksum()
+        
         super().save(*args, **kwargs)
+        
+        if registrar:
+            HistorialPago.objects.create(
+                pago=self,
+                estado_anterior=estado_anterior,
+                estado_nuevo=self.status,
+                **(historial or {})
+            )
+            
+            # Registrar en log de seguridad si es completado o fallido
+            if self.status in ['completado', 'fallido', 'reembolsado']:
+                logger.info(f"Pago {self.referencia} cambió de {estado_anterior} a {self.status}")
     
     def verify_integrity(self):
         """Verifica que el pago no ha sido manipulado comparando checksums"""
-        data_string = f"{self.referencia}:{self.pedido.id}:{self.monto}:{self.status}"
-        salt = settings.SECRET_KEY[:16]
-        calculated_checksum = hashlib.sha512((data_string + salt).encode('utf-8')).hexdigest()
-        
         # Devuelve True si coinciden, False si hay manipulación
-        return calculated_checksum == self.checksum
+        return self.calcular_checksum() == self.checksum
     
     def __str__(self):
         return f"Pago {self.referencia} - {self.get_status_display()}"
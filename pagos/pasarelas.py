@@ -0,0 +1,203 @@
+"""
+Clientes de las pasarelas de pago.
+
+Los procesadores de services.py no hablan con la red directamente: piden
+el cliente configurado con obtener_pasarela() y esperan (await) su
+respuesta. Así, servido por ASGI, un worker puede tener decenas de cobros
+en vuelo sin ocupar un hilo por cada uno.
+
+La pasarela se elige en settings.PAGOS_PASARELA:
+
+    PAGOS_PASARELA = {
+        'BACKEND': 'pagos.pasarelas.PasarelaHTTP',
+        'OPCIONES': {'url': 'https://...', 'api_key': '...', 'timeout': 10},
+    }
+
+PasarelaSimulada responde en local (desarrollo y tests); PasarelaHTTP
+reutiliza un pool de conexiones por bucle de eventos (requiere httpx). Los
+cobros síncronos (tareas, comandos) usan un bucle por llamada y cierran su
+cliente al terminar (PaymentProcessor._procesar_sincrono).
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+import weakref
+from dataclasses import dataclass
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('mototienda.security')
+
+
+class ErrorPasarela(Exception):
+    """La pasarela no respondió (timeout, error de red o respuesta inválida)"""
+    pass
+
+
+@dataclass
+class RespuestaPasarela:
+    aprobado: bool
+    mensaje: str
+    transaccion_id: str = None
+    # La pasarela aceptó la solicitud y enviará el resultado por webhook
+    pendiente: bool = False
+
+
+class Pasarela:
+    """
+    Interfaz de un cliente de pasarela.
+
+    Las subclases implementan cobrar(); cerrar() libera las conexiones del
+    bucle de eventos en curso.
+    """
+
+    def __init__(self, timeout=10, **opciones):
+        self.timeout = timeout
+
+    async def cobrar(self, operacion, monto, referencia, datos):
+        """
+        Solicita un cargo a la pasarela.
+
+        Args:
+            operacion (str): 'tarjeta' o 'paypal'
+            monto (Decimal): Importe a cobrar
+            referencia (str): Referencia del pedido en la tienda
+            datos (dict): Datos propios del método (nunca se registran)
+
+        Returns:
+            RespuestaPasarela
+
+        Raises:
+            ErrorPasarela: Si no se obtuvo respuesta
+        """
+        raise NotImplementedError("Las subclases deben implementar este método.")
+
+    async def cerrar(self):
+        pass
+
+
+class PasarelaSimulada(Pasarela):
+    """
+    Pasarela local que imita la latencia y los rechazos de una real.
+
+    Opciones:
+        latencia (tuple): Segundos mínimo y máximo de respuesta
+        tasas_exito (dict): Probabilidad de aprobación por operación
+        tasa_exito (float, optional): Si se indica, sustituye a tasas_exito
+            (con 1.0 o 0.0 el resultado es determinista, útil en tests)
+    """
+    ERRORES = {
+        'tarjeta': [
+            "Fondos insuficientes",
+            "Tarjeta rechazada por el banco",
+            "Tarjeta expirada",
+            "Error de comunicación con el banco",
+        ],
+        'paypal': ["Error en el proceso de pago con PayPal"],
+    }
+    PREFIJOS = {'tarjeta': 'card_', 'paypal': 'PP-'}
+
+    def __init__(self, latencia=(1, 2), tasas_exito=None, tasa_exito=None, **opciones):
+        super().__init__(**opciones)
+        self.latencia = latencia
+        self.tasas_exito = tasas_exito or {'tarjeta': 0.9, 'paypal': 0.95}
+        self.tasa_exito = tasa_exito
+
+    async def cobrar(self, operacion, monto, referencia, datos):
+        minimo, maximo = self.latencia
+        if maximo:
+            await asyncio.sleep(random.uniform(minimo, maximo))
+
+        tasa = self.tasa_exito if self.tasa_exito is not None else self.tasas_exito.get(operacion, 0.9)
+        if random.random() < tasa:
+            transaccion_id = f"{self.PREFIJOS.get(operacion, '')}{int(time.time())}_{uuid.uuid4().hex[:10]}"
+            return RespuestaPasarela(True, "Pago procesado correctamente", transaccion_id)
+        return RespuestaPasarela(False, random.choice(self.ERRORES.get(operacion, ["Pago rechazado"])))
+
+
+class PasarelaHTTP(Pasarela):
+    """
+    Pasarela remota por HTTP con un cliente asíncrono compartido.
+
+    Cada bucle de eventos tiene su propio httpx.AsyncClient (un cliente no
+    puede usarse desde otro bucle); con ASGI hay un único bucle por proceso,
+    así que todas las peticiones comparten el pool de conexiones.
+
+    Opciones:
+        url (str): URL base de la API de la pasarela
+        api_key (str): Credencial enviada como Bearer
+        timeout (float): Segundos máximos de lectura
+        timeout_conexion (float): Segundos máximos para conectar
+        max_conexiones (int): Tamaño del pool por proceso
+    """
+
+    def __init__(self, url, api_key='', timeout=10, timeout_conexion=3, max_conexiones=100, **opciones):
+        super().__init__(timeout=timeout, **opciones)
+        self.url = url.rstrip('/')
+        self.api_key = api_key
+        self.timeout_conexion = timeout_conexion
+        self.max_conexiones = max_conexiones
+        self._clientes = weakref.WeakKeyDictionary()
+
+    def _cliente(self):
+        import httpx
+
+        bucle = asyncio.get_running_loop()
+        cliente = self._clientes.get(bucle)
+        if cliente is None or cliente.is_closed:
+            cliente = httpx.AsyncClient(
+                base_url=self.url,
+                headers={'Authorization': f'Bearer {self.api_key}'},
+                timeout=httpx.Timeout(self.timeout, connect=self.timeout_conexion),
+                limits=httpx.Limits(max_connections=self.max_conexiones,
+                                    max_keepalive_connections=self.max_conexiones // 5 or 1),
+            )
+            self._clientes[bucle] = cliente
+        return cliente
+
+    async def cobrar(self, operacion, monto, referencia, datos):
+        import httpx
+
+        try:
+            respuesta = await self._cliente().post(f'/{operacion}/cargos', json={
+                'monto': str(monto),
+                'referencia': referencia,
+                **datos,
+            })
+            respuesta.raise_for_status()
+            contenido = respuesta.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise ErrorPasarela(f"{type(e).__name__}: {e}") from e
+
+        return RespuestaPasarela(
+            aprobado=contenido.get('estado') == 'aprobado',
+            mensaje=contenido.get('mensaje', ''),
+            transaccion_id=contenido.get('id'),
+            pendiente=contenido.get('estado') == 'pendiente',
+        )
+
+    async def cerrar(self):
+        bucle = asyncio.get_running_loop()
+        cliente = self._clientes.pop(bucle, None)
+        if cliente is not None:
+            await cliente.aclose()
+
+
+@lru_cache(maxsize=None)
+def obtener_pasarela():
+    """Devuelve el cliente configurado en PAGOS_PASARELA (uno por proceso)"""
+    config = getattr(settings, 'PAGOS_PASARELA', {})
+    clase = import_string(config.get('BACKEND', 'pagos.pasarelas.PasarelaSimulada'))
+    return clase(**config.get('OPCIONES', {}))
+
+
+@receiver(setting_changed)
+def _reiniciar_pasarela(setting, **kwargs):
+    if setting == 'PAGOS_PASARELA':
+        obtener_pasarela.cache_clear()
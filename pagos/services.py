@@ -2,14 +2,15 @@
 Servicio de procesamiento de pagos que simula la integración con pasarelas de pago
 y cumple con buenas prácticas de seguridad PCI DSS.
 """
+import asyncio
 import logging
 import uuid
 import time
-import random
 import hashlib
 from decimal import Decimal
 from django.conf import settings
 from .models import Pago, HistorialPago
+from .pasarelas import ErrorPasarela, obtener_pasarela
 from django.utils import timezone
 
 logger = logging.getLogger('mototienda.security')
@@ -20,6 +21,10 @@ class PaymentProcessor:
     pasarelas de pago y asegura que los datos sensibles se manejen correctamente.
     """
     
+    # Los métodos que esperan a una pasarela se cobran en segundo plano
+    # (ver confirmacion.py); el resto se resuelve en la propia petición
+    requiere_pasarela = False
+    
     @staticmethod
     def get_processor(method_type):
         """
@@ -48,6 +53,60 @@ class PaymentProcessor:
         """
         raise NotImplementedError("Las subclases deben implementar este método.")
     
+    async def aprocess_payment(self, payment_data):
+        """
+        Versión asíncrona de process_payment, la que usan las vistas.
+        
+        Por defecto llama a la versión síncrona, válido para los métodos que
+        no esperan a ninguna pasarela; los que sí lo hacen la sobrescriben
+        para no bloquear el bucle de eventos mientras llega la respuesta.
+        """
+        return self.process_payment(payment_data)
+    
+    def _procesar_sincrono(self, payment_data):
+        """
+        Ejecuta aprocess_payment en un bucle de eventos propio.
+        
+        El bucle solo vive durante esta llamada, así que las conexiones que
+        la pasarela abra para él se cierran al terminar: nadie volverá a
+        usarlas. Nunca se ejecuta en el bucle de ASGI, cuyo pool se comparte.
+        """
+        async def procesar():
+            try:
+                return await self.aprocess_payment(payment_data)
+            finally:
+                await obtener_pasarela().cerrar()
+        return asyncio.run(procesar())
+    
+    async def _cobrar(self, operacion, payment_data, datos_pasarela):
+        """
+        Solicita el cargo a la pasarela configurada y registra el intento.
+        
+        Returns:
+            tuple: (bool, str, str) - (éxito, mensaje, ID de transacción); el
+            éxito es None si la pasarela confirmará el resultado por webhook
+        """
+        # La referencia del pago identifica después su notificación (webhook)
+        referencia = payment_data.get('referencia') or f"PED-{getattr(payment_data['pedido'], 'id', '')}"
+        try:
+            respuesta = await obtener_pasarela().cobrar(
+                operacion, payment_data['monto'], referencia, datos_pasarela
+            )
+        except ErrorPasarela as e:
+            logger.error(f"Pasarela sin respuesta ({operacion}): {e}")
+            msg = "Error de comunicación con la pasarela de pago. Inténtalo de nuevo."
+            self._log_payment_attempt(payment_data, False, msg)
+            return False, msg, None
+        
+        if respuesta.pendiente:
+            self._log_payment_attempt(payment_data, True, f"Pendiente de confirmación: {respuesta.mensaje}")
+            return None, respuesta.mensaje, respuesta.transaccion_id
+        
+        self._log_payment_attempt(payment_data, respuesta.aprobado, respuesta.mensaje)
+        if respuesta.aprobado:
+            return True, respuesta.mensaje, respuesta.transaccion_id
+        return False, respuesta.mensaje, None
+    
     def validate_payment_data(self, payment_data):
         """
         Valida los datos de pago comunes a todos los métodos.
@@ -128,11 +187,17 @@ class PaymentProcessor:
 
 class CardPaymentProcessor(PaymentProcessor):
     """
-    Procesador para pagos con tarjeta que simula una integración con un gateway de pago
+    Procesador para pagos con tarjeta que se integra con la pasarela configurada
     y cumple con las directrices de PCI DSS.
     """
     
+    requiere_pasarela = True
+    
     def process_payment(self, payment_data):
+        """Versión síncrona (comandos, tareas, shell): ver aprocess_payment"""
+        return self._procesar_sincrono(payment_data)
+    
+    async def aprocess_payment(self, payment_data):
         """
         Procesa un pago con tarjeta.
         
@@ -160,32 +225,13 @@ class CardPaymentProcessor(PaymentProcessor):
             self._log_payment_attempt(payment_data, False, msg)
             return False, msg, None
             
-        # En un sistema real, aquí se integraría con el procesador de pagos
-        # Para el simulador, introducimos un retraso aleatorio y posibilidad de fallo
-        time.sleep(random.uniform(1, 2))  # Simular latencia de API
-        
-        # Simular respuesta del procesador (aleatoria para demo)
-        success_rate = 0.9  # 90% de probabilidad de éxito
-        success = random.random() < success_rate
-        
-        # Generar ID de transacción única
-        transaction_id = f"card_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-        
-        if success:
-            msg = "Pago procesado correctamente"
-            self._log_payment_attempt(payment_data, True, msg)
-            return True, msg, transaction_id
-        else:
-            # Simulación de errores típicos
-            errors = [
-                "Fondos insuficientes",
-                "Tarjeta rechazada por el banco",
-                "Tarjeta expirada",
-                "Error de comunicación con el banco"
-            ]
-            error_msg = random.choice(errors)
-            self._log_payment_attempt(payment_data, False, error_msg)
-            return False, error_msg, None
+        # Cargo en la pasarela (la espera no bloquea el worker)
+        return await self._cobrar('tarjeta', payment_data, {
+            'numero': payment_data['card_number'].replace(' ', ''),
+            'expiracion': payment_data['card_expiry'],
+            'cvv': payment_data['cvv'],
+            'titular': payment_data.get('card_holder', ''),
+        })
     
     def _validate_card_data(self, payment_data):
         """
@@ -268,9 +314,15 @@ class BankTransferProcessor(PaymentProcessor):
 class PayPalProcessor(PaymentProcessor):
     """Procesador para pagos vía PayPal."""
     
+    requiere_pasarela = True
+    
     def process_payment(self, payment_data):
+        """Versión síncrona (comandos, tareas, shell): ver aprocess_payment"""
+        return self._procesar_sincrono(payment_data)
+    
+    async def aprocess_payment(self, payment_data):
         """
-        Simula un pago a través de PayPal.
+        Procesa un pago a través de PayPal.
         
         Args:
             payment_data (dict): Datos del pago incluyendo:
@@ -288,24 +340,9 @@ class PayPalProcessor(PaymentProcessor):
             self._log_payment_attempt(payment_data, False, error_msg)
             return False, error_msg, None
             
-        # Simular una redirección a PayPal y respuesta
-        time.sleep(random.uniform(1, 2))  # Simular latencia
-        
-        # Simulación de respuesta
-        success_rate = 0.95  # 95% de probabilidad de éxito
-        success = random.random() < success_rate
-        
-        # Generar ID de transacción PayPal
-        paypal_id = f"PP-{int(time.time())}-{uuid.uuid4().hex[:10].upper()}"
-        
-        if success:
-            msg = "Pago por PayPal completado correctamente"
-            self._log_payment_attempt(payment_data, True, msg)
-            return True, msg, paypal_id
-        else:
-            error_msg = "Error en el proceso de pago con PayPal"
-            self._log_payment_attempt(payment_data, False, error_msg)
-            return False, error_msg, None
+        return await self._cobrar('paypal', payment_data, {
+            'email': payment_data.get('paypal_email', ''),
+        })
 
 class CashOnDeliveryProcessor(PaymentProcessor):
     """Procesador para pagos contra entrega."""
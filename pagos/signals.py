@@ -31,9 +31,9 @@ def log_historial_pago(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Pago)
 def pago_saved(sender, instance, created, **kwargs):
     """Invalidar caché cuando se guarda un pago"""
-    invalidate_model_cache('pedido', instance.pedido.id)
+    invalidate_model_cache('pedido', instance.pedido_id)
     
 @receiver(post_delete, sender=Pago)
 def pago_deleted(sender, instance, **kwargs):
     """Invalidar caché cuando se elimina un pago"""
-    invalidate_model_cache('pedido', instance.pedido.id)
\ No newline at end of file
+    invalidate_model_cache('pedido', instance.pedido_id)
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""
+Tareas en segundo plano de los pagos (ver tareas/cola.py).
+"""
+from tareas.cola import tarea
+from . import confirmacion
+
+
+@tarea(max_intentos=1)
+def autorizar_pago(pago_id):
+    """Solicita el cargo a la pasarela y cierra el pago (ver confirmacion.py)"""
+    confirmacion.autorizar(pago_id)
@@ -1,3 +1,352 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from catalogo.models import Categoria, Marca, Producto
+from pedidos import reservas
+from pedidos.models import ItemPedido, Pedido
+from . import confirmacion
+from .models import MetodoPago, Pago
+from .pasarelas import ErrorPasarela, Pasarela, RespuestaPasarela, obtener_pasarela
+from .services import PaymentProcessor
+
+
+def pasarela_simulada(tasa_exito, latencia=(0, 0)):
+    return override_settings(PAGOS_PASARELA={
+        'BACKEND': 'pagos.pasarelas.PasarelaSimulada',
+        'OPCIONES': {'latencia': latencia, 'tasa_exito': tasa_exito},
+    })
+
+
+class PasarelaCaida(Pasarela):
+    """Pasarela que nunca responde a tiempo"""
+    async def cobrar(self, operacion, monto, referencia, datos):
+        raise ErrorPasarela('ReadTimeout')
+
+
+class PasarelaDiferida(Pasarela):
+    """Pasarela que acepta el cargo y confirma el resultado por webhook"""
+    async def cobrar(self, operacion, monto, referencia, datos):
+        return RespuestaPasarela(False, 'En revisión', 'diferida-1', pendiente=True)
+
+
+class PasarelaConClientes(Pasarela):
+    """Pasarela que, como PasarelaHTTP, abre un cliente por bucle de eventos"""
+    def __init__(self, **opciones):
+        super().__init__(**opciones)
+        self.clientes = {}
+
+    async def cobrar(self, operacion, monto, referencia, datos):
+        self.clientes.setdefault(asyncio.get_running_loop(), {'cerrado': False})
+        return RespuestaPasarela(True, 'Aprobado', f'cliente-{len(self.clientes)}')
+
+    async def cerrar(self):
+        cliente = self.clientes.get(asyncio.get_running_loop())
+        if cliente is not None:
+            cliente['cerrado'] = True
+
+
+class PasarelaRota(Pasarela):
+    """Pasarela con un error inesperado (no de comunicación)"""
+    async def cobrar(self, operacion, monto, referencia, datos):
+        raise KeyError('estado')
+
+
+class ProcesamientoPagoTest(TestCase):
+    """Tests del cobro en dos fases contra las pasarelas de prueba"""
+
+    DATOS_TARJETA = {'titular': 'Cliente Prueba', 'numero_tarjeta': '4111 1111 1111 1111',
+                     'fecha_expiracion': '12/99', 'cvv': '123'}
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='cliente', email='cliente@example.com',
+                                                password='testpassword')
+        self.producto = Producto.objects.create(
+            nombre='Casco', descripcion='Casco', precio=100, stock=5,
+            categoria=Categoria.objects.create(nombre='Cascos'),
+            marca=Marca.objects.create(nombre='Shoei'),
+        )
+        self.pedido = Pedido.objects.create(usuario=self.usuario, nombre_completo='Cliente',
+                                            direccion='Calle', ciudad='Ciudad',
+                                            codigo_postal='12345', telefono='123456789')
+        ItemPedido.objects.create(pedido=self.pedido, producto=self.producto, precio=100, cantidad=2)
+        reservas.reservar(self.pedido, [(self.producto.id, '', 2)])
+        self.client.login(username='cliente', password='testpassword')
+
+    def _pago(self, tipo):
+        metodo = MetodoPago.objects.create(nombre=tipo.title(), tipo=tipo)
+        return Pago.objects.create(pedido=self.pedido, usuario=self.usuario, metodo_pago=metodo,
+                                   monto=self.pedido.total())
+
+    @pasarela_simulada(1.0)
+    def test_pago_tarjeta_aprobado(self):
+        pago = self._pago('tarjeta')
+        response = self.client.get(reverse('pagos:procesar_pago', args=[pago.id]))
+        self.assertEqual(response.status_code, 200)
+        
+        # La petición solo encola el cobro; el worker lo autoriza al confirmar
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('pagos:procesar_pago', args=[pago.id]), self.DATOS_TARJETA)
+        self.assertRedirects(response, reverse('pagos:pago_en_proceso', args=[pago.id]),
+                             fetch_redirect_response=False)
+
+        pago.refresh_from_db()
+        self.pedido.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual(pago.status, 'completado')
+        self.assertTrue(pago.transaccion_id.startswith('card_'))
+        self.assertTrue(self.pedido.pagado)
+        self.assertEqual((self.producto.stock, self.producto.reservado), (3, 0))
+        self.assertEqual(list(pago.historial.values_list('estado_nuevo', flat=True).order_by('id')),
+                         ['procesando', 'completado'])
+        
+        response = self.client.get(reverse('pagos:pago_en_proceso', args=[pago.id]))
+        self.assertRedirects(response, reverse('pedidos:detalle_pedido', args=[self.pedido.id]),
+                             fetch_redirect_response=False)
+
+    @pasarela_simulada(0.0)
+    def test_pago_paypal_rechazado_libera_stock(self):
+        pago = self._pago('paypal')
+        response = self.client.get(reverse('pagos:paypal_redirect', args=[pago.id]))
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('pagos:paypal_redirect', args=[pago.id]))
+
+        pago.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual(pago.status, 'fallido')
+        self.assertEqual((self.producto.stock, self.producto.reservado), (5, 0))
+        
+        response = self.client.get(reverse('pagos:pago_en_proceso', args=[pago.id]))
+        self.assertRedirects(response, reverse('pagos:seleccionar_metodo_pago', args=[self.pedido.id]),
+                             fetch_redirect_response=False)
+
+    def test_estado_pago_mientras_se_procesa(self):
+        pago = self._pago('tarjeta')
+        # Sin ejecutar las tareas encoladas el pago queda en proceso
+        self.client.post(reverse('pagos:procesar_pago', args=[pago.id]), self.DATOS_TARJETA)
+        response = self.client.get(reverse('pagos:estado_pago', args=[pago.id]))
+        self.assertEqual(response.json(), {'estado': 'procesando', 'finalizado': False})
+        response = self.client.get(reverse('pagos:pago_en_proceso', args=[pago.id]))
+        self.assertContains(response, reverse('pagos:estado_pago', args=[pago.id]))
+        
+        # Un segundo envío no vuelve a cobrar
+        response = self.client.post(reverse('pagos:procesar_pago', args=[pago.id]), self.DATOS_TARJETA)
+        self.assertRedirects(response, reverse('pagos:pago_en_proceso', args=[pago.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(pago.historial.count(), 1)
+
+    @override_settings(PAGOS_PASARELA={'BACKEND': 'pagos.tests.PasarelaDiferida'},
+                       PAGOS_WEBHOOK_SECRETO='secreto-de-prueba')
+    def test_confirmacion_por_webhook(self):
+        pago = self._pago('tarjeta')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('pagos:procesar_pago', args=[pago.id]), self.DATOS_TARJETA)
+        pago.refresh_from_db()
+        self.assertEqual((pago.status, pago.transaccion_id), ('procesando', 'diferida-1'))
+        
+        cuerpo = json.dumps({'referencia': str(pago.referencia), 'estado': 'aprobado',
+                             'transaccion_id': 'diferida-1', 'mensaje': 'Aprobado'}).encode()
+        url = reverse('pagos:webhook_pago')
+        response = self.client.post(url, cuerpo, content_type='application/json',
+                                    HTTP_X_PASARELA_FIRMA='firma-falsa')
+        self.assertEqual(response.status_code, 403)
+        
+        firma = confirmacion.firmar(cuerpo)
+        response = self.client.post(url, cuerpo, content_type='application/json',
+                                    HTTP_X_PASARELA_FIRMA=firma)
+        self.assertEqual(response.json(), {'ok': True, 'procesada': True})
+        pago.refresh_from_db()
+        self.assertEqual(pago.status, 'completado')
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 3)
+        
+        # Las notificaciones repetidas no tienen efecto
+        response = self.client.post(url, cuerpo, content_type='application/json',
+                                    HTTP_X_PASARELA_FIRMA=firma)
+        self.assertEqual(response.json(), {'ok': True, 'procesada': False})
+        self.assertEqual(pago.historial.filter(estado_nuevo='completado').count(), 1)
+
+    def test_datos_de_tarjeta_cifrados_en_cache(self):
+        pago = self._pago('tarjeta')
+        datos = {'card_number': '4111111111111111', 'card_expiry': '12/99', 'cvv': '123'}
+        confirmacion.iniciar_cobro(pago, datos)
+        guardado = confirmacion.cache.get(confirmacion._clave_datos(pago))
+        self.assertIsInstance(guardado, bytes)
+        self.assertNotIn(b'4111111111111111', guardado)
+        self.assertNotIn(b'"123"', guardado)
+        self.assertEqual(confirmacion._leer_datos(pago), datos)
+
+        # Un token manipulado o demasiado antiguo no se descifra
+        confirmacion.cache.set(confirmacion._clave_datos(pago), guardado[:-2] + b'xx')
+        self.assertIsNone(confirmacion._leer_datos(pago))
+        confirmacion.cache.set(confirmacion._clave_datos(pago), guardado)
+        with mock.patch('time.time', return_value=time.time() + confirmacion.DATOS_TTL + 60):
+            self.assertIsNone(confirmacion._leer_datos(pago))
+
+    @override_settings(PAGOS_PASARELA={'BACKEND': 'pagos.tests.PasarelaRota'})
+    def test_error_del_worker_cierra_el_pago(self):
+        pago = self._pago('tarjeta')
+        # Las tareas se ejecutan al salir de captureOnCommitCallbacks
+        with self.assertLogs('mototienda.security', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('pagos:procesar_pago', args=[pago.id]), self.DATOS_TARJETA)
+        pago.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual(pago.status, 'fallido')
+        self.assertEqual(self.producto.reservado, 0)
+        self.assertIsNone(confirmacion.cache.get(confirmacion._clave_datos(pago)))
+
+    def test_pagos_atascados_en_proceso_vencen(self):
+        from datetime import timedelta
+        atascado = self._pago('tarjeta')
+        esperando = self._pago('paypal')
+        reciente = self._pago('paypal')
+        # Sin ejecutar las tareas, los tres quedan en proceso
+        for pago in (atascado, esperando, reciente):
+            confirmacion.iniciar_cobro(pago, {})
+        Pago.objects.filter(id=esperando.id).update(transaccion_id='diferida-1')
+        hace = timezone.now() - timedelta(hours=1)
+        Pago.objects.filter(id__in=[atascado.id, esperando.id]).update(fecha_actualizacion=hace)
+
+        with self.assertLogs('mototienda.security', 'WARNING'):
+            call_command('liberar_reservas', stdout=StringIO())
+        estados = dict(Pago.objects.values_list('id', 'status'))
+        # El que espera la notificación de la pasarela tiene más margen
+        self.assertEqual((estados[atascado.id], estados[esperando.id], estados[reciente.id]),
+                         ('fallido', 'procesando', 'procesando'))
+
+        Pago.objects.filter(id=esperando.id).update(fecha_actualizacion=hace - timedelta(days=1))
+        with self.assertLogs('mototienda.security', 'ERROR'):
+            self.assertEqual(confirmacion.vencer_en_proceso(), 1)
+        self.assertEqual(Pago.objects.get(id=esperando.id).status, 'fallido')
+
+    @override_settings(PAGOS_PASARELA={'BACKEND': 'pagos.tests.PasarelaCaida'})
+    def test_pasarela_sin_respuesta(self):
+        processor = PaymentProcessor.get_processor('paypal')
+        success, mensaje, transaccion_id = processor.process_payment(
+            {'monto': 10, 'pedido': self.pedido, 'usuario': self.usuario})
+        self.assertFalse(success)
+        self.assertIsNone(transaccion_id)
+        self.assertIn('pasarela', mensaje)
+
+    @override_settings(PAGOS_PASARELA={'BACKEND': 'pagos.tests.PasarelaConClientes'})
+    def test_cobros_sincronos_cierran_su_cliente(self):
+        processor = PaymentProcessor.get_processor('paypal')
+        datos = {'monto': 10, 'pedido': self.pedido, 'usuario': self.usuario}
+        for _ in range(2):
+            self.assertTrue(processor.process_payment(datos)[0])
+        # Un bucle (y un cliente) por cobro, y ninguno queda abierto
+        clientes = obtener_pasarela().clientes
+        self.assertEqual(len(clientes), 2)
+        self.assertTrue(all(cliente['cerrado'] for cliente in clientes.values()))
+
+    @pasarela_simulada(1.0, latencia=(0.2, 0.2))
+    async def test_cobros_concurrentes_no_se_bloquean(self):
+        processor = PaymentProcessor.get_processor('paypal')
+        datos = {'monto': 10, 'pedido': self.pedido, 'usuario': self.usuario}
+
+        inicio = time.monotonic()
+        resultados = await asyncio.gather(*[processor.aprocess_payment(datos) for _ in range(20)])
+        # En serie serían 4 segundos
+        self.assertLess(time.monotonic() - inicio, 1)
+        self.assertTrue(all(success for success, _, _ in resultados))
+
+    def test_pasarela_se_reinicia_con_la_configuracion(self):
+        with pasarela_simulada(0.5):
+            self.assertEqual(obtener_pasarela().tasa_exito, 0.5)
+        self.assertIsNone(obtener_pasarela().tasa_exito)
+
+
+class HistorialPagoTest(TestCase):
+    """Tests del registro de cambios de estado sin releer el pago"""
+
+    def setUp(self):
+        usuario = User.objects.create_user(username='cliente', password='testpassword')
+        pedido = Pedido.objects.create(usuario=usuario, nombre_completo='Cliente', direccion='Calle',
+                                       ciudad='Ciudad', codigo_postal='12345', telefono='123456789')
+        metodo = MetodoPago.objects.create(nombre='Tarjeta', tipo='tarjeta')
+        self.pago = Pago.objects.create(pedido=pedido, usuario=usuario, metodo_pago=metodo, monto=10)
+
+    def test_cambio_de_estado_es_un_update_y_un_insert(self):
+        pago = Pago.objects.get(id=self.pago.id)
+        with self.assertNumQueries(2):
+            pago.status = 'procesando'
+            pago.save()
+        self.assertTrue(pago.verify_integrity())
+
+        # Guardar sin cambiar el estado no añade historial
+        with self.assertNumQueries(1):
+            pago.notas = 'Revisado'
+            pago.save()
+        self.assertEqual(list(pago.historial.values_list('estado_anterior', 'estado_nuevo')),
+                         [('pendiente', 'procesando')])
+
+    def test_estado_diferido(self):
+        pago = Pago.objects.only('id', 'referencia', 'pedido_id', 'monto').get(id=self.pago.id)
+        pago.status = 'fallido'
+        pago.save()
+        self.assertEqual(pago.historial.get().estado_anterior, 'pendiente')
+
+
+class VerifyPaymentsTest(TestCase):
+    """Tests del comando de auditoría de checksums"""
+
+    def setUp(self):
+        import tempfile
+        usuario = User.objects.create_user(username='cliente', password='testpassword')
+        pedido = Pedido.objects.create(usuario=usuario, nombre_completo='Cliente', direccion='Calle',
+                                       ciudad='Ciudad', codigo_postal='12345', telefono='123456789')
+        metodo = MetodoPago.objects.create(nombre='Tarjeta', tipo='tarjeta')
+        self.pagos = []
+        for monto in (10, 20, 30):
+            pago = Pago.objects.create(pedido=pedido, usuario=usuario, metodo_pago=metodo, monto=monto)
+            pago.save()  # Los pagos reciben checksum al actualizarse
+            self.pagos.append(pago)
+        Pago.objects.create(pedido=pedido, usuario=usuario, metodo_pago=metodo, monto=40)
+        self.directorio = tempfile.mkdtemp()
+        self.estado = os.path.join(self.directorio, 'estado.json')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _ejecutar(self, *args):
+        salida = StringIO()
+        call_command('verify_payments', '--procesos', '1', '--lote', '2', '--estado', self.estado,
+                     *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_sin_manipulaciones(self):
+        salida = self._ejecutar()
+        self.assertIn('Pagos verificados: 4', salida)
+        self.assertIn('sin checksum: 1; no coinciden: 0', salida)
+
+    def test_detecta_manipulacion_e_incremental(self):
+        self._ejecutar()
+        # Cambio directo en la BD (sin pasar por save) en un pago actualizado después
+        Pago.objects.filter(id=self.pagos[1].id).update(monto=2000, fecha_actualizacion=timezone.now())
+        informe = os.path.join(self.directorio, 'informe.csv')
+        with self.assertRaises(CommandError):
+            self._ejecutar('--incremental', '--informe', informe)
+        with open(informe, encoding='utf-8') as fichero:
+            filas = list(csv.reader(fichero))
+        self.assertEqual([fila[0] for fila in filas[1:]], [str(self.pagos[1].id)])
+
+        # Sigue fallando en las siguientes ejecuciones aunque no se vuelva a tocar
+        with self.assertRaisesMessage(CommandError, '1 pagos con checksum no válido'):
+            self._ejecutar('--incremental')
+
+        # Una vez corregido deja de verificarse
+        Pago.objects.get(id=self.pagos[1].id).save()
+        self.assertIn('Pagos verificados: 1', self._ejecutar('--incremental'))
+        self.assertIn('Pagos verificados: 0', self._ejecutar('--incremental'))
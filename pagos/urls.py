@@ -1,3 +1,4 @@
+from django.contrib.auth.decorators import login_required
 from django.urls import path
 from . import views
 
@@ -19,8 +20,21 @@ urlpatterns = [
          views.resumen_pago, 
          name='resumen_pago'),
     
+    # Pago en proceso y consulta de su estado
+    path('en-proceso/<int:pago_id>/', 
+         views.pago_en_proceso, 
+         name='pago_en_proceso'),
+    path('estado/<int:pago_id>/', 
+         views.estado_pago, 
+         name='estado_pago'),
+    
+    # Notificaciones de la pasarela
+    path('webhook/', 
+         views.webhook_pago, 
+         name='webhook_pago'),
+    
     # Redirección para PayPal
     path('paypal/<int:pago_id>/', 
-         views.PayPalRedirectView.as_view(), 
+         login_required(views.PayPalRedirectView.as_view()), 
          name='paypal_redirect'),
 ]
\ No newline at end of file
@@ -1,24 +1,29 @@
 from django.shortcuts import render
 
 # Create your views here.
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
-from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.csrf import csrf_protect, csrf_exempt
+from django.views.decorators.cache import never_cache
 from django.db import transaction
 from django.urls import reverse
 from django.views import View
+from asgiref.sync import sync_to_async
 
 from .models import Pago, MetodoPago, HistorialPago
 from .forms import TarjetaForm, TransferenciaForm, MetodoPagoSeleccionForm
 from .services import PaymentProcessor
+from . import confirmacion
+from pedidos import reservas
 from pedidos.models import Pedido
 
 import logging
 import json
+import uuid
 
 logger = logging.getLogger('mototienda.security')
 
@@ -58,23 +63,23 @@ def seleccionar_metodo_pago(request, pedido_id):
         if form.is_valid():
             metodo_pago = form.cleaned_data['metodo_pago']
             
-            # Crear un nuevo registro de pago
+            # Asegurar que el stock sigue retenido mientras se paga
+            try:
+                reservas.renovar(pedido)
+            except reservas.StockInsuficiente as e:
+                messages.error(request, f"No se puede pagar el pedido: {e}")
+                return redirect('pedidos:detalle_pedido', pedido_id=pedido.id)
+            
+            # Crear un nuevo registro de pago con la primera entrada del historial
             with transaction.atomic():
-                pago = Pago.objects.create(
+                pago = Pago(
                     pedido=pedido,
                     usuario=request.user,
                     metodo_pago=metodo_pago,
                     monto=pedido.total(),
                     gateway_usado='simulado'  # Esto cambiaría en producción
                 )
-                
-                # Crear la primera entrada en el historial
-                HistorialPago.objects.create(
-                    pago=pago,
-                    estado_anterior='',
-                    estado_nuevo='pendiente',
-                    ip_usuario=get_client_ip(request)
-                )
+                pago.save(historial={'ip_usuario': get_client_ip(request)})
             
             # Redirigir al procesamiento específico según el método
             return redirect('pagos:procesar_pago', pago_id=pago.id)
@@ -86,11 +91,25 @@ def seleccionar_metodo_pago(request, pedido_id):
         'pedido': pedido
     })
 
+def _confirmar_contra_entrega(pago):
+    """Confirma un pedido que se pagará al entregarlo"""
+    pago.status = 'pendiente'
+    pago.save()
+    pago.pedido.pagado = True  # Marcar como pagado (se pagará al entregar)
+    pago.pedido.metodo_pago = "Efectivo"
+    pago.pedido.save()
+    reservas.confirmar(pago.pedido)
+
 @login_required
-def procesar_pago(request, pago_id):
+async def procesar_pago(request, pago_id):
     """
     Vista para procesar un pago según el método seleccionado.
     
+    Los métodos con pasarela no esperan su respuesta: el cobro se encola y
+    se muestra la página de pago en proceso (ver confirmacion.py). Es
+    asíncrona; el acceso a la base de datos y el renderizado van por
+    sync_to_async.
+    
     Args:
         request: HttpRequest
         pago_id: ID del pago a procesar
@@ -98,11 +117,13 @@ def procesar_pago(request, pago_id):
     Returns:
         HttpResponse
     """
+    usuario = await request.auser()
+    
     # Obtener el pago o retornar 404
-    pago = get_object_or_404(
+    pago = await aget_object_or_404(
         Pago.objects.select_related('pedido', 'metodo_pago'),
         id=pago_id,
-        usuario=request.user,
+        usuario=usuario,
         status__in=['pendiente', 'procesando']  # Solo pagos no finalizados
     )
     
@@ -112,6 +133,10 @@ def procesar_pago(request, pago_id):
         messages.error(request, "Se ha detectado un problema con este pago. Por favor, contacte a soporte.")
         return redirect('pedidos:lista_pedidos')
     
+    # El cobro ya está en marcha: mostrar su estado en lugar de repetirlo
+    if pago.status == 'procesando':
+        return redirect('pagos:pago_en_proceso', pago_id=pago.id)
+    
     # Obtener el formulario adecuado según el método de pago
     metodo = pago.metodo_pago.tipo
     form = None
@@ -128,11 +153,7 @@ def procesar_pago(request, pago_id):
         return redirect('pagos:paypal_redirect', pago_id=pago.id)
     elif metodo == 'efectivo':
         # Para efectivo simplemente confirmamos el pedido
-        pago.status = 'pendiente'
-        pago.save()
-        pago.pedido.pagado = True  # Marcar como pagado (se pagará al entregar)
-        pago.pedido.metodo_pago = "Efectivo"
-        pago.pedido.save()
+        await sync_to_async(_confirmar_contra_entrega)(pago)
         messages.success(request, "Pedido confirmado. Pagarás al recibir tu pedido.")
         return redirect('pedidos:detalle_pedido', pedido_id=pago.pedido.id)
     else:
@@ -146,45 +167,43 @@ def procesar_pago(request, pago_id):
             # Obtener datos del procesador de pago correspondiente
             processor = PaymentProcessor.get_processor(metodo)
             
-            # Preparar datos para el procesador (específicos para cada método)
-            payment_data = {
-                'monto': pago.monto,
-                'pedido': pago.pedido,
-                'usuario': request.user
-            }
-            
-            # Añadir datos específicos según el método
+            # Datos específicos según el método
+            datos_metodo = {}
             if metodo == 'tarjeta':
-                payment_data.update({
+                datos_metodo = {
                     'card_number': form.cleaned_data['numero_tarjeta'],
                     'card_expiry': form.cleaned_data['fecha_expiracion'],
                     'cvv': form.cleaned_data['cvv'],
                     'card_holder': form.cleaned_data['titular']
-                })
+                }
             elif metodo == 'transferencia':
-                payment_data.update({
+                datos_metodo = {
                     'nombre_ordenante': form.cleaned_data['nombre_ordenante'],
                     'banco_origen': form.cleaned_data['banco_origen']
-                })
+                }
+            
+            # Con pasarela: encolar el cobro y responder ya
+            if processor.requiere_pasarela:
+                await sync_to_async(confirmacion.iniciar_cobro)(pago, datos_metodo)
+                return redirect('pagos:pago_en_proceso', pago_id=pago.id)
             
             # Procesar el pago
-            success, message, transaction_id = processor.process_payment(payment_data)
+            success, message, transaction_id = await processor.aprocess_payment({
+                'monto': pago.monto,
+                'pedido': pago.pedido,
+                'usuario': usuario,
+                **datos_metodo
+            })
             
-            # Actualizar el estado del pago
-            pago.status = 'completado' if success else 'fallido'
-            pago.transaccion_id = transaction_id if transaction_id else ''
-            pago.save()
+            # Actualizar el estado del pago y del pedido
+            await sync_to_async(confirmacion.registrar_resultado)(
+                pago, success, transaction_id, pago.metodo_pago.nombre
+            )
             
-            # Si el pago es exitoso, actualizar el pedido
             if success:
-                pago.pedido.pagado = True
-                pago.pedido.referencia_pago = transaction_id
-                pago.pedido.metodo_pago = pago.metodo_pago.nombre
-                pago.pedido.save()
-                
                 # Si el método es 'transferencia', cambiar estado a procesando
                 if metodo == 'transferencia':
-                    pago.pedido.cambiar_estado('procesando', 'Pedido pagado por transferencia')
+                    await sync_to_async(pago.pedido.cambiar_estado)('procesando', 'Pedido pagado por transferencia')
                 
                 messages.success(request, f"Pago procesado correctamente. {message}")
                 return redirect('pedidos:detalle_pedido', pedido_id=pago.pedido.id)
@@ -193,7 +212,7 @@ def procesar_pago(request, pago_id):
     else:
         form = form_class()
     
-    return render(request, template, {
+    return await sync_to_async(render)(request, template, {
         'form': form,
         'pago': pago,
         'pedido': pago.pedido
@@ -223,63 +242,110 @@ def resumen_pago(request, pago_id):
         'pedido': pago.pedido
     })
 
-@method_decorator(login_required, name='dispatch')
 class PayPalRedirectView(View):
-    """Vista para manejar la redirección a PayPal y callback."""
+    """
+    Vista para manejar la redirección a PayPal y callback.
     
-    def get(self, request, pago_id):
-        """Maneja la redirección inicial a PayPal."""
-        pago = get_object_or_404(
+    Es asíncrona como procesar_pago; login_required se aplica en urls.py
+    porque method_decorator no admite métodos async en esta versión.
+    """
+    
+    async def _obtener_pago(self, request, pago_id):
+        return await aget_object_or_404(
             Pago.objects.select_related('pedido'),
             id=pago_id,
-            usuario=request.user,
+            usuario=await request.auser(),
             status__in=['pendiente', 'procesando']
         )
+    
+    async def get(self, request, pago_id):
+        """Maneja la redirección inicial a PayPal."""
+        pago = await self._obtener_pago(request, pago_id)
         
         # En un sistema real, aquí se generaría la URL de PayPal
         # y se redireccionaría al usuario
         
         # Para este simulador, simplemente mostramos una página
-        return render(request, 'pagos/paypal_redirect.html', {
+        return await sync_to_async(render)(request, 'pagos/paypal_redirect.html', {
             'pago': pago,
             'pedido': pago.pedido
         })
     
-    def post(self, request, pago_id):
-        """Procesa la respuesta del pago PayPal (simulado)."""
-        pago = get_object_or_404(
-            Pago.objects.select_related('pedido'),
-            id=pago_id,
-            usuario=request.user,
-            status__in=['pendiente', 'procesando']
-        )
-        
-        # Procesar el pago con PayPal
-        processor = PaymentProcessor.get_processor('paypal')
-        payment_data = {
-            'monto': pago.monto,
-            'pedido': pago.pedido,
-            'usuario': request.user,
-            'paypal_email': request.user.email
-        }
-        
-        success, message, transaction_id = processor.process_payment(payment_data)
+    async def post(self, request, pago_id):
+        """Inicia el cobro con PayPal."""
+        pago = await self._obtener_pago(request, pago_id)
         
-        # Actualizar estado del pago
-        pago.status = 'completado' if success else 'fallido'
-        pago.transaccion_id = transaction_id if transaction_id else ''
-        pago.save()
+        if pago.status == 'procesando':
+            return redirect('pagos:pago_en_proceso', pago_id=pago.id)
         
-        if success:
-            pago.pedido.pagado = True
-            pago.pedido.referencia_pago = transaction_id
-            pago.pedido.metodo_pago = "PayPal"
-            pago.pedido.save()
-            messages.success(request, "Pago por PayPal completado correctamente")
-            return redirect('pedidos:detalle_pedido', pedido_id=pago.pedido.id)
-        else:
-            messages.error(request, f"Error en el pago por PayPal: {message}")
-            return redirect('pagos:seleccionar_metodo_pago', pedido_id=pago.pedido.id)
+        # Encolar el cobro con PayPal y mostrar el pago en proceso
+        usuario = await request.auser()
+        await sync_to_async(confirmacion.iniciar_cobro)(pago, {'paypal_email': usuario.email})
+        return redirect('pagos:pago_en_proceso', pago_id=pago.id)
+
+@login_required
+def pago_en_proceso(request, pago_id):
+    """
+    Página que se muestra mientras la pasarela autoriza el cobro.
+    
+    Consulta estado_pago periódicamente y se recarga cuando el pago termina;
+    entonces redirige al pedido o, si falló, a elegir otro método de pago.
+    """
+    pago = get_object_or_404(Pago.objects.select_related('pedido'), id=pago_id, usuario=request.user)
+    
+    if pago.status == 'completado':
+        messages.success(request, "Pago procesado correctamente.")
+        return redirect('pedidos:detalle_pedido', pedido_id=pago.pedido_id)
+    if pago.status == 'fallido':
+        messages.error(request, f"Error en el pago: {pago.notas or 'pago rechazado'}")
+        return redirect('pagos:seleccionar_metodo_pago', pedido_id=pago.pedido_id)
+    if pago.status != 'procesando':
+        return redirect('pedidos:detalle_pedido', pedido_id=pago.pedido_id)
+    
+    return render(request, 'pagos/procesando.html', {
+        'pago': pago,
+        'pedido': pago.pedido
+    })
+
+@never_cache
+@login_required
+def estado_pago(request, pago_id):
+    """
+    Estado de un pago en JSON, para la página de pago en proceso.
+    
+    Es una consulta de una sola fila sin renderizar plantillas, pensada para
+    que el navegador la llame cada pocos segundos.
+    """
+    estado = (Pago.objects.filter(id=pago_id, usuario=request.user)
+              .values_list('status', flat=True).first())
+    if estado is None:
+        return JsonResponse({'error': 'Pago no encontrado'}, status=404)
+    return JsonResponse({'estado': estado, 'finalizado': estado != 'procesando'})
+
+@csrf_exempt
+@require_POST
+def webhook_pago(request):
+    """
+    Notificación de la pasarela con el resultado de un cobro pendiente.
+    
+    El cuerpo es JSON con referencia, estado ('aprobado' o 'rechazado'),
+    transaccion_id y mensaje, firmado con HMAC-SHA256 en la cabecera
+    X-Pasarela-Firma. Las notificaciones repetidas se aceptan sin efecto.
+    """
+    if not confirmacion.verificar_firma(request.body, request.headers.get('X-Pasarela-Firma', '')):
+        logger.warning(f"Notificación de pago con firma no válida desde {get_client_ip(request)}")
+        return JsonResponse({'error': 'Firma no válida'}, status=403)
+    
+    try:
+        datos = json.loads(request.body)
+        if datos.get('estado') not in ('aprobado', 'rechazado') or not datos.get('referencia'):
+            raise ValueError(datos.get('estado'))
+        uuid.UUID(str(datos['referencia']))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Notificación no válida'}, status=400)
+    
+    procesada = confirmacion.procesar_notificacion(datos)
+    return JsonResponse({'ok': True, 'procesada': procesada})
 
 # Función auxiliar para obtener la IP del cliente
 def get_client_ip(request):
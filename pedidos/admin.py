@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Pedido, ItemPedido, HistorialEstadoPedido
+from .models import Pedido, ItemPedido, HistorialEstadoPedido, ReservaStock
 
 class HistorialEstadoInline(admin.TabularInline):
     model = HistorialEstadoPedido
@@ -12,7 +12,7 @@ class HistorialEstadoInline(admin.TabularInline):
 
 class ItemPedidoInline(admin.TabularInline):
     model = ItemPedido
-    readonly_fields = ('producto', 'precio', 'cantidad')
+    readonly_fields = ('producto', 'talla', 'precio', 'cantidad')
     extra = 0
     can_delete = False
     
@@ -45,8 +45,9 @@ class PedidoAdmin(admin.ModelAdmin):
     )
     
     def total_pedido(self, obj):
-        return f"${obj.total()}"
+        return f"${obj.total_importe}"
     total_pedido.short_description = 'Total'
+    total_pedido.admin_order_field = 'total_importe'
     
     def save_model(self, request, obj, form, change):
         # Si el estado ha cambiado, registrar el cambio
@@ -72,4 +73,15 @@ class HistorialEstadoAdmin(admin.ModelAdmin):
         return False
     
     def has_change_permission(self, request, obj=None):
-        return False
\ No newline at end of file
+        return False
+
+@admin.register(ReservaStock)
+class ReservaStockAdmin(admin.ModelAdmin):
+    list_display = ('id', 'pedido', 'producto', 'talla', 'cantidad', 'estado', 'expira')
+    list_filter = ('estado',)
+    search_fields = ('pedido__id', 'producto__nombre')
+    list_select_related = ('pedido', 'producto', 'talla')
+    readonly_fields = ('pedido', 'producto', 'talla', 'cantidad', 'estado', 'expira', 'fecha_creacion')
+
+    def has_add_permission(self, request):
+        return False
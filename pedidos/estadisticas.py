@@ -0,0 +1,135 @@
+"""
+Servicio de estadísticas de pedidos.
+
+Cada bloque del panel sale de una única consulta agregada en SQL (Sum/Count
+condicionales con filter=). Los recuentos, ingresos y series leen las tablas
+de ventas agregadas (ver pedidos/ventas.py) en lugar del histórico de
+pedidos, y el resultado completo se cachea bajo la etiqueta
+'estadisticas_pedidos', que las señales de Pedido invalidan en cada cambio.
+"""
+import datetime
+import logging
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from utils.cache_warming import warmable
+from .models import Pedido, VentaDiaria, VentaMensual
+
+logger = logging.getLogger('mototienda.performance')
+
+# Clave y tiempo de vida del resumen cacheado
+CACHE_KEY = 'estadisticas_pedidos_dashboard'
+CACHE_TIMEOUT = 60 * 15
+
+
+def resumen_pedidos(dias_recientes=30):
+    """
+    Recuentos por estado, ingresos y valor medio en una sola consulta
+    sobre las filas diarias de totales por pedido.
+
+    Returns:
+        dict: total, por_estado ({estado: n}), recientes, ingresos_totales,
+            ingresos_recientes y valor_promedio
+    """
+    desde = timezone.localdate() - datetime.timedelta(days=dias_recientes)
+    recientes = Q(fecha__gte=desde)
+    pagados = Q(pagado=True)
+
+    agregados = {f'estado_{estado}': Sum('num_pedidos', filter=Q(estado=estado))
+                 for estado, _ in Pedido.ESTADOS}
+    datos = VentaDiaria.objects.totales().order_by().aggregate(
+        total=Sum('num_pedidos'),
+        importe_total=Sum('importe'),
+        recientes=Sum('num_pedidos', filter=recientes),
+        ingresos_totales=Sum('importe', filter=pagados),
+        ingresos_recientes=Sum('importe', filter=pagados & recientes),
+        **agregados
+    )
+
+    total = datos['total'] or 0
+    return {
+        'total': total,
+        'por_estado': {estado: datos[f'estado_{estado}'] or 0 for estado, _ in Pedido.ESTADOS},
+        'recientes': datos['recientes'] or 0,
+        'ingresos_totales': datos['ingresos_totales'] or 0,
+        'ingresos_recientes': datos['ingresos_recientes'] or 0,
+        'valor_promedio': (datos['importe_total'] or 0) / total if total else 0,
+    }
+
+
+def _inicios_de_mes(meses):
+    """Primer día de cada uno de los últimos `meses` meses, en orden cronológico"""
+    actual = timezone.localdate().replace(day=1)
+    inicios = []
+    for _ in range(meses):
+        inicios.append(actual)
+        actual = (actual - datetime.timedelta(days=1)).replace(day=1)
+    return inicios[::-1]
+
+
+def serie_mensual(meses=6):
+    """
+    Pedidos e ingresos por mes de los últimos `meses` meses (incluido el actual),
+    con los meses sin pedidos a cero.
+
+    Returns:
+        list: dicts con mes (date), etiqueta, pedidos e ingresos
+    """
+    inicios = _inicios_de_mes(meses)
+
+    filas = (VentaMensual.objects
+             .totales()
+             .filter(mes__gte=inicios[0])
+             .order_by()
+             .values('mes')
+             .annotate(pedidos=Sum('num_pedidos'),
+                       ingresos=Sum('importe', filter=Q(pagado=True))))
+    por_mes = {fila['mes']: fila for fila in filas}
+
+    serie = []
+    for inicio in inicios:
+        fila = por_mes.get(inicio, {})
+        serie.append({
+            'mes': inicio,
+            'etiqueta': inicio.strftime('%b %Y'),
+            'pedidos': fila.get('pedidos', 0),
+            'ingresos': fila.get('ingresos') or 0,
+        })
+    return serie
+
+
+def mejores_clientes(limite=5):
+    """
+    Clientes con mayor gasto, agrupando los pedidos por usuario.
+
+    Returns:
+        list: dicts con usuario_id, username, email, total_pedidos y gasto_total
+    """
+    return list(Pedido.objects
+                .order_by()
+                .values('usuario_id', 'usuario__username', 'usuario__email')
+                .annotate(total_pedidos=Count('id'), gasto_total=Sum('total_importe'))
+                .order_by('-gasto_total', 'usuario_id')[:limite])
+
+
+def obtener_estadisticas():
+    """
+    Devuelve todas las estadísticas del panel, desde la caché si es posible.
+
+    Returns:
+        dict: resumen, serie_mensual y mejores_clientes
+    """
+    return calcular_estadisticas.get()
+
+
+@warmable('estadisticas_pedidos', key=CACHE_KEY, tags=['estadisticas_pedidos'], timeout=CACHE_TIMEOUT,
+          stale_ttl=60)
+def calcular_estadisticas():
+    estadisticas = {
+        'resumen': resumen_pedidos(),
+        'serie_mensual': serie_mensual(),
+        'mejores_clientes': mejores_clientes(),
+    }
+    logger.debug("Estadísticas de pedidos recalculadas")
+    return estadisticas
@@ -0,0 +1,271 @@
+"""
+Exportación de pedidos en streaming (CSV y Excel).
+
+Los pedidos se leen por bloques con iterator(chunk_size=...) y sus ítems se
+precargan bloque a bloque, de modo que la memoria no crece con el número de
+pedidos. El CSV se genera fila a fila dentro de la respuesta; el Excel se
+escribe con openpyxl en modo write-only (cada fila se vuelca a disco al
+añadirla) y se sirve por trozos desde un fichero temporal, porque el
+formato zip no se puede emitir antes de cerrar el libro.
+"""
+import csv
+import datetime
+import itertools
+import logging
+import os
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from .models import ItemPedido, Pedido, VentaDiaria
+from . import ventas
+
+logger = logging.getLogger('mototienda.performance')
+
+COLUMNAS = ['ID', 'Cliente', 'Email', 'Fecha', 'Estado', 'Total', 'Productos']
+
+# Pedidos leídos por consulta y filas usadas para calcular el ancho de columnas
+TAMANO_BLOQUE = 2000
+MUESTRA_ANCHOS = 200
+ANCHO_MAXIMO = 60
+
+CONTENT_TYPE_EXCEL = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _fecha(valor):
+    """Convierte un parámetro AAAA-MM-DD a date, o None si no es válido"""
+    try:
+        return datetime.date.fromisoformat(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def filtros_desde_request(params):
+    """
+    Normaliza los filtros de la exportación a partir de request.GET.
+
+    Returns:
+        dict: estado, fecha_desde y fecha_hasta (date o None)
+    """
+    return {
+        'estado': params.get('estado') or None,
+        'fecha_desde': _fecha(params.get('fecha_desde')),
+        'fecha_hasta': _fecha(params.get('fecha_hasta')),
+    }
+
+
+def pedidos_para_exportar(filtros):
+    """
+    Queryset de pedidos filtrado, con el usuario en el mismo SELECT y los
+    ítems (solo cantidad y nombre del producto) precargados por bloque.
+    """
+    items = (ItemPedido.objects
+             .select_related('producto')
+             .only('pedido_id', 'cantidad', 'producto__nombre'))
+    queryset = (Pedido.objects
+                .select_related('usuario')
+                .only('id', 'nombre_completo', 'fecha_pedido', 'estado', 'total_importe',
+                      'usuario__email')
+                .prefetch_related(Prefetch('items', queryset=items))
+                .order_by('-fecha_pedido', '-id'))
+
+    if filtros['estado']:
+        queryset = queryset.filter(estado=filtros['estado'])
+    if filtros['fecha_desde']:
+        queryset = queryset.filter(fecha_pedido__date__gte=filtros['fecha_desde'])
+    if filtros['fecha_hasta']:
+        queryset = queryset.filter(fecha_pedido__date__lte=filtros['fecha_hasta'])
+    return queryset
+
+
+def filas_pedidos(queryset, chunk_size=TAMANO_BLOQUE):
+    """Genera una lista de valores por pedido, en el orden de COLUMNAS"""
+    estados = dict(Pedido.ESTADOS)
+    for pedido in queryset.iterator(chunk_size=chunk_size):
+        productos = ", ".join(f"{item.cantidad}x {item.producto.nombre}"
+                              for item in pedido.items.all())
+        yield [
+            pedido.id,
+            pedido.nombre_completo,
+            pedido.usuario.email,
+            pedido.fecha_pedido.strftime("%d/%m/%Y %H:%M"),
+            estados.get(pedido.estado, pedido.estado),
+            f"${pedido.total_importe}",
+            productos,
+        ]
+
+
+def _nombre_fichero(extension):
+    return f'pedidos_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+
+
+# === CSV ===
+
+class _Eco:
+    """Pseudo-fichero cuyo write() devuelve la línea en lugar de guardarla"""
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(queryset):
+    """Respuesta CSV que se genera fila a fila mientras se descarga"""
+    writer = csv.writer(_Eco())
+
+    def lineas():
+        # BOM para que Excel detecte UTF-8 al abrir el CSV
+        yield '\ufeff'
+        yield writer.writerow(COLUMNAS)
+        for fila in filas_pedidos(queryset):
+            yield writer.writerow(fila)
+
+    response = StreamingHttpResponse(lineas(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{_nombre_fichero("csv")}"'
+    return response
+
+
+# === Excel ===
+
+def _estilos():
+    lado = Side(border_style='thin', color='000000')
+    return {
+        'cabecera_font': Font(bold=True, color="FFFFFF"),
+        'cabecera_fill': PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+        'centrado': Alignment(horizontal='center'),
+        'borde': Border(left=lado, right=lado, top=lado, bottom=lado),
+    }
+
+
+def _fila_excel(ws, valores, estilos, cabecera=False, centradas=()):
+    celdas = []
+    for col_num, valor in enumerate(valores, 1):
+        celda = WriteOnlyCell(ws, value=valor)
+        celda.border = estilos['borde']
+        if cabecera:
+            celda.font = estilos['cabecera_font']
+            celda.fill = estilos['cabecera_fill']
+        if cabecera or col_num in centradas:
+            celda.alignment = estilos['centrado']
+        celdas.append(celda)
+    return celdas
+
+
+def _fijar_anchos(ws, filas):
+    """Ajusta el ancho de cada columna según las filas de muestra"""
+    for col_num in range(1, max((len(fila) for fila in filas), default=0) + 1):
+        largo = max(len(str(fila[col_num - 1])) for fila in filas if len(fila) >= col_num)
+        ws.column_dimensions[get_column_letter(col_num)].width = min(largo + 2, ANCHO_MAXIMO)
+
+
+def _hoja_pedidos(wb, queryset, estilos):
+    ws = wb.create_sheet("Pedidos")
+    filas = filas_pedidos(queryset)
+
+    # En modo write-only los anchos deben fijarse antes de la primera fila,
+    # así que se calculan sobre una muestra en lugar de recorrer todo
+    muestra = []
+    for fila in filas:
+        muestra.append(fila)
+        if len(muestra) >= MUESTRA_ANCHOS:
+            break
+    _fijar_anchos(ws, [COLUMNAS] + muestra)
+
+    ws.append(_fila_excel(ws, COLUMNAS, estilos, cabecera=True))
+    total = 0
+    for fila in itertools.chain(muestra, filas):
+        ws.append(_fila_excel(ws, fila, estilos, centradas=(1, 4, 5)))
+        total += 1
+    return total
+
+
+def _hoja_resumen(wb, filtros, estilos):
+    """Resumen por estado del periodo, leído de las tablas de ventas agregadas"""
+    ws = wb.create_sheet("Resumen")
+    for columna in 'ABCD':
+        ws.column_dimensions[columna].width = 18
+    ws.append(_fila_excel(ws, ['Estado', 'Pedidos', 'Unidades', 'Importe'], estilos, cabecera=True))
+
+    desde = (filtros['fecha_desde'] or
+             VentaDiaria.objects.order_by('fecha').values_list('fecha', flat=True).first())
+    if not desde:
+        return
+    filas = ventas.ventas_por_periodo(desde, filtros['fecha_hasta'] or timezone.localdate())
+    if filtros['estado']:
+        filas = [fila for fila in filas if fila['estado'] == filtros['estado']]
+
+    estados = dict(Pedido.ESTADOS)
+    for fila in sorted(filas, key=lambda f: f['estado']):
+        ws.append(_fila_excel(ws, [estados.get(fila['estado'], fila['estado']),
+                                   fila['num_pedidos'], fila['unidades'], fila['importe']],
+                              estilos))
+
+
+def escribir_excel(fichero, queryset, filtros):
+    """
+    Escribe el libro Excel de pedidos (hojas Pedidos y Resumen) en `fichero`
+    (ruta o fichero binario abierto).
+
+    Returns:
+        int: Número de pedidos exportados
+    """
+    wb = Workbook(write_only=True)
+    estilos = _estilos()
+    total = _hoja_pedidos(wb, queryset, estilos)
+    _hoja_resumen(wb, filtros, estilos)
+    wb.save(fichero)
+    logger.info(f"Exportación Excel generada: {total} pedidos")
+    return total
+
+
+def exportar_excel(queryset, filtros):
+    """
+    Respuesta con el libro Excel de pedidos.
+
+    El libro se escribe en modo write-only sobre un fichero temporal que
+    FileResponse envía por trozos y que se borra al cerrarse la respuesta.
+    """
+    fichero = tempfile.TemporaryFile()
+    escribir_excel(fichero, queryset, filtros)
+    fichero.seek(0)
+    return FileResponse(fichero, as_attachment=True, filename=_nombre_fichero('xlsx'),
+                        content_type=CONTENT_TYPE_EXCEL)
+
+
+# === Exportación en segundo plano ===
+
+def ruta_exportacion(nombre):
+    """Ruta de un fichero exportado dentro de EXPORTACIONES_ROOT (no público)"""
+    return os.path.join(settings.EXPORTACIONES_ROOT, os.path.basename(nombre))
+
+
+def nuevo_nombre_exportacion(formato):
+    """Nombre único y difícil de adivinar para una exportación en segundo plano"""
+    return f'pedidos_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}_{uuid.uuid4().hex[:12]}.{formato}'
+
+
+def guardar_exportacion(nombre, filtros):
+    """
+    Genera la exportación en EXPORTACIONES_ROOT con el formato indicado
+    por la extensión de `nombre` ('csv' o 'xlsx').
+
+    Returns:
+        str: Ruta del fichero generado
+    """
+    os.makedirs(settings.EXPORTACIONES_ROOT, exist_ok=True)
+    ruta = ruta_exportacion(nombre)
+    queryset = pedidos_para_exportar(filtros)
+    if ruta.endswith('.csv'):
+        with open(ruta, 'w', encoding='utf-8-sig', newline='') as fichero:
+            writer = csv.writer(fichero)
+            writer.writerow(COLUMNAS)
+            writer.writerows(filas_pedidos(queryset))
+    else:
+        escribir_excel(ruta, queryset, filtros)
+    return ruta
@@ -0,0 +1,90 @@
+"""
+Almacén de facturas PDF.
+
+Cada factura se renderiza una sola vez por versión del pedido: la versión es
+un hash de los datos que aparecen en ella (cliente, dirección, ítems y
+total), así que cambia cuando cambia el pedido y solo entonces se vuelve a
+generar. Los PDF se guardan en FACTURAS_ROOT (fuera de MEDIA_ROOT, porque
+contienen datos personales) como <pedido_id>/<versión>.pdf.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+from .utils import datos_factura, renderizar_factura
+
+logger = logging.getLogger('mototienda.performance')
+
+# Cambiar al modificar el diseño de la factura para regenerar todas
+FORMATO = 1
+
+
+def almacen():
+    return FileSystemStorage(location=settings.FACTURAS_ROOT)
+
+
+def version_factura(datos):
+    """Hash estable de los datos de una factura (y del formato)"""
+    contenido = json.dumps([FORMATO, datos], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:24]
+
+
+def nombre_factura(pedido_id, version):
+    return f'{pedido_id}/{version}.pdf'
+
+
+def guardar(pedido_id, version, contenido):
+    """
+    Guarda los bytes de una factura y borra las versiones anteriores.
+
+    La escritura va a un temporal que se renombra, así que una descarga
+    concurrente nunca ve un PDF a medias.
+    """
+    nombre = nombre_factura(pedido_id, version)
+    ruta = almacen().path(nombre)
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fichero:
+        fichero.write(contenido)
+    os.replace(temporal, ruta)
+
+    for anterior in os.listdir(directorio):
+        if anterior.endswith('.pdf') and anterior != os.path.basename(ruta):
+            try:
+                os.remove(os.path.join(directorio, anterior))
+            except FileNotFoundError:
+                pass
+    return nombre
+
+
+def obtener_factura(pedido, datos=None):
+    """
+    Devuelve la factura vigente de un pedido, renderizándola solo si su
+    versión no está en el almacén.
+
+    Args:
+        pedido: Pedido (idealmente de pedidos_para_factura())
+        datos (dict, optional): datos_factura(pedido) si ya se calcularon
+
+    Returns:
+        tuple: (nombre en el almacén, versión)
+    """
+    datos = datos or datos_factura(pedido)
+    version = version_factura(datos)
+    nombre = nombre_factura(pedido.id, version)
+    if not almacen().exists(nombre):
+        guardar(pedido.id, version, renderizar_factura(datos))
+        logger.debug(f"Factura del pedido {pedido.id} generada (versión {version})")
+    return nombre, version
+
+
+def abrir(nombre):
+    """Abre una factura del almacén en modo binario"""
+    return almacen().open(nombre, 'rb')
@@ -1,6 +1,6 @@
 from django import forms
 from .models import Pedido
-from core.utils import sanitize_input
+from core.utils import sanitize_input, sanitize_html
 
 class PedidoForm(forms.ModelForm):
     class Meta:
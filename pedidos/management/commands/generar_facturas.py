@@ -0,0 +1,79 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from pedidos import facturas
+from pedidos.utils import datos_factura, pedidos_para_factura, renderizar_factura
+
+class Command(BaseCommand):
+    help = 'Genera por adelantado las facturas PDF de los pedidos de un rango de fechas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer día (AAAA-MM-DD)')
+        parser.add_argument('--hasta', help='Último día (AAAA-MM-DD), incluido')
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos para renderizar los PDF (por defecto, uno por CPU)'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=500,
+            help='Pedidos leídos y renderizados por bloque (por defecto 500)'
+        )
+
+    def _fecha(self, valor):
+        if not valor:
+            return None
+        try:
+            return datetime.date.fromisoformat(valor)
+        except ValueError:
+            raise CommandError(f'Fecha no válida: {valor} (formato AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        pedidos = pedidos_para_factura().order_by('id')
+        desde, hasta = self._fecha(options['desde']), self._fecha(options['hasta'])
+        if desde:
+            pedidos = pedidos.filter(fecha_pedido__date__gte=desde)
+        if hasta:
+            pedidos = pedidos.filter(fecha_pedido__date__lte=hasta)
+
+        procesos = max(1, options['procesos'])
+        pool = None
+        if procesos > 1:
+            # Los procesos hijos no deben heredar la conexión abierta
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=procesos)
+
+        generadas = existentes = 0
+        try:
+            pendientes = []
+            for pedido in pedidos.iterator(chunk_size=options['lote']):
+                datos = datos_factura(pedido)
+                version = facturas.version_factura(datos)
+                if facturas.almacen().exists(facturas.nombre_factura(pedido.id, version)):
+                    existentes += 1
+                    continue
+                pendientes.append((pedido.id, version, datos))
+                if len(pendientes) >= options['lote']:
+                    generadas += self._renderizar(pendientes, pool)
+                    pendientes = []
+            generadas += self._renderizar(pendientes, pool)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Facturas generadas: {generadas}; ya estaban al día: {existentes}.'
+        ))
+
+    def _renderizar(self, pendientes, pool):
+        """Renderiza un bloque (en paralelo si hay pool) y guarda los PDF"""
+        lista_datos = [datos for _, _, datos in pendientes]
+        if pool:
+            contenidos = pool.map(renderizar_factura, lista_datos, chunksize=8)
+        else:
+            contenidos = map(renderizar_factura, lista_datos)
+        for (pedido_id, version, _), contenido in zip(pendientes, contenidos):
+            facturas.guardar(pedido_id, version, contenido)
+        return len(pendientes)
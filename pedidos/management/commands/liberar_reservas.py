@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from pedidos import reservas
+
+class Command(BaseCommand):
+    help = ('Libera las reservas de stock vencidas (pedidos que no se pagaron a tiempo) '
+            'y da por fallidos los pagos atascados en proceso')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=500,
+            help='Reservas liberadas por transacción (por defecto 500)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=0,
+            help='Si se indica, repite cada N segundos en lugar de terminar'
+        )
+
+    def handle(self, *args, **options):
+        from pagos import confirmacion
+
+        while True:
+            # Los pagos atascados en 'procesando' liberan antes sus reservas
+            pagos = confirmacion.vencer_en_proceso()
+            if pagos:
+                self.stdout.write(self.style.WARNING(f'Pagos en proceso vencidos: {pagos}'))
+            total = 0
+            while True:
+                liberadas = reservas.liberar_vencidas(options['lote'])
+                total += liberadas
+                if liberadas < options['lote']:
+                    break
+            self.stdout.write(self.style.SUCCESS(f'Reservas vencidas liberadas: {total}'))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
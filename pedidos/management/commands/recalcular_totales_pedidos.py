@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from pedidos.models import Pedido
+
+class Command(BaseCommand):
+    help = 'Verifica y rellena los totales desnormalizados de los pedidos (importe, ítems y unidades)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='Solo informa de los pedidos con totales incorrectos, sin corregirlos'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Número de pedidos corregidos por UPDATE (por defecto 1000)'
+        )
+    
+    def handle(self, *args, **options):
+        # Comparar en la base de datos los totales guardados con los calculados
+        esperados = {f'{campo}_esperado': expresion
+                     for campo, expresion in Pedido.expresiones_totales().items()}
+        distinto = Q()
+        for campo in Pedido.CAMPOS_TOTALES:
+            distinto |= ~Q(**{campo: F(f'{campo}_esperado')})
+        
+        incorrectos = list(Pedido.objects
+                           .order_by()
+                           .annotate(**esperados)
+                           .filter(distinto)
+                           .values_list('id', flat=True))
+        
+        if not incorrectos:
+            self.stdout.write(self.style.SUCCESS('Todos los pedidos tienen los totales correctos.'))
+            return
+        
+        self.stdout.write(self.style.WARNING(
+            f'{len(incorrectos)} pedidos con totales incorrectos: '
+            f'{", ".join(str(i) for i in incorrectos[:20])}{"..." if len(incorrectos) > 20 else ""}'
+        ))
+        if options['verificar']:
+            return
+        
+        lote = options['lote']
+        corregidos = 0
+        for i in range(0, len(incorrectos), lote):
+            corregidos += Pedido.actualizar_totales(incorrectos[i:i + lote])
+        
+        self.stdout.write(self.style.SUCCESS(f'Se corrigieron {corregidos} pedidos.'))
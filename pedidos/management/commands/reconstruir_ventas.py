@@ -0,0 +1,32 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from pedidos import ventas
+
+class Command(BaseCommand):
+    help = 'Reconstruye las tablas de ventas agregadas (diarias y mensuales) desde los pedidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--desde', help='Primer día a reconstruir (AAAA-MM-DD); por defecto todo el histórico'
+        )
+        parser.add_argument(
+            '--hasta', help='Último día a reconstruir (AAAA-MM-DD), incluido'
+        )
+
+    def _fecha(self, valor):
+        if not valor:
+            return None
+        try:
+            return datetime.date.fromisoformat(valor)
+        except ValueError:
+            raise CommandError(f'Fecha no válida: {valor} (formato AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        desde = self._fecha(options['desde'])
+        hasta = self._fecha(options['hasta'])
+        if desde and hasta and desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta')
+
+        dias = ventas.reconstruir(desde, hasta)
+        self.stdout.write(self.style.SUCCESS(f'Se recalcularon las ventas de {dias} días.'))
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:38
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_totales(apps, schema_editor):
+    """Rellena los totales de los pedidos existentes a partir de sus ítems"""
+    Pedido = apps.get_model('pedidos', 'Pedido')
+    ItemPedido = apps.get_model('pedidos', 'ItemPedido')
+
+    items = ItemPedido.objects.filter(pedido=OuterRef('pk')).order_by().values('pedido')
+    Pedido.objects.update(
+        total_importe=Coalesce(
+            Subquery(items.annotate(s=Sum(F('precio') * F('cantidad'))).values('s')),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ),
+        num_items=Coalesce(Subquery(items.annotate(c=Count('id')).values('c')), 0),
+        num_unidades=Coalesce(Subquery(items.annotate(u=Sum('cantidad')).values('u')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0002_pedido_actualizado_pedido_codigo_seguimiento_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='num_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='num_unidades',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='total_importe',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
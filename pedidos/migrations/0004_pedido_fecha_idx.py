@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0003_pedido_totales'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['-fecha_pedido', '-id'], name='pedido_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0011_indicebusquedaproducto'),
+        ('pedidos', '0004_pedido_fecha_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('enviado', 'Enviado'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('pagado', models.BooleanField(default=False)),
+                ('metodo_pago', models.CharField(blank=True, max_length=50)),
+                ('num_pedidos', models.PositiveIntegerField(default=0)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fecha', models.DateField()),
+                ('categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalogo.categoria')),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalogo.marca')),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'indexes': [models.Index(fields=['fecha', 'estado'], name='venta_diaria_fecha_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('enviado', 'Enviado'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('pagado', models.BooleanField(default=False)),
+                ('metodo_pago', models.CharField(blank=True, max_length=50)),
+                ('num_pedidos', models.PositiveIntegerField(default=0)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('mes', models.DateField(help_text='Primer día del mes')),
+                ('categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalogo.categoria')),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalogo.marca')),
+            ],
+            options={
+                'verbose_name': 'Venta mensual',
+                'verbose_name_plural': 'Ventas mensuales',
+                'indexes': [models.Index(fields=['mes', 'estado'], name='venta_mensual_mes_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0005_ventas_agregadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itempedido',
+            name='talla',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0007_reservastock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BloqueoVentas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(help_text="'dia:AAAA-MM-DD' o 'mes:AAAA-MM'", max_length=12, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Bloqueo de ventas',
+                'verbose_name_plural': 'Bloqueos de ventas',
+            },
+        ),
+    ]
@@ -1,12 +1,13 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-from catalogo.models import Producto
+from catalogo.models import Producto, TallaProducto
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
 from django.urls import reverse
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from utils.tracking import FieldTracker
 
 
 class Pedido(models.Model):
@@ -55,17 +56,73 @@ class Pedido(models.Model):
     notas = models.TextField(blank=True, null=True)
     notas_admin = models.TextField(blank=True, null=True)
     
+    # Totales desnormalizados: los mantienen las señales de ItemPedido con
+    # actualizar_totales() y nunca se escriben desde save()
+    total_importe = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    num_items = models.PositiveIntegerField(default=0, editable=False)
+    num_unidades = models.PositiveIntegerField(default=0, editable=False)
+    
+    CAMPOS_TOTALES = ('total_importe', 'num_items', 'num_unidades')
+    
+    # Campos que afectan a las ventas agregadas y las estadísticas
+    tracker = FieldTracker(['usuario', 'estado', 'pagado', 'metodo_pago', 'fecha_pedido'])
+    
     class Meta:
         ordering = ['-fecha_pedido']
         verbose_name = 'Pedido'
         verbose_name_plural = 'Pedidos'
+        indexes = [
+            # Listados recientes, paginación por cursor y series mensuales
+            models.Index(fields=['-fecha_pedido', '-id'], name='pedido_fecha_idx'),
+        ]
     
     def __str__(self):
         return f'Pedido {self.id} - {self.usuario.username}'
     
+    def save(self, *args, **kwargs):
+        # Una instancia cargada antes de añadir ítems tiene los totales
+        # desfasados; al actualizar se excluyen para no pisar los de la BD
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_TOTALES
+            ]
+        super().save(*args, **kwargs)
+    
     def total(self):
-        """Calcula el total del pedido sumando todos los ítems"""
-        return sum(item.precio_total() for item in self.items.all())
+        """Devuelve el total del pedido (columna desnormalizada)"""
+        return self.total_importe
+    
+    @staticmethod
+    def expresiones_totales():
+        """
+        Expresiones que calculan los totales de cada pedido a partir de sus
+        ítems, para usar en update() o annotate().
+        """
+        items = ItemPedido.objects.filter(pedido=OuterRef('pk')).order_by().values('pedido')
+        return {
+            'total_importe': Coalesce(
+                Subquery(items.annotate(s=Sum(F('precio') * F('cantidad'))).values('s')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ),
+            'num_items': Coalesce(Subquery(items.annotate(c=Count('id')).values('c')), 0),
+            'num_unidades': Coalesce(Subquery(items.annotate(u=Sum('cantidad')).values('u')), 0),
+        }
+    
+    @classmethod
+    def actualizar_totales(cls, pedido_ids):
+        """
+        Recalcula los totales de los pedidos indicados en un único UPDATE.
+        
+        Se recalcula desde los ítems en lugar de sumar deltas, así que el
+        resultado es correcto aunque cambie el precio de un ítem, y el
+        bloqueo de fila del UPDATE serializa escrituras concurrentes.
+        Las operaciones que no emiten señales (bulk_create, update() sobre
+        ItemPedido) deben llamarlo explícitamente.
+        """
+        return cls.objects.filter(pk__in=pedido_ids).update(**cls.expresiones_totales())
     
     def cambiar_estado(self, nuevo_estado, notas=None):
         """Cambiar el estado del pedido y guardar registro del cambio"""
@@ -89,21 +146,10 @@ class Pedido(models.Model):
                 notas=notas
             )
             
-            # Enviar notificación por correo electrónico
-            try:
-                estado_display = dict(self.ESTADOS)[nuevo_estado]
-                send_mail(
-                    f'Pedido #{self.id} - Estado actualizado a {estado_display}',
-                    f'Hola {self.nombre_completo},\n\nTu pedido #{self.id} ha sido actualizado a: {estado_display}.\n\n' + 
-                    (f'Notas: {notas}\n\n' if notas else '') +
-                    'Gracias por tu compra en Moto Tienda.',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [self.usuario.email],
-                    fail_silently=True,
-                )
-            except Exception:
-                # Fallar silenciosamente si hay problemas con el correo
-                pass
+            # Notificar al cliente por correo en segundo plano, al confirmar
+            # la transacción (la petición no espera al servidor SMTP)
+            from .tareas import enviar_notificacion_estado
+            enviar_notificacion_estado.encolar(self.id, nuevo_estado, notas)
             
             return True
         return False
@@ -170,23 +216,6 @@ class Pedido(models.Model):
         except:
             return False
     
-@receiver(post_save, sender=Pedido)
-def pedido_saved(sender, instance, created, **kwargs):
-        """Invalidar caché cuando se guarda un pedido"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('pedido', instance.id)
-        
-        # También invalidamos estadísticas generales si cambia el estado
-        if not created and instance.tracker.has_changed('estado'):
-            from utils.cache_utils import invalidate_model_cache
-            invalidate_model_cache('estadisticas_pedidos')
-        
-@receiver(post_delete, sender=Pedido)
-def pedido_deleted(sender, instance, **kwargs):
-        """Invalidar caché cuando se elimina un pedido"""
-        from utils.cache_utils import invalidate_model_cache
-        invalidate_model_cache('pedido', instance.id)
-        invalidate_model_cache('estadisticas_pedidos')
 
 
 class HistorialEstadoPedido(models.Model):
@@ -218,6 +247,9 @@ class ItemPedido(models.Model):
     # Cantidad de unidades
     cantidad = models.PositiveIntegerField(default=1)
     
+    # Talla elegida en el carrito (si el producto tiene tallas)
+    talla = models.CharField(max_length=20, blank=True, null=True)
+    
     def __str__(self):
         return f'{self.cantidad} x {self.producto.nombre} en Pedido {self.pedido.id}'
     
@@ -225,9 +257,131 @@ class ItemPedido(models.Model):
         """Calcula el subtotal de este ítem (precio * cantidad)"""
         return self.precio * self.cantidad
         
+class ReservaStock(models.Model):
+    """
+    Unidades retenidas para un pedido mientras se paga (ver pedidos/reservas.py).
+    
+    Mientras está activa, su cantidad está sumada en `reservado` del producto
+    (y de la talla, si la hay); al confirmarse se descuenta del stock y al
+    liberarse o vencer vuelve a estar disponible.
+    """
+    ACTIVA = 'activa'
+    CONFIRMADA = 'confirmada'
+    LIBERADA = 'liberada'
+    
+    ESTADOS = (
+        (ACTIVA, 'Activa'),
+        (CONFIRMADA, 'Confirmada'),
+        (LIBERADA, 'Liberada'),
+    )
+    
+    pedido = models.ForeignKey(Pedido, related_name='reservas', on_delete=models.CASCADE)
+    producto = models.ForeignKey(Producto, related_name='+', on_delete=models.CASCADE)
+    talla = models.ForeignKey(TallaProducto, related_name='+', on_delete=models.CASCADE,
+                              null=True, blank=True)
+    cantidad = models.PositiveIntegerField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ACTIVA)
+    expira = models.DateTimeField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Reserva de stock"
+        verbose_name_plural = "Reservas de stock"
+        indexes = [
+            models.Index(fields=['estado', 'expira'], name='reserva_estado_expira_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.cantidad} x {self.producto_id} para Pedido {self.pedido_id} ({self.estado})'
+
+
+class VentaQuerySet(models.QuerySet):
+    """
+    Las tablas de ventas guardan dos niveles de filas:
+    - Totales por pedido (categoria y marca nulas): num_pedidos es exacto
+    - Desglose por producto (categoria y marca informadas): num_pedidos
+      cuenta los pedidos que incluyen esa categoría/marca, así que no debe
+      sumarse entre categorías
+    """
+    def totales(self):
+        return self.filter(categoria__isnull=True, marca__isnull=True)
+
+    def desglose(self):
+        return self.filter(categoria__isnull=False)
+
+
+class VentaBase(models.Model):
+    """Dimensiones y medidas comunes de las tablas de ventas agregadas"""
+    estado = models.CharField(max_length=20, choices=Pedido.ESTADOS)
+    pagado = models.BooleanField(default=False)
+    metodo_pago = models.CharField(max_length=50, blank=True)
+    # Nulas en las filas de totales por pedido; al borrar una categoría o
+    # marca sus productos e ítems se borran en cascada, y su desglose también
+    categoria = models.ForeignKey('catalogo.Categoria', on_delete=models.CASCADE,
+                                  null=True, blank=True, related_name='+')
+    marca = models.ForeignKey('catalogo.Marca', on_delete=models.CASCADE,
+                              null=True, blank=True, related_name='+')
+    
+    # Medidas
+    num_pedidos = models.PositiveIntegerField(default=0)
+    unidades = models.PositiveIntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    objects = VentaQuerySet.as_manager()
+    
+    class Meta:
+        abstract = True
+
+
+class VentaDiaria(VentaBase):
+    """Ventas agregadas por día (ver pedidos/ventas.py)"""
+    fecha = models.DateField()
+    
+    class Meta:
+        verbose_name = 'Venta diaria'
+        verbose_name_plural = 'Ventas diarias'
+        indexes = [
+            models.Index(fields=['fecha', 'estado'], name='venta_diaria_fecha_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.fecha} {self.estado}: {self.importe}'
+
+
+class VentaMensual(VentaBase):
+    """Ventas agregadas por mes, consolidadas desde VentaDiaria"""
+    mes = models.DateField(help_text='Primer día del mes')
+    
+    class Meta:
+        verbose_name = 'Venta mensual'
+        verbose_name_plural = 'Ventas mensuales'
+        indexes = [
+            models.Index(fields=['mes', 'estado'], name='venta_mensual_mes_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.mes:%Y-%m} {self.estado}: {self.importe}'
+
+
+class BloqueoVentas(models.Model):
+    """
+    Una fila por día o mes de las tablas de ventas. Su recálculo la bloquea
+    con select_for_update, de modo que dos recálculos del mismo periodo no
+    se solapan (ver pedidos/ventas.py).
+    """
+    periodo = models.CharField(max_length=12, unique=True, help_text="'dia:AAAA-MM-DD' o 'mes:AAAA-MM'")
+
+    class Meta:
+        verbose_name = 'Bloqueo de ventas'
+        verbose_name_plural = 'Bloqueos de ventas'
+
+    def __str__(self):
+        return self.periodo
+
+
 def get_items_count(self):
     """Devuelve el número total de ítems en el pedido"""
-    return sum(item.cantidad for item in self.items.all())
+    return self.num_unidades
 
 def get_status_display_class(self):
     """Devuelve una clase CSS según el estado del pedido"""
@@ -243,30 +397,15 @@ def get_status_display_class(self):
 @classmethod
 def get_estadisticas(cls):
     """Obtiene estadísticas globales de pedidos"""
-    from django.db.models import Count, Sum, Avg
-    from django.utils import timezone
-    import datetime
-    
-    # Fecha de hace 30 días
-    hace_30_dias = timezone.now() - datetime.timedelta(days=30)
-    
-    # Todos los pedidos
-    total_pedidos = cls.objects.count()
-    
-    # Pedidos de los últimos 30 días
-    pedidos_recientes = cls.objects.filter(fecha_pedido__gte=hace_30_dias).count()
-    
-    # Cantidad de pedidos por estado
-    pedidos_por_estado = dict(cls.objects.values('estado').annotate(
-        total=Count('id')).values_list('estado', 'total'))
-    
-    # Ingresos totales (de pedidos pagados)
-    # Nota: Esto asume que tienes un método total() que calcula el total del pedido
-    ingresos_totales = sum(p.total() for p in cls.objects.filter(pagado=True))
+    from .estadisticas import resumen_pedidos
     
-    # Ingresos de los últimos 30 días
-    ingresos_recientes = sum(p.total() for p in cls.objects.filter(
-        pagado=True, fecha_pedido__gte=hace_30_dias))
+    # Una sola consulta agregada (ver pedidos/estadisticas.py)
+    resumen = resumen_pedidos()
+    total_pedidos = resumen['total']
+    pedidos_recientes = resumen['recientes']
+    pedidos_por_estado = {estado: n for estado, n in resumen['por_estado'].items() if n}
+    ingresos_totales = resumen['ingresos_totales']
+    ingresos_recientes = resumen['ingresos_recientes']
     
     return {
         'total_pedidos': total_pedidos,
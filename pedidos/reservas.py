@@ -0,0 +1,274 @@
+"""
+Reservas de stock con caducidad.
+
+Al hacer checkout cada línea del pedido retiene sus unidades durante
+RESERVA_STOCK_MINUTOS: la reserva se suma a la columna `reservado` del
+producto (y de la talla), de modo que lo disponible es stock - reservado y
+se lee de la propia fila, sin sumar reservas. Al pagar, la reserva se
+confirma (se descuenta del stock); si el pago falla o la reserva vence
+(comando liberar_reservas), las unidades vuelven a estar disponibles.
+
+Todos los cambios de contadores son un único UPDATE por tabla con la
+condición en el WHERE (p. ej. stock >= reservado + n en cada fila), previo
+bloqueo de las filas con select_for_update en orden de id: con cientos de
+checkouts simultáneos sobre el mismo producto cada uno espera su turno en
+el bloqueo de fila y ninguno puede reservar más de lo que queda.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
+
+from catalogo.models import Producto, TallaProducto
+from utils.cache_utils import invalidate_model_cache
+from .models import ReservaStock
+
+logger = logging.getLogger('mototienda')
+
+
+class StockInsuficiente(Exception):
+    """
+    No hay unidades disponibles para alguna línea.
+
+    Atributos:
+        faltantes (list): dicts con producto, talla, solicitado y disponible
+    """
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        detalle = ', '.join(
+            f"{f['producto']}{' talla ' + f['talla'] if f['talla'] else ''} "
+            f"(quedan {f['disponible']})"
+            for f in faltantes
+        )
+        super().__init__(f'Stock insuficiente: {detalle}')
+
+
+def duracion():
+    return timedelta(minutes=getattr(settings, 'RESERVA_STOCK_MINUTOS', 15))
+
+
+def _actualizar(modelo, cantidades, condicion, **cambios):
+    """
+    Aplica `cambios` a varias filas en un único UPDATE condicionado.
+
+    Args:
+        modelo: Producto o TallaProducto
+        cantidades (dict): {id: unidades}
+        condicion: función (unidades) -> dict de filtros que debe cumplir la fila
+        cambios: campo -> función (unidades) -> expresión del nuevo valor
+
+    Returns:
+        bool: True si se actualizaron todas las filas
+    """
+    if not cantidades:
+        return True
+    filtro = Q()
+    for fila_id, unidades in cantidades.items():
+        filtro |= Q(id=fila_id, **condicion(unidades))
+    valores = {
+        campo: Case(*[When(id=fila_id, then=expresion(unidades))
+                      for fila_id, unidades in cantidades.items()],
+                    default=F(campo), output_field=IntegerField())
+        for campo, expresion in cambios.items()
+    }
+    return modelo.objects.filter(filtro).update(**valores) == len(cantidades)
+
+
+def _reservar_filas(modelo, cantidades):
+    return _actualizar(modelo, cantidades,
+                       lambda n: {'stock__gte': F('reservado') + n},
+                       reservado=lambda n: F('reservado') + n)
+
+
+def _liberar_filas(modelo, cantidades):
+    return _actualizar(modelo, cantidades,
+                       lambda n: {'reservado__gte': n},
+                       reservado=lambda n: F('reservado') - n)
+
+
+def _confirmar_filas(modelo, cantidades):
+    return _actualizar(modelo, cantidades,
+                       lambda n: {'reservado__gte': n, 'stock__gte': n},
+                       reservado=lambda n: F('reservado') - n,
+                       stock=lambda n: F('stock') - n)
+
+
+def _bloquear(producto_ids, talla_ids=()):
+    """Bloquea las filas de producto y talla en orden de id (sin interbloqueos)"""
+    productos = {p.id: p for p in Producto.objects.select_for_update()
+                 .filter(id__in=producto_ids).order_by('id')
+                 .only('id', 'nombre', 'stock', 'reservado', 'disponible')}
+    tallas = {}
+    if talla_ids:
+        tallas = {t.id: t for t in TallaProducto.objects.select_for_update()
+                  .filter(id__in=talla_ids).order_by('id')
+                  .only('id', 'producto_id', 'talla', 'stock', 'reservado', 'disponible')}
+    return productos, tallas
+
+
+def _agrupar(reservas):
+    por_producto, por_talla = defaultdict(int), defaultdict(int)
+    for reserva in reservas:
+        por_producto[reserva.producto_id] += reserva.cantidad
+        if reserva.talla_id:
+            por_talla[reserva.talla_id] += reserva.cantidad
+    return dict(por_producto), dict(por_talla)
+
+
+def _invalidar_productos(producto_ids):
+    for producto_id in producto_ids:
+        invalidate_model_cache('stock', producto_id)
+
+
+def reservar(pedido, lineas):
+    """
+    Retiene las unidades de las líneas de un pedido.
+
+    Args:
+        pedido: Pedido guardado
+        lineas (iterable): tuplas (producto_id, talla, cantidad); `talla` es
+            el texto de la talla o vacío
+
+    Returns:
+        list: Reservas creadas
+
+    Raises:
+        StockInsuficiente: Si alguna línea pide más de lo disponible
+    """
+    lineas = list(lineas)
+    with transaction.atomic():
+        tallas_pedidas = {(producto_id, talla) for producto_id, talla, _ in lineas if talla}
+        talla_ids = {}
+        if tallas_pedidas:
+            filtro = Q()
+            for producto_id, talla in tallas_pedidas:
+                filtro |= Q(producto_id=producto_id, talla=talla)
+            talla_ids = {(t['producto_id'], t['talla']): t['id']
+                         for t in TallaProducto.objects.filter(filtro).values('id', 'producto_id', 'talla')}
+
+        reservas = [
+            # Las tallas sin fila propia solo cuentan para el stock del producto
+            ReservaStock(pedido=pedido, producto_id=producto_id, cantidad=cantidad,
+                         talla_id=talla_ids.get((producto_id, talla)) if talla else None)
+            for producto_id, talla, cantidad in lineas
+        ]
+        por_producto, por_talla = _agrupar(reservas)
+        productos, tallas = _bloquear(por_producto, por_talla)
+
+        faltantes = []
+        for producto_id, unidades in por_producto.items():
+            producto = productos.get(producto_id)
+            disponible = producto.disponibles if producto and producto.disponible else 0
+            if unidades > disponible:
+                faltantes.append({'producto': producto.nombre if producto else producto_id,
+                                  'talla': None, 'solicitado': unidades, 'disponible': disponible})
+        for talla_id, unidades in por_talla.items():
+            fila = tallas[talla_id]
+            disponible = fila.disponibles if fila.disponible else 0
+            if unidades > disponible:
+                faltantes.append({'producto': productos[fila.producto_id].nombre, 'talla': fila.talla,
+                                  'solicitado': unidades, 'disponible': disponible})
+        if faltantes:
+            raise StockInsuficiente(faltantes)
+
+        if not (_reservar_filas(Producto, por_producto) and _reservar_filas(TallaProducto, por_talla)):
+            # Solo ocurre si el motor no respeta select_for_update; el
+            # WHERE del UPDATE es la garantía final
+            raise StockInsuficiente([])
+
+        expira = timezone.now() + duracion()
+        for reserva in reservas:
+            reserva.expira = expira
+        ReservaStock.objects.bulk_create(reservas)
+
+    _invalidar_productos(por_producto)
+    return reservas
+
+
+def _cerrar(reservas, estado, aplicar):
+    """Cambia de estado reservas activas ajustando los contadores"""
+    reservas = [r for r in reservas if r.estado == ReservaStock.ACTIVA]
+    if not reservas:
+        return 0
+    por_producto, por_talla = _agrupar(reservas)
+    _bloquear(por_producto, por_talla)
+    if not (aplicar(Producto, por_producto) and aplicar(TallaProducto, por_talla)):
+        logger.error(f"Contadores de reserva incoherentes al pasar a {estado} las reservas "
+                     f"{[r.id for r in reservas]}; revisar el stock de {list(por_producto)}")
+    ReservaStock.objects.filter(id__in=[r.id for r in reservas]).update(estado=estado)
+    _invalidar_productos(por_producto)
+    return len(reservas)
+
+
+def _activas(pedido):
+    return list(ReservaStock.objects.select_for_update()
+                .filter(pedido=pedido, estado=ReservaStock.ACTIVA).order_by('id'))
+
+
+def liberar(pedido):
+    """Devuelve al disponible las unidades reservadas por un pedido"""
+    with transaction.atomic():
+        return _cerrar(_activas(pedido), ReservaStock.LIBERADA, _liberar_filas)
+
+
+def renovar(pedido):
+    """
+    Asegura que el pedido tiene sus unidades reservadas al empezar el pago:
+    alarga las reservas activas o, si vencieron, vuelve a reservar.
+
+    Raises:
+        StockInsuficiente: Si las reservas vencieron y ya no hay unidades
+    """
+    with transaction.atomic():
+        activas = _activas(pedido)
+        if activas:
+            ReservaStock.objects.filter(id__in=[r.id for r in activas]).update(
+                expira=timezone.now() + duracion())
+            return activas
+        if pedido.reservas.filter(estado=ReservaStock.CONFIRMADA).exists():
+            return []
+        return reservar(pedido, pedido.items.values_list('producto_id', 'talla', 'cantidad'))
+
+
+def confirmar(pedido):
+    """
+    Convierte las reservas del pedido en venta: descuenta el stock.
+
+    Si las reservas vencieron durante el pago se intenta reservar de nuevo;
+    si ya no hay unidades el pago se mantiene (ya se cobró) y se registra
+    el error para que se revise el pedido.
+
+    Returns:
+        bool: True si el stock del pedido quedó descontado
+    """
+    with transaction.atomic():
+        activas = _activas(pedido)
+        if not activas:
+            if pedido.reservas.filter(estado=ReservaStock.CONFIRMADA).exists():
+                return True
+            try:
+                with transaction.atomic():
+                    activas = reservar(pedido, pedido.items.values_list('producto_id', 'talla', 'cantidad'))
+            except StockInsuficiente as e:
+                logger.error(f"Pedido #{pedido.id} pagado sin stock disponible: {e}")
+                return False
+        _cerrar(activas, ReservaStock.CONFIRMADA, _confirmar_filas)
+        return True
+
+
+def liberar_vencidas(limite=500):
+    """
+    Libera las reservas activas que ya vencieron.
+
+    Returns:
+        int: Número de reservas liberadas
+    """
+    with transaction.atomic():
+        vencidas = list(ReservaStock.objects.select_for_update()
+                        .filter(estado=ReservaStock.ACTIVA, expira__lt=timezone.now())
+                        .order_by('id')[:limite])
+        return _cerrar(vencidas, ReservaStock.LIBERADA, _liberar_filas)
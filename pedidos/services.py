@@ -0,0 +1,74 @@
+"""
+Servicio de checkout: convierte el carrito de un usuario en un pedido.
+
+Todo ocurre en una transacción con un número de consultas que no depende
+del número de líneas del carrito:
+
+- Las unidades no se descuentan todavía: se reservan durante
+  RESERVA_STOCK_MINUTOS (ver reservas.py) y se descuentan al confirmar el
+  pago. Si no hay disponible se revierte todo.
+- Los ítems se insertan con bulk_create. Como bulk_create y update() no
+  emiten señales, aquí se recalculan los totales, se marcan las ventas
+  agregadas y se invalida la caché una sola vez.
+"""
+import logging
+
+from django.db import transaction
+
+from carrito.models import ItemCarrito
+from utils.cache_utils import invalidate_model_cache, invalidation_batch
+from . import reservas, ventas
+from .models import ItemPedido, Pedido
+from .reservas import StockInsuficiente  # noqa: F401 (la vista la importa de aquí)
+
+logger = logging.getLogger('mototienda')
+
+
+class CarritoVacio(Exception):
+    """El carrito no tiene ítems"""
+    pass
+
+
+def crear_pedido_desde_carrito(carrito, pedido):
+    """
+    Crea el pedido con los ítems del carrito, reserva el stock y vacía el
+    carrito, todo o nada.
+
+    Args:
+        carrito: Carrito del usuario
+        pedido: Pedido sin guardar con los datos de envío y el usuario
+
+    Returns:
+        Pedido: El pedido guardado, con los totales calculados
+
+    Raises:
+        CarritoVacio, StockInsuficiente
+    """
+    with invalidation_batch(), transaction.atomic():
+        lineas = list(ItemCarrito.objects.filter(carrito=carrito)
+                      .select_related('producto').only('producto_id', 'cantidad', 'talla',
+                                                       'producto__precio'))
+        if not lineas:
+            raise CarritoVacio()
+
+        pedido.save()
+        reservas.reservar(pedido, [(linea.producto_id, linea.talla, linea.cantidad)
+                                   for linea in lineas])
+        ItemPedido.objects.bulk_create([
+            ItemPedido(pedido=pedido, producto_id=linea.producto_id, precio=linea.producto.precio,
+                       cantidad=linea.cantidad, talla=linea.talla or None)
+            for linea in lineas
+        ])
+        Pedido.actualizar_totales([pedido.id])
+        pedido.refresh_from_db(fields=Pedido.CAMPOS_TOTALES)
+        ventas.marcar_pedido(pedido.id)
+
+        # Las señales de cada línea invalidan la misma clave del carrito; el
+        # lote las agrupa en una sola invalidación al salir
+        carrito.items.all().delete()
+
+        invalidate_model_cache('pedido', pedido.id)
+        invalidate_model_cache('carrito', carrito.usuario_id)
+
+    logger.info(f"Pedido #{pedido.id} creado con {len(lineas)} líneas")
+    return pedido
@@ -1,30 +1,58 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from .models import Pedido, ItemPedido
 from utils.cache_utils import invalidate_model_cache
+from . import reservas, ventas
 
 # Signals para Pedido
 @receiver(post_save, sender=Pedido)
 def pedido_saved(sender, instance, created, **kwargs):
-    """Invalidar caché cuando se guarda un pedido"""
+    """Invalidar caché y, si cambió algo que cuenta en las ventas, marcar su día"""
     invalidate_model_cache('pedido', instance.id)
     
+    cambios = {} if created else instance.tracker.changed()
+    if not (created or cambios):
+        return  # Datos de envío, notas...: no afectan a ventas ni estadísticas
+    ventas.marcar_fecha(ventas.fecha_local(instance.fecha_pedido))
+    if cambios.get('fecha_pedido'):
+        # El pedido sale del día en que estaba
+        ventas.marcar_fecha(ventas.fecha_local(cambios['fecha_pedido']))
+    
     # También invalidamos estadísticas generales
     invalidate_model_cache('estadisticas_pedidos')
     
+@receiver(pre_delete, sender=Pedido)
+def pedido_deleting(sender, instance, **kwargs):
+    """Devolver el stock reservado antes de que se borren las reservas en cascada"""
+    reservas.liberar(instance)
+
 @receiver(post_delete, sender=Pedido)
 def pedido_deleted(sender, instance, **kwargs):
-    """Invalidar caché cuando se elimina un pedido"""
+    """Invalidar caché y marcar su día en las ventas agregadas cuando se elimina un pedido"""
     invalidate_model_cache('pedido', instance.id)
+    ventas.marcar_fecha(ventas.fecha_local(instance.fecha_pedido))
     invalidate_model_cache('estadisticas_pedidos')
 
 # Signals para ItemPedido
+def _actualizar_totales_pedido(item):
+    """Recalcula los totales del pedido y refresca la instancia cargada, si la hay"""
+    Pedido.actualizar_totales([item.pedido_id])
+    if ItemPedido.pedido.is_cached(item):
+        try:
+            item.pedido.refresh_from_db(fields=Pedido.CAMPOS_TOTALES)
+        except Pedido.DoesNotExist:
+            pass  # El pedido se está eliminando en cascada
+
 @receiver(post_save, sender=ItemPedido)
 def item_pedido_saved(sender, instance, created, **kwargs):
-    """Invalidar caché cuando se guarda un item de pedido"""
-    invalidate_model_cache('pedido', instance.pedido.id)
+    """Actualizar totales e invalidar caché cuando se guarda un item de pedido"""
+    _actualizar_totales_pedido(instance)
+    ventas.marcar_pedido(instance.pedido_id)
+    invalidate_model_cache('pedido', instance.pedido_id)
     
 @receiver(post_delete, sender=ItemPedido)
 def item_pedido_deleted(sender, instance, **kwargs):
-    """Invalidar caché cuando se elimina un item de pedido"""
-    invalidate_model_cache('pedido', instance.pedido.id)
\ No newline at end of file
+    """Actualizar totales e invalidar caché cuando se elimina un item de pedido"""
+    _actualizar_totales_pedido(instance)
+    ventas.marcar_pedido(instance.pedido_id)
+    invalidate_model_cache('pedido', instance.pedido_id)
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Tareas en segundo plano de los pedidos (ver tareas/cola.py).
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+
+from tareas.cola import tarea
+from . import exportacion, ventas
+from .models import Pedido
+
+
+@tarea(max_intentos=5)
+def enviar_notificacion_estado(pedido_id, estado, notas=None):
+    """Avisa por correo al cliente del nuevo estado de su pedido"""
+    pedido = (Pedido.objects
+              .select_related('usuario')
+              .only('id', 'nombre_completo', 'usuario__email')
+              .filter(id=pedido_id)
+              .first())
+    if not pedido or not pedido.usuario.email:
+        return
+
+    estado_display = dict(Pedido.ESTADOS).get(estado, estado)
+    # Sin fail_silently: un fallo de SMTP hace que la tarea se reintente
+    send_mail(
+        f'Pedido #{pedido.id} - Estado actualizado a {estado_display}',
+        f'Hola {pedido.nombre_completo},\n\nTu pedido #{pedido.id} ha sido actualizado a: {estado_display}.\n\n' +
+        (f'Notas: {notas}\n\n' if notas else '') +
+        'Gracias por tu compra en Moto Tienda.',
+        settings.DEFAULT_FROM_EMAIL,
+        [pedido.usuario.email],
+    )
+
+
+@tarea(max_intentos=3)
+def exportar_pedidos(usuario_id, nombre, filtros, enlace):
+    """Genera una exportación de pedidos y envía el enlace de descarga"""
+    exportacion.guardar_exportacion(nombre, exportacion.filtros_desde_request(filtros))
+
+    usuario = User.objects.filter(id=usuario_id).only('email').first()
+    if usuario and usuario.email:
+        send_mail(
+            'Exportación de pedidos lista',
+            f'La exportación de pedidos que solicitaste ya está disponible:\n\n{enlace}',
+            settings.DEFAULT_FROM_EMAIL,
+            [usuario.email],
+        )
+
+
+@tarea(max_intentos=5)
+def recalcular_ventas(fechas, pedidos):
+    """Recalcula las ventas agregadas de los días afectados por una transacción"""
+    ventas.procesar([datetime.date.fromisoformat(fecha) for fecha in fechas], pedidos)
@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, skipUnlessDBFeature
 from django.contrib.auth.models import User
 from catalogo.models import Categoria, Marca, Producto
 from pedidos.models import Pedido, ItemPedido, HistorialEstadoPedido
@@ -170,6 +170,15 @@ class PedidosUtilsTest(TestCase):
     """Tests para las utilidades de pedidos"""
     
     def setUp(self):
+        # Las facturas generadas van a un directorio temporal
+        import shutil, tempfile
+        from django.test import override_settings
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajustes = override_settings(FACTURAS_ROOT=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        
         # Crear usuario para pruebas
         self.user = User.objects.create_user(
             username='testuser',
@@ -235,4 +244,685 @@ class PedidosUtilsTest(TestCase):
         
         # Verificar respuesta
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response['Content-Type'], 'application/pdf')
\ No newline at end of file
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response.close()
+    
+    def test_factura_cacheada_por_version(self):
+        """La factura se renderiza una vez por versión del pedido y admite ETag"""
+        from unittest import mock
+        from pedidos import facturas
+        self.client.login(username='testuser', password='testpassword')
+        url = reverse('pedidos:factura_pedido', args=[self.pedido.id])
+        
+        response = self.client.get(url)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        etag = response['ETag']
+        
+        with mock.patch('pedidos.facturas.renderizar_factura') as renderizar:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+            renderizar.assert_not_called()
+        
+        # Un cambio en el pedido genera una versión nueva y borra la anterior
+        ItemPedido.objects.create(pedido=self.pedido, producto=self.producto, precio=10, cantidad=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response.close()
+        self.assertEqual(len(facturas.almacen().listdir(str(self.pedido.id))[1]), 1)
+    
+    def test_comando_generar_facturas(self):
+        """El comando genera las facturas que faltan y omite las vigentes"""
+        from io import StringIO
+        from django.core.management import call_command
+        salida = StringIO()
+        call_command('generar_facturas', procesos=1, stdout=salida)
+        self.assertIn('Facturas generadas: 1', salida.getvalue())
+        call_command('generar_facturas', procesos=1, stdout=salida)
+        self.assertIn('ya estaban al día: 1', salida.getvalue())
+class PaginacionCursorTest(TestCase):
+    """Tests para la paginación por cursor de los listados de pedidos"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        # Fechas repetidas para comprobar el desempate por id
+        from django.utils import timezone
+        ahora = timezone.now()
+        for i in range(7):
+            pedido = Pedido.objects.create(
+                usuario=self.user, nombre_completo=f'Cliente {i}', direccion='Calle',
+                ciudad='Ciudad', codigo_postal='12345', telefono='123456789'
+            )
+            Pedido.objects.filter(id=pedido.id).update(fecha_pedido=ahora.replace(microsecond=i // 2))
+    
+    def test_recorrido_completo_sin_duplicados(self):
+        from utils.pagination import KeysetPaginator
+        paginator = KeysetPaginator(Pedido.objects.all(), 3, ordering=['-fecha_pedido'])
+        esperados = list(Pedido.objects.order_by('-fecha_pedido', '-pk'))
+        
+        vistos = []
+        pagina = paginator.page()
+        while True:
+            vistos.extend(pagina)
+            if not pagina.has_next:
+                break
+            pagina = paginator.page(pagina.next_cursor)
+        self.assertEqual(vistos, esperados)
+        
+        # Retroceder desde la última página devuelve la anterior
+        anterior = paginator.page(pagina.previous_cursor)
+        self.assertEqual(list(anterior), esperados[3:6])
+        self.assertTrue(anterior.has_previous)
+    
+    def test_cursor_invalido(self):
+        from utils.pagination import InvalidCursor, KeysetPaginator
+        paginator = KeysetPaginator(Pedido.objects.all(), 3, ordering=['-fecha_pedido'])
+        otro = KeysetPaginator(Pedido.objects.all(), 3, ordering=['id'])
+        cursor = otro.page().next_cursor
+        
+        with self.assertRaises(InvalidCursor):
+            paginator.page(cursor)
+        with self.assertRaises(InvalidCursor):
+            paginator.page('no-es-un-cursor')
+        self.assertEqual(len(paginator.get_page('no-es-un-cursor')), 3)
+
+    def test_cursor_manipulado_o_con_tipos_incorrectos(self):
+        from django.core import signing
+        from utils.pagination import InvalidCursor, KeysetPaginator
+        paginator = KeysetPaginator(Pedido.objects.all(), 3, ordering=['-fecha_pedido'])
+        cursor = paginator.page().next_cursor
+
+        # Cambiar la carga útil invalida la firma
+        firma = cursor.split(':', 1)[1]
+        falsificado = signing.dumps({'k': ['2020-01-01T00:00:00', 1], 'd': 'n'}).split(':', 1)[0]
+        with self.assertRaises(InvalidCursor):
+            paginator.page(f'{falsificado}:{firma}')
+
+        # Aunque estuviera firmado, cada valor pasa por el to_python() del campo
+        for valores in (['basura', 1], [{'a': 1}, 1], ['2020-01-01T00:00:00', 'x'], [None, 1]):
+            firmado = signing.dumps({'k': valores, 'd': 'n'}, salt=paginator._salt)
+            with self.assertRaises(InvalidCursor):
+                paginator.page(firmado)
+            self.assertEqual(len(paginator.get_page(firmado)), 3)
+
+        self.client.login(username='cliente', password='testpassword')
+        response = self.client.get(reverse('pedidos:lista_pedidos'), {'cursor': firmado})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['pedidos']), 7)
+    
+    def test_lista_pedidos_paginada(self):
+        self.client.login(username='cliente', password='testpassword')
+        response = self.client.get(reverse('pedidos:lista_pedidos'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['pedidos']), 7)
+        self.assertFalse(response.context['pedidos'].has_next)
+
+class TotalesPedidoTest(TestCase):
+    """Tests para los totales desnormalizados de Pedido"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.casco = Producto.objects.create(
+            nombre='Casco', descripcion='Casco', precio=100, categoria=categoria, marca=marca
+        )
+        self.guantes = Producto.objects.create(
+            nombre='Guantes', descripcion='Guantes', precio=25.5, categoria=categoria, marca=marca
+        )
+        self.pedido = Pedido.objects.create(
+            usuario=self.user, nombre_completo='Cliente', direccion='Calle',
+            ciudad='Ciudad', codigo_postal='12345', telefono='123456789'
+        )
+    
+    def test_totales_se_mantienen_con_los_items(self):
+        item = ItemPedido.objects.create(pedido=self.pedido, producto=self.casco, precio=100, cantidad=1)
+        ItemPedido.objects.create(pedido=self.pedido, producto=self.guantes, precio=25.5, cantidad=3)
+        self.assertEqual(self.pedido.total(), Decimal('176.50'))
+        self.assertEqual((self.pedido.num_items, self.pedido.num_unidades), (2, 4))
+        
+        item.cantidad = 2
+        item.save()
+        item.delete()
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.total_importe, Decimal('76.50'))
+        self.assertEqual((self.pedido.num_items, self.pedido.num_unidades), (1, 3))
+    
+    def test_instancia_desfasada_no_pisa_los_totales(self):
+        desfasado = Pedido.objects.get(pk=self.pedido.pk)
+        ItemPedido.objects.create(pedido_id=self.pedido.pk, producto=self.casco, precio=100, cantidad=2)
+        
+        desfasado.notas_admin = 'Revisado'
+        desfasado.save()
+        
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.total_importe, Decimal('200.00'))
+        self.assertEqual(self.pedido.notas_admin, 'Revisado')
+    
+    def test_comando_verifica_y_corrige(self):
+        from io import StringIO
+        from django.core.management import call_command
+        ItemPedido.objects.create(pedido=self.pedido, producto=self.casco, precio=100, cantidad=1)
+        Pedido.objects.filter(pk=self.pedido.pk).update(total_importe=0, num_items=0)
+        
+        salida = StringIO()
+        call_command('recalcular_totales_pedidos', '--verificar', stdout=salida)
+        self.assertIn('1 pedidos con totales incorrectos', salida.getvalue())
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.total_importe, Decimal('0'))
+        
+        call_command('recalcular_totales_pedidos', stdout=StringIO())
+        self.pedido.refresh_from_db()
+        self.assertEqual((self.pedido.total_importe, self.pedido.num_items), (Decimal('100.00'), 1))
+
+class EstadisticasPedidosTest(TestCase):
+    """Tests para el servicio de estadísticas de pedidos"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin', password='testpassword', is_staff=True)
+        self.cliente = User.objects.create_user(username='cliente', password='testpassword')
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.producto = Producto.objects.create(
+            nombre='Casco', descripcion='Casco', precio=100, categoria=categoria, marca=marca
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for estado, pagado in [('pendiente', False), ('entregado', True), ('entregado', True)]:
+                self._crear_pedido(estado, pagado)
+    
+    def _crear_pedido(self, estado, pagado, usuario=None):
+        pedido = Pedido.objects.create(
+            usuario=usuario or self.cliente, nombre_completo='Cliente', direccion='Calle',
+            ciudad='Ciudad', codigo_postal='12345', telefono='123456789',
+            estado=estado, pagado=pagado
+        )
+        ItemPedido.objects.create(pedido=pedido, producto=self.producto, precio=100, cantidad=1)
+        return pedido
+    
+    def test_resumen_en_una_consulta(self):
+        from pedidos.estadisticas import resumen_pedidos
+        with self.assertNumQueries(1):
+            resumen = resumen_pedidos()
+        self.assertEqual(resumen['total'], 3)
+        self.assertEqual(resumen['por_estado']['entregado'], 2)
+        self.assertEqual(resumen['por_estado']['cancelado'], 0)
+        self.assertEqual(resumen['ingresos_totales'], Decimal('200.00'))
+    
+    def test_serie_mensual_rellena_meses(self):
+        from pedidos.estadisticas import serie_mensual
+        serie = serie_mensual(6)
+        self.assertEqual(len(serie), 6)
+        self.assertEqual(serie[-1]['pedidos'], 3)
+        self.assertEqual(sum(mes['pedidos'] for mes in serie[:-1]), 0)
+    
+    def test_cache_invalidada_por_pedidos(self):
+        from pedidos.estadisticas import obtener_estadisticas
+        obtener_estadisticas()
+        with self.assertNumQueries(0):
+            obtener_estadisticas()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._crear_pedido('cancelado', False, usuario=self.admin)
+        estadisticas = obtener_estadisticas()
+        self.assertEqual(estadisticas['resumen']['por_estado']['cancelado'], 1)
+        self.assertEqual(estadisticas['mejores_clientes'][0]['usuario__username'], 'cliente')
+    
+    def test_vista_estadisticas(self):
+        self.client.login(username='admin', password='testpassword')
+        response = self.client.get(reverse('pedidos:estadisticas_pedidos'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['pedidos_entregados'], 2)
+
+
+class VentasAgregadasTest(TestCase):
+    """Tests para las tablas de ventas agregadas diarias y mensuales"""
+    
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='cliente', password='testpassword')
+        self.categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.producto = Producto.objects.create(
+            nombre='Casco', descripcion='Casco', precio=100, categoria=self.categoria, marca=marca
+        )
+    
+    def _crear_pedido(self, estado='pendiente', pagado=False, cantidad=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido = Pedido.objects.create(
+                usuario=self.usuario, nombre_completo='Cliente', direccion='Calle',
+                ciudad='Ciudad', codigo_postal='12345', telefono='123456789',
+                estado=estado, pagado=pagado
+            )
+            ItemPedido.objects.create(pedido=pedido, producto=self.producto, precio=100, cantidad=cantidad)
+        return pedido
+    
+    def test_filas_mantenidas_al_crear_y_pagar(self):
+        from pedidos.models import VentaDiaria, VentaMensual
+        pedido = self._crear_pedido(cantidad=2)
+        
+        fila = VentaDiaria.objects.totales().get()
+        self.assertEqual((fila.estado, fila.pagado), ('pendiente', False))
+        self.assertEqual((fila.num_pedidos, fila.unidades, fila.importe), (1, 2, Decimal('200.00')))
+        desglose = VentaDiaria.objects.desglose().get()
+        self.assertEqual(desglose.categoria_id, self.categoria.id)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.estado = 'procesando'
+            pedido.pagado = True
+            pedido.save()
+        fila = VentaMensual.objects.totales().get()
+        self.assertEqual((fila.estado, fila.pagado, fila.importe), ('procesando', True, Decimal('200.00')))
+    
+    def test_recalculo_fuera_de_la_peticion(self):
+        from django.test import override_settings
+        from pedidos.models import VentaDiaria
+        from tareas import cola
+        from tareas.models import Tarea
+        with override_settings(TAREAS_SINCRONAS=False):
+            self._crear_pedido(cantidad=2)
+            # El checkout solo encola una tarea con todo lo marcado
+            tarea = Tarea.objects.get()
+            self.assertEqual(tarea.nombre, 'pedidos.tareas.recalcular_ventas')
+            self.assertFalse(VentaDiaria.objects.exists())
+            
+            cola.procesar_lote()
+        self.assertEqual(VentaDiaria.objects.totales().get().unidades, 2)
+    
+    def test_cambio_de_fecha_mueve_el_pedido_de_dia(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from pedidos import ventas
+        from pedidos.models import VentaDiaria
+        pedido = self._crear_pedido()
+        
+        # Cambios que no cuentan en las ventas no recalculan nada
+        pedido = Pedido.objects.get(id=pedido.id)
+        with mock.patch.object(ventas, 'marcar_fecha') as marcar:
+            pedido.telefono = '987654321'
+            pedido.save()
+        marcar.assert_not_called()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.fecha_pedido = timezone.now() - timedelta(days=3)
+            pedido.save()
+        self.assertEqual(list(VentaDiaria.objects.totales().values_list('fecha', flat=True)),
+                         [ventas.fecha_local(pedido.fecha_pedido)])
+    
+    def test_reconstruir_y_periodo(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+        from pedidos import ventas
+        from pedidos.models import VentaDiaria
+        
+        anterior = self._crear_pedido('entregado', True)
+        self._crear_pedido('entregado', True)
+        # Mover un pedido dos meses atrás con update() (sin señales)
+        Pedido.objects.filter(id=anterior.id).update(
+            fecha_pedido=timezone.now() - timedelta(days=60))
+        
+        call_command('reconstruir_ventas', stdout=open('/dev/null', 'w'))
+        self.assertEqual(VentaDiaria.objects.totales().count(), 2)
+        
+        hoy = timezone.localdate()
+        filas = ventas.ventas_por_periodo(hoy - timedelta(days=90), hoy)
+        self.assertEqual(filas, [{'estado': 'entregado', 'num_pedidos': 2, 'unidades': 2,
+                                  'importe': Decimal('200.00')}])
+        filas = ventas.ventas_por_periodo(hoy - timedelta(days=10), hoy)
+        self.assertEqual(filas[0]['num_pedidos'], 1)
+
+
+class VentasConcurrenciaTest(TransactionTestCase):
+    """Recálculos simultáneos del mismo día desde dos checkouts"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='cliente', password='testpassword')
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.producto = Producto.objects.create(
+            nombre='Casco', descripcion='Casco', precio=100, categoria=categoria, marca=marca
+        )
+
+    def _crear_pedido(self):
+        # Fuera de una transacción: las señales recalculan el día al momento
+        pedido = Pedido.objects.create(
+            usuario=self.usuario, nombre_completo='Cliente', direccion='Calle',
+            ciudad='Ciudad', codigo_postal='12345', telefono='123456789'
+        )
+        ItemPedido.objects.create(pedido=pedido, producto=self.producto, precio=100, cantidad=1)
+        return pedido
+
+    def test_el_dia_se_bloquea_antes_de_leer_los_pedidos(self):
+        from unittest import mock
+        from pedidos import ventas
+        from pedidos.models import BloqueoVentas
+
+        pedido = self._crear_pedido()
+        hoy = ventas.fecha_local(pedido.fecha_pedido)
+        orden = mock.Mock()
+        with mock.patch.object(ventas, '_bloquear', wraps=ventas._bloquear) as bloquear, \
+             mock.patch.object(ventas, '_filas_dia', wraps=ventas._filas_dia) as filas:
+            orden.attach_mock(bloquear, 'bloquear')
+            orden.attach_mock(filas, 'filas')
+            ventas.recalcular_dia(hoy)
+        self.assertEqual(orden.mock_calls[:2], [mock.call.bloquear(f'dia:{hoy.isoformat()}'),
+                                                mock.call.filas(hoy)])
+        self.assertTrue(BloqueoVentas.objects.filter(periodo=f'dia:{hoy.isoformat()}').exists())
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_recalculos_simultaneos_no_pierden_pedidos(self):
+        import threading
+        import time
+        from unittest import mock
+        from django.db import connection
+        from pedidos import ventas
+        from pedidos.models import VentaDiaria
+
+        primero = self._crear_pedido()
+        hoy = ventas.fecha_local(primero.fecha_pedido)
+        leido = threading.Event()
+        original = ventas._filas_dia
+
+        def filas_lentas(fecha):
+            filas = original(fecha)
+            if threading.current_thread().name == 'recalculo-a':
+                # A ya leyó (solo el primer pedido) y tarda en escribir
+                leido.set()
+                time.sleep(0.5)
+            return filas
+
+        def recalculo_a():
+            try:
+                ventas.recalcular_dia(hoy)
+            finally:
+                connection.close()
+
+        def checkout_b():
+            try:
+                leido.wait(5)
+                # Sus señales recalculan el día: espera al bloqueo de A y
+                # después lee los dos pedidos
+                self._crear_pedido()
+            finally:
+                connection.close()
+
+        with mock.patch.object(ventas, '_filas_dia', filas_lentas):
+            hilos = [threading.Thread(target=recalculo_a, name='recalculo-a'),
+                     threading.Thread(target=checkout_b)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+
+        self.assertEqual(VentaDiaria.objects.totales().get(fecha=hoy).num_pedidos, 2)
+
+
+class ExportacionPedidosTest(TestCase):
+    """Tests para la exportación de pedidos en streaming"""
+    
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com',
+                                              password='testpassword', is_staff=True)
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.productos = [
+            Producto.objects.create(nombre=f'Casco {i}', descripcion='Casco', precio=100,
+                                    categoria=categoria, marca=marca)
+            for i in range(3)
+        ]
+        for estado in ['pendiente', 'entregado', 'entregado']:
+            pedido = Pedido.objects.create(
+                usuario=self.admin, nombre_completo='Cliente', direccion='Calle',
+                ciudad='Ciudad', codigo_postal='12345', telefono='123456789', estado=estado
+            )
+            for producto in self.productos:
+                ItemPedido.objects.create(pedido=pedido, producto=producto, precio=100, cantidad=1)
+        self.client.login(username='admin', password='testpassword')
+    
+    def test_csv_en_streaming(self):
+        import csv
+        response = self.client.get(reverse('pedidos:exportar_pedidos_csv'), {'estado': 'entregado'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        contenido = b''.join(response.streaming_content).decode('utf-8-sig')
+        filas = list(csv.reader(contenido.splitlines()))
+        self.assertEqual(filas[0][0], 'ID')
+        self.assertEqual(len(filas), 3)
+        self.assertEqual(filas[1][2], 'admin@example.com')
+        self.assertEqual(filas[1][5], '$300.00')
+        self.assertIn('1x Casco 2', filas[1][6])
+    
+    def test_consultas_constantes(self):
+        from pedidos.exportacion import filas_pedidos, pedidos_para_exportar, filtros_desde_request
+        from django.http import QueryDict
+        queryset = pedidos_para_exportar(filtros_desde_request(QueryDict()))
+        # Pedidos con su usuario y un prefetch de ítems con producto por bloque
+        with self.assertNumQueries(2):
+            filas = list(filas_pedidos(queryset))
+        self.assertEqual(len(filas), 3)
+    
+    def test_excel_write_only(self):
+        from io import BytesIO
+        import openpyxl
+        response = self.client.get(reverse('pedidos:exportar_pedidos_excel'),
+                                   {'fecha_desde': 'no-es-fecha'})
+        self.assertEqual(response.status_code, 200)
+        wb = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(wb.sheetnames, ['Pedidos', 'Resumen'])
+        self.assertEqual(wb['Pedidos'].max_row, 4)
+        self.assertGreater(wb['Pedidos'].column_dimensions['G'].width, 10)
+    
+    def test_exportacion_en_segundo_plano(self):
+        import tempfile
+        from django.core import mail
+        from django.test import override_settings
+        with tempfile.TemporaryDirectory() as directorio, \
+                override_settings(EXPORTACIONES_ROOT=directorio, TAREAS_SINCRONAS=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('pedidos:exportar_pedidos_csv'),
+                                           {'segundo_plano': '1'})
+            self.assertRedirects(response, reverse('pedidos:admin_lista_pedidos'))
+            
+            enlace = mail.outbox[0].body.split()[-1]
+            response = self.client.get(enlace)
+            self.assertEqual(response.status_code, 200)
+            contenido = b''.join(response.streaming_content).decode('utf-8-sig')
+            self.assertEqual(len(contenido.splitlines()), 4)
+            response.close()
+            
+            response = self.client.get(reverse('pedidos:descargar_exportacion', args=['no_existe.csv']))
+            self.assertEqual(response.status_code, 404)
+
+
+class CheckoutServiceTest(TestCase):
+    """Tests para el servicio de checkout (pedido, ítems y stock en una transacción)"""
+    
+    def setUp(self):
+        from carrito.models import Carrito
+        from catalogo.models import TallaProducto
+        self.usuario = User.objects.create_user(username='cliente', password='testpassword')
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.productos = [
+            Producto.objects.create(nombre=f'Casco {i}', descripcion='Casco', precio=100 + i,
+                                    categoria=categoria, marca=marca, stock=5)
+            for i in range(4)
+        ]
+        self.talla = TallaProducto.objects.create(producto=self.productos[0], talla='M', stock=2)
+        self.carrito = Carrito.objects.create(usuario=self.usuario)
+    
+    def _pedido(self):
+        return Pedido(usuario=self.usuario, nombre_completo='Cliente', direccion='Calle',
+                      ciudad='Ciudad', codigo_postal='12345', telefono='123456789')
+    
+    def _llenar_carrito(self, lineas):
+        from carrito.models import ItemCarrito
+        for producto, cantidad, talla in lineas:
+            ItemCarrito.objects.create(carrito=self.carrito, producto=producto,
+                                       cantidad=cantidad, talla=talla)
+    
+    def test_crea_pedido_y_reserva_stock(self):
+        from pedidos.services import crear_pedido_desde_carrito
+        self._llenar_carrito([(self.productos[0], 2, 'M'), (self.productos[1], 3, '')])
+        
+        pedido = crear_pedido_desde_carrito(self.carrito, self._pedido())
+        self.assertEqual(pedido.num_items, 2)
+        self.assertEqual(pedido.total_importe, Decimal('503.00'))
+        self.assertEqual(pedido.items.get(producto=self.productos[0]).talla, 'M')
+        self.assertFalse(self.carrito.items.exists())
+        
+        self.productos[0].refresh_from_db()
+        self.productos[1].refresh_from_db()
+        self.talla.refresh_from_db()
+        # El stock no se descuenta hasta el pago: solo queda reservado
+        self.assertEqual((self.productos[0].stock, self.productos[1].stock, self.talla.stock), (5, 5, 2))
+        self.assertEqual((self.productos[0].disponibles, self.productos[1].disponibles,
+                          self.talla.disponibles), (3, 2, 0))
+        self.assertEqual(pedido.reservas.filter(estado='activa').count(), 2)
+    
+    def test_consultas_constantes(self):
+        from pedidos.services import crear_pedido_desde_carrito
+        self._llenar_carrito([(self.productos[1], 1, '')])
+        # Vaciar el carrito con señales son dos consultas (SELECT y DELETE)
+        # sea cual sea el número de líneas
+        with self.assertNumQueries(14):
+            crear_pedido_desde_carrito(self.carrito, self._pedido())
+        
+        self._llenar_carrito([(p, 1, '') for p in self.productos[1:]])
+        with self.assertNumQueries(14):
+            crear_pedido_desde_carrito(self.carrito, self._pedido())
+    
+    def test_sin_stock_no_crea_nada(self):
+        from pedidos.services import StockInsuficiente, crear_pedido_desde_carrito
+        self._llenar_carrito([(self.productos[1], 1, ''), (self.productos[0], 3, 'M')])
+        
+        with self.assertRaises(StockInsuficiente) as contexto:
+            crear_pedido_desde_carrito(self.carrito, self._pedido())
+        self.assertEqual(contexto.exception.faltantes[0]['talla'], 'M')
+        self.assertFalse(Pedido.objects.exists())
+        self.assertEqual(self.carrito.items.count(), 2)
+        self.productos[1].refresh_from_db()
+        self.assertEqual((self.productos[1].stock, self.productos[1].reservado), (5, 0))
+    
+    def test_update_condicionado_evita_sobreventa(self):
+        from catalogo.models import Producto as ProductoModel
+        from pedidos.reservas import _reservar_filas
+        producto = self.productos[2]
+        # Otro checkout reservó el stock entre la lectura y el UPDATE
+        ProductoModel.objects.filter(id=producto.id).update(reservado=4)
+        self.assertFalse(_reservar_filas(ProductoModel, {producto.id: 2, self.productos[3].id: 1}))
+        producto.refresh_from_db()
+        self.assertEqual(producto.reservado, 4)
+    
+    def test_vista_crear_pedido(self):
+        self._llenar_carrito([(self.productos[1], 6, '')])
+        self.client.login(username='cliente', password='testpassword')
+        datos = {'nombre_completo': 'Cliente', 'direccion': 'Calle', 'ciudad': 'Ciudad',
+                 'codigo_postal': '12345', 'telefono': '123456789'}
+        response = self.client.post(reverse('pedidos:crear_pedido'), datos)
+        self.assertRedirects(response, reverse('carrito:ver_carrito'), fetch_redirect_response=False)
+        self.assertFalse(Pedido.objects.exists())
+        
+        self.carrito.items.update(cantidad=5)
+        response = self.client.post(reverse('pedidos:crear_pedido'), datos)
+        pedido = Pedido.objects.get()
+        self.assertRedirects(response, reverse('pagos:seleccionar_metodo_pago', args=[pedido.id]),
+                             fetch_redirect_response=False)
+
+
+class ReservasStockTest(TestCase):
+    """Tests para las reservas de stock con caducidad"""
+    
+    def setUp(self):
+        from catalogo.models import TallaProducto
+        self.usuario = User.objects.create_user(username='cliente', password='testpassword')
+        categoria = Categoria.objects.create(nombre='Cascos')
+        marca = Marca.objects.create(nombre='Shoei')
+        self.producto = Producto.objects.create(nombre='Casco', descripcion='Casco', precio=100,
+                                                categoria=categoria, marca=marca, stock=5)
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla='M', stock=3)
+    
+    def _pedido_con_reserva(self, cantidad, talla='M'):
+        from pedidos import reservas
+        pedido = Pedido.objects.create(usuario=self.usuario, nombre_completo='Cliente', direccion='Calle',
+                                       ciudad='Ciudad', codigo_postal='12345', telefono='123456789')
+        ItemPedido.objects.create(pedido=pedido, producto=self.producto, precio=100,
+                                  cantidad=cantidad, talla=talla)
+        reservas.reservar(pedido, [(self.producto.id, talla, cantidad)])
+        return pedido
+    
+    def _contadores(self):
+        self.producto.refresh_from_db()
+        self.talla.refresh_from_db()
+        return (self.producto.stock, self.producto.reservado, self.talla.stock, self.talla.reservado)
+    
+    def test_reservas_no_superan_el_stock(self):
+        from pedidos.reservas import StockInsuficiente
+        self._pedido_con_reserva(2)
+        with self.assertRaises(StockInsuficiente) as contexto:
+            self._pedido_con_reserva(2)
+        self.assertEqual(contexto.exception.faltantes[0]['disponible'], 1)
+        self.assertEqual(self._contadores(), (5, 2, 3, 2))
+    
+    def test_reservar_solo_invalida_la_ficha_del_producto(self):
+        from pedidos import reservas
+        from utils.cache_utils import flush_invalidations, get_tag_versions
+        pedido = Pedido.objects.create(usuario=self.usuario, nombre_completo='Cliente', direccion='Calle',
+                                       ciudad='Ciudad', codigo_postal='12345', telefono='123456789')
+        # Las invalidaciones de setUp siguen en cola (su transacción no se confirma)
+        flush_invalidations()
+        etiquetas = ['productos', 'catalogo', f'producto:{self.producto.id}']
+        antes = get_tag_versions(etiquetas)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservas.reservar(pedido, [(self.producto.id, 'M', 1)])
+            reservas.liberar(pedido)
+        despues = get_tag_versions(etiquetas)
+        # Los listados del catálogo siguen en caché
+        self.assertEqual([despues[t] for t in etiquetas[:2]], [antes[t] for t in etiquetas[:2]])
+        self.assertNotEqual(despues[etiquetas[2]], antes[etiquetas[2]])
+    
+    def test_confirmar_descuenta_stock(self):
+        from pedidos import reservas
+        pedido = self._pedido_con_reserva(2)
+        self.assertTrue(reservas.confirmar(pedido))
+        self.assertEqual(self._contadores(), (3, 0, 1, 0))
+        # Confirmar dos veces no descuenta de nuevo
+        self.assertTrue(reservas.confirmar(pedido))
+        self.assertEqual(self._contadores(), (3, 0, 1, 0))
+    
+    def test_liberar_y_cancelar(self):
+        from pedidos import reservas
+        pedido = self._pedido_con_reserva(2)
+        self.assertEqual(reservas.liberar(pedido), 1)
+        self.assertEqual(self._contadores(), (5, 0, 3, 0))
+        
+        otro = self._pedido_con_reserva(1)
+        otro.delete()
+        self.assertEqual(self._contadores(), (5, 0, 3, 0))
+    
+    def test_reservas_vencidas(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from pedidos import reservas
+        from pedidos.models import ReservaStock
+        vencido = self._pedido_con_reserva(2)
+        vigente = self._pedido_con_reserva(1)
+        vencido.reservas.update(expira=timezone.now() - timedelta(minutes=1))
+        
+        call_command('liberar_reservas', stdout=StringIO())
+        self.assertEqual(self._contadores(), (5, 1, 3, 1))
+        self.assertEqual(vencido.reservas.get().estado, ReservaStock.LIBERADA)
+        self.assertEqual(vigente.reservas.get().estado, ReservaStock.ACTIVA)
+        
+        # Al volver a pagar, el pedido vencido reserva otra vez si hay stock
+        reservas.renovar(vencido)
+        self.assertEqual(self._contadores(), (5, 3, 3, 3))
+        self.assertTrue(reservas.confirmar(vencido))
+        self.assertEqual(self._contadores(), (3, 1, 1, 1))
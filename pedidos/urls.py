@@ -16,5 +16,7 @@ urlpatterns = [
     path('admin/pedido/<int:pedido_id>/', views.admin_detalle_pedido, name='admin_detalle_pedido'),
     path('admin/pedido/<int:pedido_id>/actualizar-seguimiento/', views.actualizar_seguimiento, name='actualizar_seguimiento'),
     path('admin/pedidos/exportar/excel/', views.exportar_pedidos_excel, name='exportar_pedidos_excel'),
+    path('admin/pedidos/exportar/csv/', views.exportar_pedidos_csv, name='exportar_pedidos_csv'),
+    path('admin/pedidos/exportar/descargar/<str:nombre>/', views.descargar_exportacion, name='descargar_exportacion'),
     path('admin/pedido/<int:pedido_id>/cambiar-estado/', views.cambiar_estado_pedido, name='cambiar_estado_pedido'),
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 from io import BytesIO
-from django.http import HttpResponse
+from django.db.models import Prefetch
+from django.http import FileResponse, HttpResponse
 from django.conf import settings
 from django.utils import timezone
 from reportlab.pdfgen import canvas
@@ -10,11 +11,49 @@ from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 
-from .models import Pedido
+from .models import Pedido, ItemPedido
+
+def pedidos_para_factura():
+    """Pedidos con los ítems y sus productos precargados para datos_factura()"""
+    return Pedido.objects.prefetch_related(
+        Prefetch('items', queryset=ItemPedido.objects.select_related('producto'))
+    )
+
+def datos_factura(pedido):
+    """
+    Extrae los datos que aparecen en la factura como tipos simples (texto y
+    números), para calcular su versión y poder renderizarla en otro proceso.
+    Usa los ítems precargados si el pedido viene de pedidos_para_factura().
+    """
+    items = [
+        [item.producto.nombre, f"${item.precio}", str(item.cantidad), f"${item.precio_total()}"]
+        for item in sorted(pedido.items.all(), key=lambda item: item.id)
+    ]
+    return {
+        'id': pedido.id,
+        'fecha': pedido.fecha_pedido.strftime('%d/%m/%Y'),
+        'nombre_completo': pedido.nombre_completo,
+        'direccion': pedido.direccion,
+        'ciudad': pedido.ciudad,
+        'codigo_postal': pedido.codigo_postal,
+        'telefono': pedido.telefono,
+        'items': items,
+        'total': f"${pedido.total_importe}",
+    }
 
 def generar_factura_pdf(pedido):
     """Genera una factura en PDF para un pedido"""
+    return BytesIO(renderizar_factura(datos_factura(pedido)))
+
+def renderizar_factura(datos):
+    """
+    Dibuja la factura a partir de datos_factura() y devuelve los bytes del PDF.
+    
+    Solo recibe tipos simples y no consulta la base de datos, así que puede
+    ejecutarse en un pool de procesos (ver el comando generar_facturas).
+    """
     # Crear un buffer para el PDF
     buffer = BytesIO()
     
@@ -23,7 +62,7 @@ def generar_factura_pdf(pedido):
     width, height = A4
     
     # Establecer información básica
-    p.setTitle(f"Factura - Pedido #{pedido.id}")
+    p.setTitle(f"Factura - Pedido #{datos['id']}")
     
     # Encabezado
     p.setFont("Helvetica-Bold", 16)
@@ -37,9 +76,9 @@ def generar_factura_pdf(pedido):
     
     # Datos de la factura
     p.setFont("Helvetica-Bold", 10)
-    p.drawString(60, height - 95, f"PEDIDO #: {pedido.id}")
-    p.drawString(60, height - 110, f"FECHA: {pedido.fecha_pedido.strftime('%d/%m/%Y')}")
-    p.drawString(60, height - 125, f"CLIENTE: {pedido.nombre_completo}")
+    p.drawString(60, height - 95, f"PEDIDO #: {datos['id']}")
+    p.drawString(60, height - 110, f"FECHA: {datos['fecha']}")
+    p.drawString(60, height - 125, f"CLIENTE: {datos['nombre_completo']}")
     
     # Datos de la empresa (en la parte derecha)
     p.drawString(350, height - 95, "MOTO TIENDA")
@@ -52,27 +91,21 @@ def generar_factura_pdf(pedido):
     p.setFont("Helvetica-Bold", 12)
     p.drawString(50, height - 180, "DIRECCIÓN DE ENVÍO:")
     p.setFont("Helvetica", 10)
-    p.drawString(50, height - 200, pedido.nombre_completo)
-    direccion_lines = pedido.direccion.split('\n')
+    p.drawString(50, height - 200, datos['nombre_completo'])
+    direccion_lines = datos['direccion'].split('\n')
     y_position = height - 215
     for line in direccion_lines:
         p.drawString(50, y_position, line)
         y_position -= 15
-    p.drawString(50, y_position, f"{pedido.ciudad}, {pedido.codigo_postal}")
-    p.drawString(50, y_position - 15, f"Teléfono: {pedido.telefono}")
+    p.drawString(50, y_position, f"{datos['ciudad']}, {datos['codigo_postal']}")
+    p.drawString(50, y_position - 15, f"Teléfono: {datos['telefono']}")
     
     # Tabla de productos
     data = [["PRODUCTO", "PRECIO", "CANT.", "SUBTOTAL"]]
-    for item in pedido.items.all():
-        data.append([
-            item.producto.nombre,
-            f"${item.precio}",
-            str(item.cantidad),
-            f"${item.precio_total()}"
-        ])
+    data.extend(datos['items'])
     
     # Añadir fila de total
-    data.append(["", "", "TOTAL", f"${pedido.total()}"])
+    data.append(["", "", "TOTAL", datos['total']])
     
     # Crear tabla
     table = Table(data, colWidths=[width*0.4, width*0.2, width*0.1, width*0.2])
@@ -103,20 +136,25 @@ def generar_factura_pdf(pedido):
     p.showPage()
     p.save()
     
-    # Mover el cursor al principio del buffer y devolver el valor
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
 
 def obtener_factura(request, pedido_id):
     """Vista para descargar la factura de un pedido"""
-    pedido = get_object_or_404(Pedido, id=pedido_id, usuario=request.user)
-    
-    # Generar el PDF
-    buffer = generar_factura_pdf(pedido)
-    
-    # Crear la respuesta HTTP con el PDF
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="factura_pedido_{pedido.id}.pdf"'
-    response.write(buffer.getvalue())
-    
-    return response
\ No newline at end of file
+    from . import facturas
+    pedido = get_object_or_404(pedidos_para_factura(), id=pedido_id, usuario=request.user)
+    
+    # La factura se renderiza una vez por versión del pedido y se sirve desde
+    # el almacén; la versión hace de ETag para responder 304 sin enviarla
+    nombre, version = facturas.obtener_factura(pedido)
+    etag = f'"{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+    
+    response = FileResponse(facturas.abrir(nombre), as_attachment=True,
+                            filename=f"factura_pedido_{pedido.id}.pdf",
+                            content_type='application/pdf')
+    response['ETag'] = etag
+    # Privada y revalidada siempre: la factura cambia si cambia el pedido
+    response['Cache-Control'] = 'private, no-cache'
+    return response
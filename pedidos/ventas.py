@@ -0,0 +1,276 @@
+"""
+Tablas de ventas agregadas (VentaDiaria y VentaMensual).
+
+Cuando se crea, paga o cambia de estado un pedido, o cambian sus ítems, se
+marca su día como pendiente; al confirmar la transacción se encola una sola
+tarea (recalcular_ventas, ver pedidos/tareas.py) con los días y pedidos
+marcados. El worker recalcula cada día completo desde Pedido/ItemPedido y
+después consolida su mes desde las filas diarias. Recalcular el día entero
+(en lugar de aplicar deltas) hace el mantenimiento idempotente y tolerante
+a reintentos, y al hacerlo en la cola su coste no recae en la petición.
+
+Cada recálculo bloquea antes su fila de BloqueoVentas: si dos workers
+recalculan el mismo día a la vez, el segundo espera al primero y lee
+después todos los pedidos, en lugar de guardar un agregado al que le falta
+alguno.
+
+Los informes sobre rangos de fechas leen estas filas en lugar de recorrer
+el histórico de pedidos.
+"""
+import datetime
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from utils.cache_utils import invalidate_tags
+from .models import BloqueoVentas, ItemPedido, Pedido, VentaDiaria, VentaMensual
+
+logger = logging.getLogger('mototienda.performance')
+
+# Días y pedidos pendientes de recalcular por hilo
+_local = threading.local()
+
+DIMENSIONES = ('estado', 'pagado', 'metodo_pago', 'categoria_id', 'marca_id')
+
+
+def _pendientes():
+    if not hasattr(_local, 'fechas'):
+        _local.fechas = set()
+        _local.pedidos = set()
+    return _local
+
+
+def fecha_local(momento):
+    """Día (en la zona horaria del sitio) al que pertenece un instante"""
+    if timezone.is_aware(momento):
+        momento = timezone.localtime(momento)
+    return momento.date()
+
+
+def _rango_dia(fecha):
+    inicio = timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+    fin = timezone.make_aware(datetime.datetime.combine(fecha + datetime.timedelta(days=1),
+                                                        datetime.time.min))
+    return inicio, fin
+
+
+def _programar():
+    if transaction.get_connection().in_atomic_block:
+        # Si la transacción se revierte, Django descarta el callback y los
+        # días quedan marcados hasta la siguiente tarea (recalcular de más
+        # es inocuo). robust: un fallo aquí no debe afectar al pedido ya
+        # confirmado; las tablas se reconstruyen con reconstruir_ventas
+        transaction.on_commit(_encolar_pendientes, robust=True)
+    else:
+        try:
+            _encolar_pendientes()
+        except Exception:
+            logger.exception("Error al encolar el recálculo de las ventas agregadas")
+
+
+def _encolar_pendientes():
+    """Encola una tarea con los días y pedidos marcados en el hilo"""
+    from .tareas import recalcular_ventas
+
+    pendientes = _pendientes()
+    fechas, pedidos = pendientes.fechas, pendientes.pedidos
+    pendientes.fechas, pendientes.pedidos = set(), set()
+    if fechas or pedidos:
+        recalcular_ventas.encolar(sorted(fecha.isoformat() for fecha in fechas), sorted(pedidos))
+
+
+def marcar_fecha(fecha):
+    """Marca un día para recalcular sus ventas al confirmar la transacción"""
+    _pendientes().fechas.add(fecha)
+    _programar()
+
+
+def marcar_pedido(pedido_id):
+    """Marca el día de un pedido (se resuelve al procesar, sin consultas extra)"""
+    _pendientes().pedidos.add(pedido_id)
+    _programar()
+
+
+def _bloquear(periodo):
+    """Bloquea la fila del periodo hasta el final de la transacción en curso"""
+    BloqueoVentas.objects.get_or_create(periodo=periodo)
+    BloqueoVentas.objects.select_for_update().get(periodo=periodo)
+
+
+def procesar(fechas=(), pedidos=()):
+    """
+    Recalcula los días indicados y los de los pedidos indicados, y
+    consolida sus meses (lo ejecuta la tarea recalcular_ventas).
+    """
+    fechas = set(fechas)
+    if pedidos:
+        fechas |= {fecha_local(f) for f in Pedido.objects.filter(id__in=pedidos)
+                   .values_list('fecha_pedido', flat=True)}
+    if not fechas:
+        return
+
+    with transaction.atomic():
+        for fecha in sorted(fechas):
+            recalcular_dia(fecha)
+        for mes in sorted({fecha.replace(day=1) for fecha in fechas}):
+            recalcular_mes(mes)
+
+    # El panel lee estas tablas: si se cacheó entre la invalidación del
+    # pedido y este recálculo, quedaría con las cifras anteriores
+    invalidate_tags('estadisticas_pedidos')
+
+
+def recalcular_dia(fecha):
+    """
+    Sustituye las filas de VentaDiaria de un día por las calculadas desde
+    los pedidos de ese día (totales por pedido y desglose por producto).
+    """
+    with transaction.atomic():
+        # Los pedidos se leen con el día ya bloqueado
+        _bloquear(f'dia:{fecha.isoformat()}')
+        filas = _filas_dia(fecha)
+        VentaDiaria.objects.filter(fecha=fecha).delete()
+        VentaDiaria.objects.bulk_create(filas)
+    return len(filas)
+
+
+def _filas_dia(fecha):
+    """Filas de VentaDiaria de un día calculadas desde sus pedidos"""
+    inicio, fin = _rango_dia(fecha)
+    pedidos = Pedido.objects.filter(fecha_pedido__gte=inicio, fecha_pedido__lt=fin).order_by()
+
+    # Totales por pedido: a partir de los totales desnormalizados
+    filas = [
+        VentaDiaria(fecha=fecha, estado=fila['estado'], pagado=fila['pagado'],
+                    metodo_pago=fila['metodo_pago'], num_pedidos=fila['n'],
+                    unidades=fila['u'] or 0, importe=fila['i'] or 0)
+        for fila in pedidos.values('estado', 'pagado', 'metodo_pago')
+                           .annotate(n=Count('id'), u=Sum('num_unidades'), i=Sum('total_importe'))
+    ]
+
+    # Desglose por categoría y marca del producto
+    items = (ItemPedido.objects
+             .filter(pedido__fecha_pedido__gte=inicio, pedido__fecha_pedido__lt=fin)
+             .order_by()
+             .values(estado=F('pedido__estado'), pagado=F('pedido__pagado'),
+                     metodo_pago=F('pedido__metodo_pago'),
+                     categoria_id=F('producto__categoria_id'), marca_id=F('producto__marca_id'))
+             .annotate(n=Count('pedido_id', distinct=True), u=Sum('cantidad'),
+                       i=Sum(F('precio') * F('cantidad'))))
+    filas += [
+        VentaDiaria(fecha=fecha, estado=fila['estado'], pagado=fila['pagado'],
+                    metodo_pago=fila['metodo_pago'], categoria_id=fila['categoria_id'],
+                    marca_id=fila['marca_id'], num_pedidos=fila['n'],
+                    unidades=fila['u'] or 0, importe=fila['i'] or 0)
+        for fila in items
+    ]
+    return filas
+
+
+def recalcular_mes(mes):
+    """Consolida en VentaMensual las filas diarias de un mes"""
+    mes = mes.replace(day=1)
+    with transaction.atomic():
+        _bloquear(f'mes:{mes:%Y-%m}')
+        return _recalcular_mes(mes)
+
+
+def _recalcular_mes(mes):
+    siguiente = (mes + datetime.timedelta(days=32)).replace(day=1)
+
+    filas = [
+        VentaMensual(mes=mes, num_pedidos=fila.pop('n'), unidades=fila.pop('u'),
+                     importe=fila.pop('i'), **fila)
+        for fila in (VentaDiaria.objects
+                     .filter(fecha__gte=mes, fecha__lt=siguiente)
+                     .order_by()
+                     .values(*DIMENSIONES)
+                     .annotate(n=Sum('num_pedidos'), u=Sum('unidades'), i=Sum('importe')))
+    ]
+
+    VentaMensual.objects.filter(mes=mes).delete()
+    VentaMensual.objects.bulk_create(filas)
+    return len(filas)
+
+
+def reconstruir(desde=None, hasta=None):
+    """
+    Reconstruye las tablas de ventas para un rango de días (todo el
+    histórico si no se indica).
+
+    Returns:
+        int: Número de días recalculados
+    """
+    dias = (Pedido.objects
+            .order_by()
+            .annotate(dia=TruncDate('fecha_pedido'))
+            .values_list('dia', flat=True)
+            .distinct())
+    if desde:
+        dias = dias.filter(dia__gte=desde)
+    if hasta:
+        dias = dias.filter(dia__lte=hasta)
+    dias = set(dias)
+
+    # Los días del rango que ya no tienen pedidos deben quedar vacíos
+    existentes = VentaDiaria.objects.values_list('fecha', flat=True).distinct()
+    if desde:
+        existentes = existentes.filter(fecha__gte=desde)
+    if hasta:
+        existentes = existentes.filter(fecha__lte=hasta)
+    dias |= set(existentes)
+
+    for dia in sorted(dias):
+        recalcular_dia(dia)
+    for mes in sorted({dia.replace(day=1) for dia in dias}):
+        recalcular_mes(mes)
+
+    invalidate_tags('estadisticas_pedidos')
+    logger.info(f"Tablas de ventas reconstruidas: {len(dias)} días")
+    return len(dias)
+
+
+def ventas_por_periodo(desde, hasta, agrupar=('estado',), desglose=False):
+    """
+    Suma las ventas de un rango de días leyendo las tablas agregadas.
+
+    Se usan las filas mensuales para los meses completos del rango y las
+    diarias para los extremos.
+
+    Args:
+        desde (date), hasta (date): Rango de días, ambos incluidos
+        agrupar (iterable): Dimensiones por las que agrupar
+        desglose (bool): Si True se usan las filas por categoría/marca
+
+    Returns:
+        list: dicts con las dimensiones y num_pedidos, unidades e importe
+    """
+    primer_mes = desde if desde.day == 1 else (desde.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    fin_meses = (hasta + datetime.timedelta(days=1)).replace(day=1)
+
+    consultas = []
+    if primer_mes < fin_meses:
+        consultas.append(VentaMensual.objects.filter(mes__gte=primer_mes, mes__lt=fin_meses))
+        consultas.append(VentaDiaria.objects.filter(
+            Q(fecha__gte=desde, fecha__lt=primer_mes) | Q(fecha__gte=fin_meses, fecha__lte=hasta)))
+    else:
+        consultas.append(VentaDiaria.objects.filter(fecha__gte=desde, fecha__lte=hasta))
+
+    resultado = {}
+    agrupar = list(agrupar)
+    for queryset in consultas:
+        queryset = queryset.desglose() if desglose else queryset.totales()
+        for fila in (queryset.order_by().values(*agrupar)
+                     .annotate(n=Sum('num_pedidos'), u=Sum('unidades'), i=Sum('importe'))):
+            clave = tuple(fila[d] for d in agrupar)
+            acumulado = resultado.setdefault(clave, {
+                **{d: fila[d] for d in agrupar}, 'num_pedidos': 0, 'unidades': 0, 'importe': 0
+            })
+            acumulado['num_pedidos'] += fila['n'] or 0
+            acumulado['unidades'] += fila['u'] or 0
+            acumulado['importe'] += fila['i'] or 0
+    return list(resultado.values())
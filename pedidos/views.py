@@ -18,19 +18,22 @@ from datetime import datetime
 from django.db.models import Q
 from django.db.models import Sum, Avg, Count
 import calendar
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
 from django.http import HttpResponse
 from datetime import datetime
-from io import BytesIO
 from django.contrib.auth.models import User
 from django.template.loader import render_to_string
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404
+from django.urls import reverse
+import os
 import json
 from utils.logger import log_exception, log_audit, performance_monitor, exception_handler
 from django.db.models import Prefetch
 from utils.performance import query_debugger
+from utils.pagination import KeysetPaginator
+from .estadisticas import obtener_estadisticas
+from . import exportacion
+from . import reservas
+from .services import CarritoVacio, StockInsuficiente, crear_pedido_desde_carrito
 
 @login_required
 @performance_monitor(name="crear_pedido_view")  # Monitorea el tiempo de ejecución
@@ -51,16 +54,21 @@ def crear_pedido(request):
             # Crear un nuevo pedido pero no guardarlo todavía
             pedido = form.save(commit=False)
             pedido.usuario = request.user
-            pedido.save()
             
-            # Transferir items del carrito al pedido
-            for item in carrito.items.all():
-                ItemPedido.objects.create(
-                    pedido=pedido,
-                    producto=item.producto,
-                    precio=item.producto.precio,
-                    cantidad=item.cantidad
-                )
+            # Pedido, ítems, stock y carrito en una sola transacción
+            try:
+                pedido = crear_pedido_desde_carrito(carrito, pedido)
+            except StockInsuficiente as e:
+                for faltante in e.faltantes:
+                    talla = f" (talla {faltante['talla']})" if faltante['talla'] else ''
+                    messages.error(request, f"No hay stock suficiente de {faltante['producto']}{talla}: "
+                                            f"quedan {faltante['disponible']} unidades")
+                if not e.faltantes:
+                    messages.error(request, 'No hay stock suficiente para completar el pedido')
+                return redirect('carrito:ver_carrito')
+            except CarritoVacio:
+                messages.warning(request, 'Tu carrito está vacío')
+                return redirect('carrito:ver_carrito')
             
             # Registrar acción de auditoría
             log_audit(
@@ -69,14 +77,11 @@ def crear_pedido(request):
                 object_type="Pedido",
                 object_id=pedido.id,
                 details={
-                    "total_items": pedido.items.count(),
-                    "total_amount": float(pedido.total())
+                    "total_items": pedido.num_items,
+                    "total_amount": float(pedido.total_importe)
                 }
             )
             
-            # Vaciar el carrito
-            carrito.items.all().delete()
-            
             # Mostrar mensaje de éxito
             messages.success(request, 'Pedido realizado con éxito')
             
@@ -105,9 +110,12 @@ def crear_pedido(request):
 @login_required
 def lista_pedidos(request):
     """Mostrar todos los pedidos del usuario"""
-    pedidos = Pedido.objects.filter(usuario=request.user).order_by('-fecha_pedido')
+    pedidos = Pedido.objects.filter(usuario=request.user)
+    
+    # Paginación por cursor sobre (fecha_pedido, id)
+    paginator = KeysetPaginator(pedidos, 20, ordering=['-fecha_pedido', '-id'], contar=None)
     return render(request, 'pedidos/lista_pedidos.html', {
-        'pedidos': pedidos
+        'pedidos': paginator.get_page(request.GET.get('cursor'))
     })
 
 @login_required
@@ -133,6 +141,7 @@ def cancelar_pedido(request, pedido_id):
         if request.method == 'POST':
             pedido.estado = 'cancelado'
             pedido.save()
+            reservas.liberar(pedido)
             messages.success(request, 'Pedido cancelado exitosamente')
             return redirect('pedidos:lista_pedidos')
         
@@ -166,91 +175,32 @@ def estadisticas_pedidos(request):
     """
     Vista para mostrar estadísticas de pedidos para administradores
     """
-    # Obtener todos los pedidos
-    pedidos = Pedido.objects.all()
-    
-    # Estadísticas generales
-    total_pedidos = pedidos.count()
-    pedidos_pendientes = pedidos.filter(estado=Pedido.PENDIENTE).count()
-    pedidos_procesando = pedidos.filter(estado=Pedido.PROCESANDO).count()
-    pedidos_enviados = pedidos.filter(estado=Pedido.ENVIADO).count()
-    pedidos_entregados = pedidos.filter(estado=Pedido.ENTREGADO).count()
-    pedidos_cancelados = pedidos.filter(estado=Pedido.CANCELADO).count()
-    
-    # Obtener pedidos por mes (últimos 6 meses)
-    fecha_inicio = timezone.now() - timedelta(days=180)  # 6 meses atrás
-    pedidos_por_mes_query = pedidos.filter(
-        fecha_pedido__gte=fecha_inicio
-    ).annotate(
-        mes=TruncMonth('fecha_pedido')
-    ).values('mes').annotate(
-        total=Count('id')
-    ).order_by('mes')
-    
-    # Preparar datos para el gráfico de pedidos por mes
-    meses = []
-    totales = []
-    
-    for item in pedidos_por_mes_query:
-        meses.append(item['mes'].strftime('%b %Y'))
-        totales.append(item['total'])
-    
-    # Si no hay datos para algunos meses, llenar con ceros
-    # Esto asegura que siempre mostramos 6 meses incluso si no hay pedidos
-    if len(meses) < 6:
-        fecha_actual = timezone.now()
-        for i in range(6):
-            fecha = fecha_actual - timedelta(days=30 * i)
-            mes_str = fecha.strftime('%b %Y')
-            if mes_str not in meses:
-                meses.insert(0, mes_str)
-                totales.insert(0, 0)
-        # Limitar a solo 6 meses
-        meses = meses[:6]
-        totales = totales[:6]
-    
-    # Ordenar cronológicamente
-    meses.reverse()
-    totales.reverse()
+    # Todas las métricas salen de unas pocas consultas agregadas, cacheadas
+    # bajo la etiqueta 'estadisticas_pedidos'
+    estadisticas = obtener_estadisticas()
+    resumen = estadisticas['resumen']
+    por_estado = resumen['por_estado']
+    serie = estadisticas['serie_mensual']
     
     # Obtener pedidos recientes (últimos 10)
-    pedidos_recientes = pedidos.order_by('-fecha_pedido')[:10]
+    pedidos_recientes = Pedido.objects.select_related('usuario').order_by('-fecha_pedido')[:10]
     
     # Contexto para la plantilla
     context = {
-        'total_pedidos': total_pedidos,
-        'pedidos_pendientes': pedidos_pendientes,
-        'pedidos_procesando': pedidos_procesando,
-        'pedidos_enviados': pedidos_enviados,
-        'pedidos_entregados': pedidos_entregados,
-        'pedidos_cancelados': pedidos_cancelados,
-        'meses_labels': json.dumps(meses),
-        'pedidos_por_mes': totales,
+        'total_pedidos': resumen['total'],
+        'pedidos_pendientes': por_estado[Pedido.PENDIENTE],
+        'pedidos_procesando': por_estado[Pedido.PROCESANDO],
+        'pedidos_enviados': por_estado[Pedido.ENVIADO],
+        'pedidos_entregados': por_estado[Pedido.ENTREGADO],
+        'pedidos_cancelados': por_estado[Pedido.CANCELADO],
+        'meses_labels': json.dumps([mes['etiqueta'] for mes in serie]),
+        'pedidos_por_mes': [mes['pedidos'] for mes in serie],
         'pedidos_recientes': pedidos_recientes,
+        'valor_promedio_pedidos': resumen['valor_promedio'],
+        'ventas_totales': resumen['ingresos_totales'],
+        'mejores_clientes': estadisticas['mejores_clientes'],
     }
     
-    # Métricas adicionales
-    valor_promedio_pedidos = pedidos.aggregate(avg=Avg('items__precio'))['avg'] or 0
-    
-    # Ventas totales
-    ventas_totales = sum(pedido.total() for pedido in pedidos)
-    
-    # Ventas por mes (último año)
-    fecha_inicio_anual = timezone.now() - timedelta(days=365)
-    
-    # Mejores clientes
-    mejores_clientes = User.objects.annotate(
-        total_pedidos=Count('pedidos'),
-        gasto_total=Sum('pedidos__items__precio')
-    ).order_by('-gasto_total')[:5]
-    
-    # Añadir al contexto
-    context.update({
-        'valor_promedio_pedidos': valor_promedio_pedidos,
-        'ventas_totales': ventas_totales,
-        'mejores_clientes': mejores_clientes,
-    })
-    
     return render(request, 'pedidos/admin/estadisticas.html', context)
 
 @login_required
@@ -269,14 +219,10 @@ def admin_lista_pedidos(request):
                   'historial_estados'
               ))
               
-    # Añadimos paginación eficiente para manejar grandes volúmenes
-    paginator = Paginator(pedidos.order_by('-fecha_pedido'), 50)  # 50 pedidos por página
-    page = request.GET.get('page', 1)
-    
-    try:
-        pedidos_paginados = paginator.page(page)
-    except (PageNotAnInteger, EmptyPage):
-        pedidos_paginados = paginator.page(1)
+    # Paginación por cursor: sin OFFSET ni COUNT(*) exacto, de modo que
+    # cualquier página cuesta lo mismo que la primera
+    paginator = KeysetPaginator(pedidos, 50, ordering=['-fecha_pedido', '-id'], contar='estimado')
+    pedidos_paginados = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'pedidos': pedidos_paginados,
@@ -354,99 +300,42 @@ def actualizar_seguimiento(request, pedido_id):
     return redirect('pedidos:admin_detalle_pedido', pedido_id=pedido.id)
     
 
+def _exportar_en_segundo_plano(request, formato):
+    """Encola la exportación y avisa al usuario de que recibirá un enlace"""
+    from .tareas import exportar_pedidos
+    nombre = exportacion.nuevo_nombre_exportacion(formato)
+    filtros = {clave: request.GET.get(clave, '') for clave in ('estado', 'fecha_desde', 'fecha_hasta')}
+    enlace = request.build_absolute_uri(reverse('pedidos:descargar_exportacion', args=[nombre]))
+    exportar_pedidos.encolar(request.user.id, nombre, filtros, enlace)
+    messages.info(request, 'La exportación se está generando; recibirás un correo con el enlace de descarga.')
+    return redirect('pedidos:admin_lista_pedidos')
+
 @login_required
 @user_passes_test(es_admin)
 def exportar_pedidos_excel(request):
-    """Exportar pedidos a Excel con formato adecuado"""
-    # Aplicar filtros (similar a la vista de lista)
-    queryset = Pedido.objects.all().order_by('-fecha_pedido')
-    estado = request.GET.get('estado')
-    fecha_desde = request.GET.get('fecha_desde')
-    fecha_hasta = request.GET.get('fecha_hasta')
-    
-    if estado:
-        queryset = queryset.filter(estado=estado)
-    if fecha_desde:
-        queryset = queryset.filter(fecha_pedido__date__gte=fecha_desde)
-    if fecha_hasta:
-        queryset = queryset.filter(fecha_pedido__date__lte=fecha_hasta)
-    
-    # Crear un libro de Excel
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Pedidos"
-    
-    # Definir estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    centered_alignment = Alignment(horizontal='center')
-    border = Border(
-        left=Side(border_style='thin', color='000000'),
-        right=Side(border_style='thin', color='000000'),
-        top=Side(border_style='thin', color='000000'),
-        bottom=Side(border_style='thin', color='000000')
-    )
-    
-    # Encabezados
-    columns = ['ID', 'Cliente', 'Email', 'Fecha', 'Estado', 'Total', 'Productos']
-    for col_num, column_title in enumerate(columns, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = column_title
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = centered_alignment
-        cell.border = border
-    
-    # Agregar datos
-    for row_num, pedido in enumerate(queryset, 2):
-        # Lista de productos formateada
-        productos = ", ".join([f"{item.cantidad}x {item.producto.nombre}" for item in pedido.items.all()])
-        
-        # Datos de la fila
-        row = [
-            pedido.id, 
-            pedido.nombre_completo,
-            pedido.usuario.email,
-            pedido.fecha_pedido.strftime("%d/%m/%Y %H:%M"),
-            dict(Pedido.ESTADOS)[pedido.estado],
-            f"${pedido.total()}",
-            productos
-        ]
-        
-        # Escribir la fila y aplicar estilo
-        for col_num, cell_value in enumerate(row, 1):
-            cell = ws.cell(row=row_num, column=col_num)
-            cell.value = cell_value
-            cell.border = border
-            
-            # Centrar algunas columnas
-            if col_num in [1, 4, 5]:  # ID, Fecha, Estado
-                cell.alignment = centered_alignment
-    
-    # Autoajustar ancho de columnas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Crear respuesta HTTP
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="pedidos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-    
-    # Guardar el libro de trabajo en el objeto de respuesta
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    response.write(buffer.getvalue())
-    
-    return response
+    """Exportar pedidos a Excel (modo write-only, servido por trozos)"""
+    if request.GET.get('segundo_plano'):
+        return _exportar_en_segundo_plano(request, 'xlsx')
+    filtros = exportacion.filtros_desde_request(request.GET)
+    return exportacion.exportar_excel(exportacion.pedidos_para_exportar(filtros), filtros)
+
+@login_required
+@user_passes_test(es_admin)
+def exportar_pedidos_csv(request):
+    """Exportar pedidos a CSV en streaming"""
+    if request.GET.get('segundo_plano'):
+        return _exportar_en_segundo_plano(request, 'csv')
+    filtros = exportacion.filtros_desde_request(request.GET)
+    return exportacion.exportar_csv(exportacion.pedidos_para_exportar(filtros))
+
+@login_required
+@user_passes_test(es_admin)
+def descargar_exportacion(request, nombre):
+    """Descargar una exportación generada en segundo plano"""
+    ruta = exportacion.ruta_exportacion(nombre)
+    if not os.path.isfile(ruta):
+        raise Http404("La exportación no existe o ya no está disponible")
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=os.path.basename(ruta))
 
 @login_required
 @user_passes_test(es_admin)
@@ -0,0 +1,18 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Tarea
+
+@admin.register(Tarea)
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nombre', 'estado', 'intentos', 'ejecutar_en', 'fecha_creacion', 'fecha_fin')
+    list_filter = ('estado', 'nombre')
+    search_fields = ('nombre', 'ultimo_error')
+    readonly_fields = ('fecha_creacion', 'fecha_fin', 'bloqueada_hasta', 'ultimo_error')
+    actions = ['reintentar']
+    
+    def reintentar(self, request, queryset):
+        actualizadas = queryset.exclude(estado=Tarea.EN_PROCESO).update(
+            estado=Tarea.PENDIENTE, intentos=0, ejecutar_en=timezone.now(), bloqueada_hasta=None
+        )
+        self.message_user(request, f'{actualizadas} tareas marcadas para reintentar.')
+    reintentar.short_description = 'Reintentar las tareas seleccionadas'
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+class TareasConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'tareas'
+    verbose_name = 'Tareas en segundo plano'
+    
+    def ready(self):
+        """
+        Método que se ejecuta cuando la aplicación está lista.
+        Importa el módulo tareas.py de cada aplicación para registrar sus tareas.
+        """
+        autodiscover_modules('tareas')
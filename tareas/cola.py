@@ -0,0 +1,206 @@
+"""
+Cola de tareas en segundo plano respaldada por la base de datos.
+
+Las funciones se registran con el decorador @tarea en el módulo tareas.py
+de cada aplicación y se encolan con funcion.encolar(*args, **kwargs). La
+fila se inserta al confirmar la transacción en curso, de modo que el worker
+nunca ve una tarea que hace referencia a datos revertidos. El worker
+(manage.py procesar_tareas) reclama las tareas con un UPDATE condicional,
+así que varios workers pueden ejecutarse a la vez sin repetir trabajo.
+
+Los argumentos deben ser serializables en JSON: se pasan ids, no objetos.
+Con TAREAS_SINCRONAS = True (desarrollo y tests) las tareas se ejecutan en
+el propio proceso al confirmar la transacción, sin pasar por la tabla.
+"""
+import functools
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Tarea
+
+logger = logging.getLogger('mototienda')
+
+# Espera antes de cada reintento: RETARDO_BASE * 2^(intento-1), con tope
+RETARDO_BASE = 30
+RETARDO_MAXIMO = 60 * 60
+# Tiempo que un worker retiene una tarea antes de que otro pueda reclamarla
+BLOQUEO = timedelta(minutes=10)
+
+# nombre -> función registrada
+_registro = {}
+
+
+class TareaNoRegistrada(Exception):
+    """El nombre de la tarea no corresponde a ninguna función registrada"""
+    pass
+
+
+def tarea(nombre=None, max_intentos=5):
+    """
+    Registra una función como tarea en segundo plano.
+
+    Uso:
+        @tarea(max_intentos=3)
+        def enviar_correo(pedido_id):
+            ...
+
+        enviar_correo.encolar(pedido.id)
+
+    Args:
+        nombre (str, optional): Nombre de registro; por defecto módulo.función
+        max_intentos (int): Ejecuciones antes de marcarla como fallida
+    """
+    def decorador(funcion):
+        funcion.nombre_tarea = nombre or f'{funcion.__module__}.{funcion.__name__}'
+        funcion.max_intentos = max_intentos
+        funcion.encolar = functools.partial(_encolar_args, funcion)
+        _registro[funcion.nombre_tarea] = funcion
+        return funcion
+    return decorador
+
+
+def _encolar_args(funcion, *args, **kwargs):
+    return encolar(funcion, args=args, kwargs=kwargs)
+
+
+def obtener(nombre):
+    """Devuelve la función registrada con `nombre`"""
+    try:
+        return _registro[nombre]
+    except KeyError:
+        raise TareaNoRegistrada(nombre)
+
+
+def encolar(funcion, args=(), kwargs=None, retraso=None, al_confirmar=True):
+    """
+    Encola una tarea registrada.
+
+    Args:
+        funcion: Función decorada con @tarea
+        args (tuple), kwargs (dict): Argumentos, serializables en JSON
+        retraso (timedelta, optional): Espera mínima antes de ejecutarla
+        al_confirmar (bool): Si True, la tarea se inserta al confirmar la
+            transacción en curso; si False, se inserta ya (y, dentro de una
+            transacción, se pierde igualmente si esta se revierte)
+    """
+    args, kwargs = list(args), dict(kwargs or {})
+
+    if getattr(settings, 'TAREAS_SINCRONAS', False):
+        def ejecutar_ahora():
+            try:
+                funcion(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Error en la tarea {funcion.nombre_tarea}")
+        accion = ejecutar_ahora
+    else:
+        def accion():
+            Tarea.objects.create(
+                nombre=funcion.nombre_tarea, args=args, kwargs=kwargs,
+                max_intentos=funcion.max_intentos,
+                ejecutar_en=timezone.now() + (retraso or timedelta()),
+            )
+
+    if al_confirmar:
+        transaction.on_commit(accion)
+    else:
+        accion()
+
+
+def _espera(intentos):
+    """Segundos hasta el siguiente intento, con una pequeña variación aleatoria"""
+    segundos = min(RETARDO_BASE * 2 ** max(intentos - 1, 0), RETARDO_MAXIMO)
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def reclamar(limite=10):
+    """
+    Marca como en proceso hasta `limite` tareas listas y las devuelve.
+
+    Cada tarea se reclama con un UPDATE condicional sobre su estado; si otro
+    worker se adelanta, el UPDATE no afecta a ninguna fila y se descarta.
+    Las tareas en proceso cuyo bloqueo venció (worker caído) se recuperan.
+    """
+    ahora = timezone.now()
+    candidatas = list(Tarea.objects
+                      .filter(estado=Tarea.PENDIENTE, ejecutar_en__lte=ahora)
+                      .order_by('ejecutar_en', 'id')
+                      .values_list('id', 'estado')[:limite])
+    candidatas += list(Tarea.objects
+                       .filter(estado=Tarea.EN_PROCESO, bloqueada_hasta__lt=ahora)
+                       .order_by('bloqueada_hasta')
+                       .values_list('id', 'estado')[:limite])
+
+    reclamadas = []
+    for tarea_id, estado in candidatas[:limite]:
+        filtro = {'id': tarea_id, 'estado': estado}
+        if estado == Tarea.EN_PROCESO:
+            filtro['bloqueada_hasta__lt'] = ahora
+        if Tarea.objects.filter(**filtro).update(estado=Tarea.EN_PROCESO,
+                                                 bloqueada_hasta=ahora + BLOQUEO):
+            reclamadas.append(tarea_id)
+    return list(Tarea.objects.filter(id__in=reclamadas).order_by('ejecutar_en', 'id'))
+
+
+def ejecutar(tarea_obj):
+    """
+    Ejecuta una tarea reclamada y registra el resultado.
+
+    Si falla se reprograma con espera exponencial hasta agotar max_intentos,
+    tras lo cual queda como fallida para revisarla desde el admin.
+
+    Returns:
+        bool: True si la tarea terminó correctamente
+    """
+    tarea_obj.intentos += 1
+    try:
+        funcion = obtener(tarea_obj.nombre)
+        funcion(*tarea_obj.args, **tarea_obj.kwargs)
+    except Exception as e:
+        agotada = isinstance(e, TareaNoRegistrada) or tarea_obj.intentos >= tarea_obj.max_intentos
+        tarea_obj.ultimo_error = traceback.format_exc()
+        tarea_obj.bloqueada_hasta = None
+        if agotada:
+            tarea_obj.estado = Tarea.FALLIDA
+            tarea_obj.fecha_fin = timezone.now()
+            logger.error(f"Tarea {tarea_obj.nombre} #{tarea_obj.id} fallida tras "
+                         f"{tarea_obj.intentos} intentos: {e}")
+        else:
+            tarea_obj.estado = Tarea.PENDIENTE
+            tarea_obj.ejecutar_en = timezone.now() + _espera(tarea_obj.intentos)
+            logger.warning(f"Tarea {tarea_obj.nombre} #{tarea_obj.id} reprogramada "
+                           f"(intento {tarea_obj.intentos}): {e}")
+        tarea_obj.save()
+        return False
+
+    tarea_obj.estado = Tarea.COMPLETADA
+    tarea_obj.bloqueada_hasta = None
+    tarea_obj.ultimo_error = ''
+    tarea_obj.fecha_fin = timezone.now()
+    tarea_obj.save()
+    return True
+
+
+def procesar_lote(limite=10):
+    """
+    Reclama y ejecuta un lote de tareas.
+
+    Returns:
+        int: Número de tareas ejecutadas (con éxito o no)
+    """
+    tareas = reclamar(limite)
+    for tarea_obj in tareas:
+        ejecutar(tarea_obj)
+    return len(tareas)
+
+
+def purgar_completadas(dias=7):
+    """Borra las tareas completadas hace más de `dias` días"""
+    limite = timezone.now() - timedelta(days=dias)
+    borradas, _ = Tarea.objects.filter(estado=Tarea.COMPLETADA, fecha_fin__lt=limite).delete()
+    return borradas
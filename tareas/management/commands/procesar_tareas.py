@@ -0,0 +1,54 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from tareas import cola
+
+class Command(BaseCommand):
+    help = 'Worker de la cola de tareas: ejecuta las tareas pendientes en segundo plano'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa las tareas pendientes y termina (útil desde cron)'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=10,
+            help='Tareas reclamadas en cada consulta (por defecto 10)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help='Segundos de espera cuando la cola está vacía (por defecto 2)'
+        )
+        parser.add_argument(
+            '--purgar-dias', type=int, default=7,
+            help='Borra las tareas completadas hace más de N días (0 para no purgar)'
+        )
+
+    def handle(self, *args, **options):
+        self.detener = False
+        signal.signal(signal.SIGTERM, self._detener)
+        signal.signal(signal.SIGINT, self._detener)
+
+        if options['purgar_dias']:
+            borradas = cola.purgar_completadas(options['purgar_dias'])
+            if borradas:
+                self.stdout.write(f'Se purgaron {borradas} tareas completadas.')
+
+        total = 0
+        while not self.detener:
+            close_old_connections()
+            procesadas = cola.procesar_lote(options['lote'])
+            total += procesadas
+            if procesadas:
+                continue
+            if options['una_vez']:
+                break
+            time.sleep(options['intervalo'])
+
+        self.stdout.write(self.style.SUCCESS(f'Tareas ejecutadas: {total}'))
+
+    def _detener(self, signum, frame):
+        # Terminar después de la tarea en curso
+        self.detener = True
@@ -0,0 +1,47 @@
+from django.db import models
+from django.utils import timezone
+
+class Tarea(models.Model):
+    """
+    Trabajo pendiente de ejecutar fuera del ciclo de la petición
+    (correos, exportaciones...). Ver tareas/cola.py.
+    """
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    COMPLETADA = 'completada'
+    FALLIDA = 'fallida'
+    
+    ESTADOS = (
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (COMPLETADA, 'Completada'),
+        (FALLIDA, 'Fallida'),
+    )
+    
+    # Nombre con el que se registró la función (módulo.función)
+    nombre = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    
+    # No se ejecuta antes de este momento (reintentos con espera creciente)
+    ejecutar_en = models.DateTimeField(default=timezone.now)
+    # Mientras un worker la ejecuta; si vence, otro worker puede reclamarla
+    bloqueada_hasta = models.DateTimeField(null=True, blank=True)
+    ultimo_error = models.TextField(blank=True, default='')
+    
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Tarea"
+        verbose_name_plural = "Tareas"
+        indexes = [
+            models.Index(fields=['estado', 'ejecutar_en'], name='tarea_estado_ejecutar_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.nombre} ({self.get_estado_display()})"
@@ -0,0 +1,108 @@
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.utils import timezone
+from tareas import cola
+from tareas.models import Tarea
+
+# Registro de llamadas de las tareas de prueba
+llamadas = []
+
+
+@cola.tarea(nombre='tests.sumar')
+def sumar(a, b):
+    llamadas.append(a + b)
+
+
+@cola.tarea(nombre='tests.fallar', max_intentos=2)
+def fallar():
+    raise RuntimeError('fallo de prueba')
+
+
+@override_settings(TAREAS_SINCRONAS=False)
+class ColaTareasTest(TestCase):
+    """Tests para la cola de tareas en base de datos"""
+    
+    def setUp(self):
+        llamadas.clear()
+    
+    def test_encolar_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            sumar.encolar(2, b=3)
+            # Dentro de la transacción todavía no existe la fila
+            self.assertFalse(Tarea.objects.exists())
+        for callback in callbacks:
+            callback()
+        
+        tarea = Tarea.objects.get()
+        self.assertEqual((tarea.nombre, tarea.args, tarea.kwargs), ('tests.sumar', [2], {'b': 3}))
+        self.assertEqual(cola.procesar_lote(), 1)
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, Tarea.COMPLETADA)
+        self.assertEqual(llamadas, [5])
+    
+    def test_reclamar_no_repite(self):
+        cola.encolar(sumar, args=(1, 1), al_confirmar=False)
+        self.assertEqual(len(cola.reclamar()), 1)
+        # Un segundo worker no obtiene la tarea ya reclamada
+        self.assertEqual(cola.reclamar(), [])
+        
+        # Salvo que el bloqueo haya vencido (worker caído)
+        Tarea.objects.update(bloqueada_hasta=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(cola.reclamar()), 1)
+    
+    def test_reintentos_con_espera(self):
+        cola.encolar(fallar, al_confirmar=False)
+        cola.procesar_lote()
+        tarea = Tarea.objects.get()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.PENDIENTE, 1))
+        self.assertGreater(tarea.ejecutar_en, timezone.now())
+        self.assertIn('fallo de prueba', tarea.ultimo_error)
+        
+        # No se vuelve a ejecutar antes de tiempo
+        self.assertEqual(cola.procesar_lote(), 0)
+        Tarea.objects.update(ejecutar_en=timezone.now())
+        cola.procesar_lote()
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.FALLIDA, 2))
+    
+    def test_comando_worker(self):
+        for i in range(3):
+            cola.encolar(sumar, args=(i, i), al_confirmar=False)
+        Tarea.objects.create(nombre='tests.no_existe')
+        call_command('procesar_tareas', una_vez=True, lote=2, stdout=open('/dev/null', 'w'))
+        self.assertEqual(sorted(llamadas), [0, 2, 4])
+        self.assertEqual(Tarea.objects.get(nombre='tests.no_existe').estado, Tarea.FALLIDA)
+    
+    def test_notificacion_estado_en_segundo_plano(self):
+        from pedidos.models import Pedido
+        usuario = User.objects.create_user(username='cliente', email='cliente@example.com',
+                                           password='testpassword')
+        pedido = Pedido.objects.create(
+            usuario=usuario, nombre_completo='Cliente', direccion='Calle',
+            ciudad='Ciudad', codigo_postal='12345', telefono='123456789'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.cambiar_estado('enviado')
+        # La petición no envía el correo: queda en la cola
+        self.assertEqual(len(mail.outbox), 0)
+        
+        cola.procesar_lote()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Enviado', mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].to, ['cliente@example.com'])
+    
+    @override_settings(ADMINS=[('Admin', 'admin@example.com')])
+    def test_error_dentro_de_una_transaccion_avisa_directamente(self):
+        from utils.logger import log_exception
+        # Los tests corren dentro de una transacción: una fila de la cola se
+        # perdería al revertirla, así que el correo sale sin pasar por ella
+        try:
+            raise ValueError('fallo en la vista')
+        except ValueError as e:
+            log_exception(e, context={'vista': 'checkout'})
+        self.assertFalse(Tarea.objects.exists())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('ValueError', mail.outbox[0].subject)
@@ -0,0 +1,371 @@
+"""
+Caché de dos niveles: memoria del proceso (L1) delante de la caché compartida (L2).
+
+Los valores más leídos y que casi nunca cambian (categorías, marcas,
+productos populares, versiones de etiquetas...) se sirven desde un LRU del
+propio proceso durante unos segundos, sin ir a Redis en cada petición. Todo
+lo demás pasa directamente a L2.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'utils.cache_backends.TwoTierCache',
+            'LOCATION': 'mototienda',
+            'OPTIONS': {
+                'L2': 'redis',                   # alias de la caché compartida
+                'L1_TIMEOUT': 30,                # segundos como máximo en L1
+                'L1_MAX_ENTRIES': 500,
+                'L1_KEY_PREFIXES': ['todas_categorias', 'cache_tag_version:'],
+                'BUS': 'utils.cache_backends.RedisBus',
+            },
+        },
+        'redis': {'BACKEND': 'django_redis.cache.RedisCache', ...},
+    }
+
+Las escrituras van a L2 y se anuncian por el bus a los demás procesos (y
+nodos), que descartan esas claves de su L1; así las invalidaciones de
+cache_utils (delete_many de claves y set_many de versiones de etiquetas)
+llegan a todos los workers. Si un mensaje se pierde, el valor antiguo se
+sirve como mucho L1_TIMEOUT segundos.
+
+Un valor nunca vive en L1 más de lo que le queda en L2: el mensaje de cada
+escritura lleva la caducidad de las claves, y si un proceso no la conoce
+(arrancó después) la pide a L2 con ttl() cuando el backend lo permite.
+
+stats() devuelve los aciertos de cada nivel y los fallos del proceso.
+"""
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('mototienda.performance')
+
+_MISSING = object()
+
+# LOCATION -> _Memoria: una por proceso, compartida por los hilos (Django crea
+# una instancia del backend por hilo)
+_memorias = {}
+_memorias_lock = threading.Lock()
+
+
+class LocalBus:
+    """
+    Bus dentro del proceso: entrega los mensajes a las demás memorias del
+    mismo canal. Sirve para desarrollo y pruebas (varias LOCATION simulan
+    varios workers).
+    """
+    _suscriptores = defaultdict(list)
+    _lock = threading.Lock()
+
+    def __init__(self, channel, on_message, **options):
+        self.channel = channel
+        self.on_message = on_message
+        with self._lock:
+            self._suscriptores[channel].append(on_message)
+
+    def publish(self, mensaje):
+        with self._lock:
+            destinos = [s for s in self._suscriptores[self.channel] if s is not self.on_message]
+        for destino in destinos:
+            destino(mensaje)
+
+    def reiniciar(self):
+        pass
+
+
+class RedisBus:
+    """
+    Bus sobre Redis pub/sub. Cada proceso se suscribe al canal con un hilo
+    propio (redis-py PubSub.run_in_thread) la primera vez que usa la caché,
+    y otra vez tras un fork.
+
+    Options:
+        alias (str): Alias de una caché django_redis cuya conexión se usa
+    """
+
+    def __init__(self, channel, on_message, alias='redis'):
+        self.channel = channel
+        self.on_message = on_message
+        self.alias = alias
+        self._origen = uuid.uuid4().hex
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def _conexion(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(self.alias)
+
+    def reiniciar(self):
+        """Se suscribe al canal (en un proceso nuevo, tras un fork)"""
+        with self._lock:
+            self._origen = uuid.uuid4().hex
+            try:
+                pubsub = self._conexion().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._recibir})
+                self._hilo = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception:
+                # Sin suscripción, L1 caduca igualmente a los L1_TIMEOUT segundos
+                logger.warning(f'No se pudo suscribir al canal {self.channel}', exc_info=True)
+
+    def publish(self, mensaje):
+        try:
+            self._conexion().publish(self.channel, json.dumps({'origen': self._origen, **mensaje}))
+        except Exception:
+            logger.warning(f'No se pudo publicar en el canal {self.channel}', exc_info=True)
+
+    def _recibir(self, mensaje):
+        try:
+            datos = json.loads(mensaje['data'])
+        except (TypeError, ValueError):
+            return
+        # Los cambios propios ya se aplicaron en local
+        if datos.pop('origen', None) != self._origen:
+            self.on_message(datos)
+
+
+class _Memoria:
+    """LRU con caducidad del proceso, más sus contadores y su bus"""
+
+    def __init__(self, max_entries, bus_class, channel, bus_options):
+        self.max_entries = max_entries
+        self.datos = OrderedDict()  # clave -> (caduca, valor serializado)
+        # clave -> caducidad en L2 (time.time(), o None si no caduca) según
+        # las escrituras anunciadas; acotado como datos
+        self.caducidades = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        # Cada invalidación incrementa la generación: un valor leído de L2
+        # antes de una invalidación no se guarda en L1 después de ella
+        self.generacion = 0
+        self.pid = os.getpid()
+        self.bus = bus_class(channel, self.recibir, **bus_options)
+        self.bus.reiniciar()
+
+    def comprobar_proceso(self):
+        # Tras un fork, lo heredado puede estar desfasado y la suscripción
+        # al bus no existe en el hijo
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid == os.getpid():
+                    return
+                self.pid = os.getpid()
+                self.datos.clear()
+                self.stats.clear()
+                self.generacion += 1
+            self.bus.reiniciar()
+
+    def get(self, clave):
+        with self.lock:
+            entrada = self.datos.get(clave)
+            if entrada is None:
+                return _MISSING
+            if entrada[0] <= time.monotonic():
+                del self.datos[clave]
+                return _MISSING
+            self.datos.move_to_end(clave)
+            return entrada[1]
+
+    def set(self, clave, valor, timeout, generacion):
+        with self.lock:
+            if generacion != self.generacion:
+                return
+            self.datos[clave] = (time.monotonic() + timeout, valor)
+            self.datos.move_to_end(clave)
+            while len(self.datos) > self.max_entries:
+                self.datos.popitem(last=False)
+
+    def descartar(self, claves, caducidades=None):
+        with self.lock:
+            self.generacion += 1
+            for clave in claves:
+                self.datos.pop(clave, None)
+            for clave, caduca in (caducidades or {}).items():
+                self.caducidades[clave] = caduca
+                self.caducidades.move_to_end(clave)
+            while len(self.caducidades) > self.max_entries * 10:
+                self.caducidades.popitem(last=False)
+
+    def caducidad(self, clave):
+        """Caducidad en L2 anunciada para la clave, o _MISSING si no se conoce"""
+        with self.lock:
+            return self.caducidades.get(clave, _MISSING)
+
+    def vaciar(self):
+        with self.lock:
+            self.generacion += 1
+            self.datos.clear()
+            self.caducidades.clear()
+
+    def recibir(self, mensaje):
+        """Mensaje de otro proceso: {'claves': [...], 'caducan': {...}} o {'todo': True}"""
+        if mensaje.get('todo'):
+            self.vaciar()
+        else:
+            self.descartar(mensaje.get('claves', ()), mensaje.get('caducan'))
+
+
+class TwoTierCache(BaseCache):
+    """
+    Backend de caché con L1 en memoria del proceso y L2 en otro alias.
+
+    Options:
+        L2 (str): Alias de la caché compartida (por defecto 'redis')
+        L1_TIMEOUT (int): Segundos que un valor vive en L1 (por defecto 30)
+        L1_MAX_ENTRIES (int): Entradas de L1 por proceso (por defecto 1000)
+        L1_KEY_PREFIXES (list): Claves que pasan por L1; vacío, todas
+        BUS (str): Clase del bus de invalidaciones (LocalBus o RedisBus)
+        BUS_CHANNEL (str): Canal del bus (por defecto 'cache-l1:<LOCATION>')
+        BUS_OPTIONS (dict): Argumentos extra del bus
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'redis')
+        self._l1_timeout = options.get('L1_TIMEOUT', 30)
+        self._prefixes = tuple(options.get('L1_KEY_PREFIXES', ()))
+
+        nombre = location or self._l2_alias
+        with _memorias_lock:
+            if nombre not in _memorias:
+                _memorias[nombre] = _Memoria(
+                    options.get('L1_MAX_ENTRIES', 1000),
+                    import_string(options.get('BUS', 'utils.cache_backends.LocalBus')),
+                    options.get('BUS_CHANNEL', f'cache-l1:{nombre}'),
+                    options.get('BUS_OPTIONS', {}),
+                )
+            self._l1 = _memorias[nombre]
+
+    @property
+    def _l2(self):
+        return caches[self._l2_alias]
+
+    def _en_l1(self, key):
+        return not self._prefixes or key.startswith(self._prefixes)
+
+    def _invalidar(self, keys, version=None, timeout=_MISSING):
+        """
+        Descarta las claves de L1 en este proceso y en los demás; si se
+        escribieron, anuncia también su caducidad en L2.
+        """
+        claves = [self.make_key(key, version) for key in keys if self._en_l1(key)]
+        if not claves:
+            return
+        mensaje = {'claves': claves}
+        if timeout is not _MISSING:
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = self._l2.default_timeout
+            mensaje['caducan'] = dict.fromkeys(claves, None if timeout is None else time.time() + timeout)
+        self._l1.descartar(claves, mensaje.get('caducan'))
+        self._l1.bus.publish(mensaje)
+
+    def _vida_l1(self, key, version):
+        """Segundos que puede pasar en L1 un valor recién leído de L2"""
+        clave = self.make_key(key, version)
+        caduca = self._l1.caducidad(clave)
+        if caduca is _MISSING:
+            ttl = getattr(self._l2, 'ttl', None)
+            if ttl is None:
+                return self._l1_timeout
+            # django_redis: segundos restantes, None si no caduca
+            restante = ttl(key, version=version)
+            return self._l1_timeout if restante is None else min(self._l1_timeout, restante)
+        if caduca is None:
+            return self._l1_timeout
+        return min(self._l1_timeout, caduca - time.time())
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._l1.comprobar_proceso()
+        resultado, pendientes = {}, []
+        for key in keys:
+            valor = self._l1.get(self.make_key(key, version)) if self._en_l1(key) else _MISSING
+            if valor is _MISSING:
+                pendientes.append(key)
+            else:
+                resultado[key] = pickle.loads(valor)
+        self._l1.stats['l1_hits'] += len(resultado)
+        if not pendientes:
+            return resultado
+
+        generacion = self._l1.generacion
+        encontrados = self._l2.get_many(pendientes, version=version)
+        self._l1.stats['l2_hits'] += len(encontrados)
+        self._l1.stats['misses'] += len(pendientes) - len(encontrados)
+        for key, valor in encontrados.items():
+            if self._en_l1(key):
+                vida = self._vida_l1(key, version)
+                if vida <= 0:
+                    continue
+                # Serializado, como LocMemCache: quien lo lea no comparte el objeto
+                self._l1.set(self.make_key(key, version), pickle.dumps(valor, pickle.HIGHEST_PROTOCOL),
+                             vida, generacion)
+        resultado.update(encontrados)
+        return resultado
+
+    def has_key(self, key, version=None):
+        if self._en_l1(key) and self._l1.get(self.make_key(key, version)) is not _MISSING:
+            return True
+        return self._l2.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l2.set(key, value, timeout, version=version)
+        self._invalidar([key], version, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._l2.add(key, value, timeout, version=version):
+            self._invalidar([key], version, timeout)
+            return True
+        return False
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        fallidas = self._l2.set_many(data, timeout, version=version)
+        self._invalidar(list(data), version, timeout)
+        return fallidas
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        tocada = self._l2.touch(key, timeout, version=version)
+        if tocada:
+            self._invalidar([key], version, timeout)
+        return tocada
+
+    def incr(self, key, delta=1, version=None):
+        valor = self._l2.incr(key, delta, version=version)
+        self._invalidar([key], version)
+        return valor
+
+    def delete(self, key, version=None):
+        borrada = self._l2.delete(key, version=version)
+        self._invalidar([key], version)
+        return borrada
+
+    def delete_many(self, keys, version=None):
+        self._l2.delete_many(keys, version=version)
+        self._invalidar(keys, version)
+
+    def clear(self):
+        self._l2.clear()
+        self._l1.vaciar()
+        self._l1.bus.publish({'todo': True})
+
+    def close(self, **kwargs):
+        self._l2.close(**kwargs)
+
+    def stats(self):
+        """Aciertos en L1 y L2, fallos y entradas de L1 de este proceso"""
+        return {
+            'l1_hits': self._l1.stats['l1_hits'],
+            'l2_hits': self._l1.stats['l2_hits'],
+            'misses': self._l1.stats['misses'],
+            'l1_entries': len(self._l1.datos),
+        }
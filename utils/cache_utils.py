@@ -1,75 +1,406 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 import logging
+import math
+import random
+import threading
+import time
+import uuid
+import weakref
 
 logger = logging.getLogger('mototienda.performance')
 
-def invalidate_model_cache(model_name, object_id=None):
+# Prefijo de las claves que guardan la versión actual de cada etiqueta
+TAG_VERSION_PREFIX = 'cache_tag_version:'
+
+# Valor cacheado junto con las versiones de sus etiquetas en el momento de guardarlo
+TaggedValue = namedtuple('TaggedValue', ['versions', 'value'])
+
+# Valor calculado por get_or_compute: caduca (lógicamente) en `expires` y
+# tardó `delta` segundos en calcularse
+Computed = namedtuple('Computed', ['value', 'expires', 'delta'])
+
+# Prefijo de los cerrojos de get_or_compute en Redis
+LOCK_PREFIX = 'cache_lock:'
+
+# Cerrojos locales por clave (sin Redis); desaparecen cuando nadie los usa
+_locks = weakref.WeakValueDictionary()
+_locks_lock = threading.Lock()
+
+# Invalidaciones pendientes por hilo: {(modelo, id): None} conserva el orden sin duplicados
+_local = threading.local()
+
+
+def _tag_key(tag):
+    """Devuelve la clave de caché donde se guarda la versión de una etiqueta"""
+    return f'{TAG_VERSION_PREFIX}{tag}'
+
+
+def _new_tag_version():
     """
-    Invalida todas las cachés relacionadas con un modelo específico
-    o un objeto específico.
-    
+    Genera una versión inicial aleatoria para una etiqueta.
+
+    Si la clave de versión se pierde (desalojo, reinicio de Redis), la nueva
+    versión nunca coincidirá con la guardada en las entradas antiguas, de modo
+    que éstas quedan inalcanzables en lugar de revivir.
+    """
+    return uuid.uuid4().int >> 80
+
+
+def get_tag_versions(tags):
+    """
+    Obtiene la versión actual de cada etiqueta, creando las que no existan.
+
+    Args:
+        tags (iterable): Etiquetas (ej: 'producto:42', 'catalogo')
+
+    Returns:
+        dict: {etiqueta: versión}
+    """
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        return {}
+
+    keys = {_tag_key(tag): tag for tag in tags}
+    stored = cache.get_many(list(keys))
+    versions = {}
+    for key, tag in keys.items():
+        version = stored.get(key)
+        if version is None:
+            # add() no pisa una versión creada en paralelo por otro proceso
+            cache.add(key, _new_tag_version(), None)
+            version = cache.get(key)
+        versions[tag] = version
+    return versions
+
+
+def set_tagged(key, value, tags, timeout=None):
+    """
+    Guarda un valor en caché registrándolo bajo una o más etiquetas.
+
+    Args:
+        key (str): Clave de caché
+        value: Valor a guardar
+        tags (iterable): Etiquetas de las que depende el valor
+        timeout (int, optional): Tiempo de vida en segundos
+    """
+    cache.set(key, TaggedValue(get_tag_versions(tags), value), timeout)
+
+
+def get_tagged(key, default=None):
+    """
+    Obtiene un valor guardado con set_tagged.
+
+    Devuelve `default` si la clave no existe o si alguna de sus etiquetas
+    ha sido invalidada después de guardarlo.
+    """
+    entry = cache.get(key)
+    if not isinstance(entry, TaggedValue):
+        return default
+
+    if entry.versions:
+        current = cache.get_many([_tag_key(tag) for tag in entry.versions])
+        for tag, version in entry.versions.items():
+            if current.get(_tag_key(tag)) != version:
+                return default
+    return entry.value
+
+
+def invalidate_tags(*tags):
+    """
+    Invalida todas las entradas registradas bajo las etiquetas indicadas.
+
+    Cada etiqueta recibe una versión nueva en un único set_many, sin recorrer
+    el espacio de claves, y se comporta igual en LocMemCache y Redis.
+    """
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        return
+    cache.set_many({_tag_key(tag): _new_tag_version() for tag in tags}, None)
+    logger.debug(f"  Etiquetas de caché invalidadas: {', '.join(tags)}")
+
+
+class _LocalLock:
+    """Cerrojo por clave entre los hilos del proceso"""
+
+    def __init__(self, key):
+        with _locks_lock:
+            self._lock = _locks.setdefault(key, threading.Lock())
+
+    def acquire(self, wait):
+        return self._lock.acquire(timeout=wait) if wait else self._lock.acquire(blocking=False)
+
+    def release(self):
+        self._lock.release()
+
+
+class _RedisLock:
+    """Cerrojo por clave entre procesos y nodos (redis-py Lock)"""
+
+    def __init__(self, key, alias, timeout):
+        from django_redis import get_redis_connection
+        self._lock = get_redis_connection(alias).lock(f'{LOCK_PREFIX}{key}', timeout=timeout)
+
+    def acquire(self, wait):
+        return self._lock.acquire(blocking=bool(wait), blocking_timeout=wait or None)
+
+    def release(self):
+        from redis.exceptions import LockError
+        try:
+            self._lock.release()
+        except LockError:
+            # Caducó mientras se calculaba: quizá otro ya lo tiene
+            pass
+
+
+def _compute_lock(key, timeout):
+    alias = getattr(settings, 'CACHE_LOCK_REDIS_ALIAS', None)
+    return _RedisLock(key, alias, timeout) if alias else _LocalLock(key)
+
+
+def _read_computed(key, tags):
+    entry = cache.get(key) if tags is None else get_tagged(key)
+    return entry if isinstance(entry, Computed) else None
+
+
+def compute_and_set(key, compute, timeout=None, tags=None, stale_ttl=0):
+    """
+    Calcula el valor y lo guarda para get_or_compute, aunque ya existiera.
+
+    La entrada vive `timeout + stale_ttl` segundos en la caché, pero caduca
+    a los `timeout` segundos: a partir de ahí solo se sirve mientras otro
+    la recalcula.
+
+    Returns:
+        El valor calculado
+    """
+    # Versiones leídas antes de calcular: si una etiqueta se invalida durante
+    # el cálculo, la entrada nace ya invalidada en lugar de pasar por fresca
+    versions = get_tag_versions(tags) if tags is not None else None
+    start = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - start
+    expires = time.time() + timeout if timeout is not None else None
+    entry = Computed(value, expires, delta)
+    stored_timeout = timeout + stale_ttl if timeout is not None else None
+    if versions is None:
+        cache.set(key, entry, stored_timeout)
+    else:
+        cache.set(key, TaggedValue(versions, entry), stored_timeout)
+    return value
+
+
+def get_or_compute(key, compute, timeout=None, tags=None, stale_ttl=0, beta=1.0, lock_timeout=10):
+    """
+    Devuelve el valor cacheado o lo calcula, con una sola petición
+    calculando a la vez cada clave (protección contra estampidas).
+
+    - Fallo: la primera petición toma el cerrojo de la clave y calcula; las
+      demás esperan a que termine (hasta `lock_timeout` segundos) y leen su
+      resultado.
+    - Refresco anticipado: antes de caducar, cada lectura tiene una
+      probabilidad creciente (proporcional a lo que tarda en calcularse y
+      a `beta`) de recalcularlo, así que las claves muy leídas se renuevan
+      antes de caducar y sin coincidir.
+    - Con `stale_ttl`, durante ese tiempo tras caducar se sigue sirviendo el
+      valor antiguo mientras una sola petición lo recalcula.
+
+    Invalidar sus etiquetas o borrar la clave cuenta como fallo: nunca se
+    sirve un valor invalidado. El cerrojo es de Redis si está definido
+    CACHE_LOCK_REDIS_ALIAS y, si no, de los hilos del proceso.
+
+    Args:
+        key (str): Clave de caché
+        compute (callable): Calcula el valor (sin argumentos)
+        timeout (int, optional): Segundos hasta que caduca; None, nunca
+        tags (iterable, optional): Etiquetas (ver set_tagged)
+        stale_ttl (int): Segundos que se sirve caducado mientras se recalcula
+        beta (float): Cuánto se adelanta el refresco (0 lo desactiva)
+        lock_timeout (int): Segundos máximos de cálculo y de espera
+
+    Returns:
+        El valor cacheado o calculado
+    """
+    entry = _read_computed(key, tags)
+    if entry is not None:
+        if entry.expires is None:
+            return entry.value
+        now = time.time()
+        # XFetch: adelantar el refresco un tiempo aleatorio ~ delta * beta
+        early = entry.delta * beta * -math.log(1.0 - random.random())
+        if now + early < entry.expires:
+            return entry.value
+        if now < entry.expires + stale_ttl:
+            # Recalcula quien consiga el cerrojo; el resto sirve el actual
+            lock = _compute_lock(key, lock_timeout)
+            if not lock.acquire(0):
+                return entry.value
+            try:
+                return compute_and_set(key, compute, timeout, tags, stale_ttl)
+            finally:
+                lock.release()
+
+    lock = _compute_lock(key, lock_timeout)
+    acquired = lock.acquire(lock_timeout)
+    try:
+        if acquired:
+            # Mientras se esperaba el cerrojo, otro pudo calcularlo
+            entry = _read_computed(key, tags)
+            if entry is not None and (entry.expires is None or time.time() < entry.expires):
+                return entry.value
+        else:
+            logger.warning(f"Tiempo de espera agotado para el cálculo de '{key}'; se calcula sin cerrojo")
+        return compute_and_set(key, compute, timeout, tags, stale_ttl)
+    finally:
+        if acquired:
+            lock.release()
+
+
+def model_cache_dependencies(model_name, object_id=None):
+    """
+    Devuelve las claves exactas y las etiquetas asociadas a un modelo.
+
     Args:
         model_name (str): Nombre del modelo (ej: 'producto', 'categoria')
-        object_id (int, optional): ID específico del objeto a invalidar
+        object_id (int, optional): ID específico del objeto
+
+    Returns:
+        tuple: (list de claves exactas, list de etiquetas)
     """
-    # Mapeo de patrones de clave de caché por modelo
-    cache_patterns = {
+    # Claves fijas que se eliminan directamente
+    cache_keys = {
+        'categoria': ['todas_categorias'],
+        'marca': ['todas_marcas'],
+        'carrito': [f'carrito_count_{object_id}' if object_id else None],
+    }
+
+    # Etiquetas que sustituyen a los antiguos patrones con comodín
+    cache_tags = {
         'producto': [
-            'productos_*',
-            f'producto_{object_id}*' if object_id else None,
-            'catalogo_*',
+            'productos',
+            'catalogo',
+            f'producto:{object_id}' if object_id else None,
         ],
         'categoria': [
-            'todas_categorias',
-            'catalogo_*',
-            f'categoria_{object_id}*' if object_id else None,
+            'catalogo',
+            f'categoria:{object_id}' if object_id else None,
         ],
         'marca': [
-            'todas_marcas',
-            'catalogo_*',
-            f'marca_{object_id}*' if object_id else None,
+            'catalogo',
+            f'marca:{object_id}' if object_id else None,
         ],
         'pedido': [
-            f'pedido_{object_id}*' if object_id else None,
-            'estadisticas_pedidos*',
+            f'pedido:{object_id}' if object_id else None,
+            'estadisticas_pedidos',
         ],
         'carrito': [
-            f'carrito_count_{object_id}*' if object_id else None,
+            f'carrito:{object_id}' if object_id else None,
         ],
+        # Reservas y liberaciones de stock: solo cambia la ficha del producto
+        'stock': [
+            f'producto:{object_id}' if object_id else None,
+        ],
+        'estadisticas_pedidos': ['estadisticas_pedidos'],
     }
-    
-    # Obtener patrones para el modelo especificado
-    patterns = cache_patterns.get(model_name.lower(), [])
-    patterns = [p for p in patterns if p]  # Eliminar None
-    
+
+    model_name = model_name.lower()
+    keys = [k for k in cache_keys.get(model_name, []) if k]
+    tags = [t for t in cache_tags.get(model_name, []) if t]
+    return keys, tags
+
+
+def _pending_invalidations():
+    """Devuelve las invalidaciones pendientes del hilo actual"""
+    if not hasattr(_local, 'pending'):
+        _local.pending = {}
+    return _local.pending
+
+
+def _schedule_flush():
+    """Vacía la cola ahora o al confirmar la transacción en curso"""
+    if transaction.get_connection().in_atomic_block:
+        # Si la transacción se revierte, Django descarta el callback y las
+        # intenciones quedan en cola hasta el siguiente vaciado (invalidar de
+        # más es inocuo)
+        transaction.on_commit(flush_invalidations)
+    else:
+        flush_invalidations()
+
+
+def flush_invalidations():
+    """
+    Aplica todas las invalidaciones pendientes del hilo actual.
+
+    Las intenciones ya vienen deduplicadas por (modelo, id); aquí se
+    agrupan sus claves y etiquetas en un delete_many y un set_many.
+    """
+    pending = _pending_invalidations()
+    if not pending:
+        return
+    _local.pending = {}
+
+    keys, tags = [], []
+    for model_name, object_id in pending:
+        model_keys, model_tags = model_cache_dependencies(model_name, object_id)
+        keys.extend(model_keys)
+        tags.extend(model_tags)
+
+    keys = list(dict.fromkeys(keys))
+    if keys:
+        cache.delete_many(keys)
+        logger.debug(f"  Cachés invalidadas: {', '.join(keys)}")
+
+    invalidate_tags(*tags)
+
+
+@contextmanager
+def invalidation_batch():
+    """
+    Agrupa las invalidaciones producidas dentro del bloque.
+
+    Al salir del bloque más externo la cola se vacía una sola vez, o al
+    confirmar la transacción si el bloque está dentro de transaction.atomic().
+
+    Uso:
+        with invalidation_batch():
+            producto.save()
+            talla_formset.save()
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if _local.depth == 0:
+            _schedule_flush()
+
+
+def invalidate_model_cache(model_name, object_id=None):
+    """
+    Invalida todas las cachés relacionadas con un modelo específico
+    o un objeto específico.
+
+    La invalidación se encola y se deduplica por (modelo, id). Dentro de un
+    invalidation_batch() se aplica al salir del bloque; dentro de
+    transaction.atomic() se aplica una sola vez al confirmar; en otro caso
+    se aplica inmediatamente.
+
+    Args:
+        model_name (str): Nombre del modelo (ej: 'producto', 'categoria')
+        object_id (int, optional): ID específico del objeto a invalidar
+    """
     # Log para depuración
-    logger.debug(f"Invalidando caché para {model_name}" + 
+    logger.debug(f"Invalidando caché para {model_name}" +
                 (f" ID: {object_id}" if object_id else ""))
-    
-    # Eliminar cachés que coincidan con los patrones
-    for pattern in patterns:
-        if '*' in pattern:
-            # Si tiene wildcard, necesitamos buscar todas las claves que coincidan
-            # Esto depende de cómo está implementado el backend de caché
-            # En Redis puedes usar KEYS, pero eso es costoso en producción
-            # Aquí una implementación simplificada que funciona mejor con Memcached
-            keys = []
-            if hasattr(cache, 'keys'):
-                # Si el backend de caché soporta listar claves
-                all_keys = cache.keys(pattern)
-                keys.extend(all_keys)
-            else:
-                # Si no, no podemos hacer mucho
-                logger.warning(f"Backend de caché no soporta wildcards. Patrón: {pattern}")
-                
-            # Eliminar cada clave encontrada
-            for key in keys:
-                cache.delete(key)
-                logger.debug(f"  Caché invalidada: {key}")
-        else:
-            # Si es una clave exacta, simplemente la eliminamos
-            cache.delete(pattern)
-            logger.debug(f"  Caché invalidada: {pattern}")
+
+    _pending_invalidations()[(model_name.lower(), object_id)] = None
+
+    if getattr(_local, 'depth', 0):
+        return
+    _schedule_flush()
 
 def invalidate_all_cache():
     """Invalida toda la caché del sistema"""
@@ -0,0 +1,159 @@
+"""
+Valores compactos y versionados para la caché.
+
+En lugar de guardar instancias de modelo (pickle de todo su estado, de las
+relaciones precargadas y de la clase, que deja de poder leerse si el modelo
+cambia entre despliegues), las entradas con esquema guardan solo tipos
+básicos: una tupla por fila con los campos indicados.
+
+    PRODUCTO = ModelSchema(Producto, ['id', 'nombre', 'precio'])
+    datos = encode(PRODUCTO, productos)     # bytes
+    productos = decode(PRODUCTO, datos)     # instancias de Producto
+
+Los bytes llevan una cabecera con el formato y la versión del esquema. La
+versión cambia sola al cambiar el modelo o la lista de campos (o a mano con
+`version`), y un valor con otra versión se trata como ausente: el código
+nuevo nunca lee datos del anterior.
+
+El cuerpo se codifica con msgpack si está instalado (JSON si no) y se
+comprime con zlib por encima de CACHE_COMPRESION_MIN_BYTES.
+"""
+import json
+import logging
+import struct
+import zlib
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # Opcional: sin msgpack se usa JSON
+    msgpack = None
+
+logger = logging.getLogger('mototienda.performance')
+
+# Cabecera: indicadores (1 byte) y versión del esquema (4 bytes)
+HEADER = struct.Struct('!BI')
+FLAG_MSGPACK = 0x01
+FLAG_ZLIB = 0x02
+
+
+class Schema:
+    """
+    Esquema de datos que ya son tipos básicos (dict, list, str, números...),
+    por ejemplo las respuestas JSON ya preparadas.
+    """
+
+    def __init__(self, name, version=1):
+        self.name = name
+        self.version = zlib.crc32(f'{name}:{version}'.encode())
+
+    def dump(self, value):
+        return value
+
+    def load(self, data):
+        return data
+
+
+class ModelSchema(Schema):
+    """
+    Lista de instancias de `model` guardadas como tuplas de `fields`
+    (nombres de atributo: 'categoria_id', no 'categoria').
+
+    Al leerlas se reconstruyen con Model.from_db(): el resto de campos quedan
+    diferidos y, si una plantilla los usa, se cargan con una consulta.
+
+    Args:
+        model: Clase del modelo
+        fields (list): Campos que se guardan
+        version (int): Se sube a mano si cambia el significado de los datos
+            sin cambiar los campos
+        related (dict): {atributo: (ModelSchema, función)}; guarda junto a
+            cada fila el objeto que devuelve función(instancia) y al leerla
+            lo asigna al atributo (p. ej. una imagen principal precargada)
+    """
+
+    def __init__(self, model, fields, version=1, related=None):
+        self.model = model
+        # from_db() recibe los valores en el orden de los campos del modelo
+        self._fields = [f for f in model._meta.concrete_fields if f.attname in fields]
+        self.fields = tuple(f.attname for f in self._fields)
+        if len(self.fields) != len(set(fields)):
+            raise ValueError(f'{model.__name__} no tiene los campos {set(fields) - set(self.fields)}')
+        self.related = related or {}
+        super().__init__(f"{model._meta.label}:{','.join(self.fields)}:{','.join(self.related)}", version)
+
+    def _dump_value(self, field, obj):
+        value = getattr(obj, field.attname)
+        # Tipos básicos: los que ya lo son, y el resto como cadena (Decimal,
+        # fechas, ficheros...); to_python() los recupera al leer
+        if value is None or isinstance(value, (str, int, float, bool, dict, list)):
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if hasattr(value, 'name'):
+            return value.name
+        return str(value)
+
+    def dump_one(self, obj):
+        if obj is None:
+            return None
+        row = [self._dump_value(field, obj) for field in self._fields]
+        for schema, getter in self.related.values():
+            row.append(schema.dump_one(getter(obj)))
+        return row
+
+    def load_one(self, row):
+        if row is None:
+            return None
+        values = [field.to_python(value) for field, value in zip(self._fields, row)]
+        obj = self.model.from_db(None, self.fields, values)
+        for (attr, (schema, _)), data in zip(self.related.items(), row[len(self._fields):]):
+            setattr(obj, attr, schema.load_one(data))
+        return obj
+
+    def dump(self, value):
+        return [self.dump_one(obj) for obj in value]
+
+    def load(self, data):
+        return [self.load_one(row) for row in data]
+
+
+def encode(schema, value):
+    """Convierte `value` en bytes con la cabecera del esquema"""
+    data = schema.dump(value)
+    if msgpack is not None:
+        flags, body = FLAG_MSGPACK, msgpack.packb(data, use_bin_type=True)
+    else:
+        flags, body = 0, json.dumps(data, separators=(',', ':')).encode()
+    if len(body) >= settings.CACHE_COMPRESION_MIN_BYTES:
+        comprimido = zlib.compress(body, 6)
+        if len(comprimido) < len(body):
+            flags, body = flags | FLAG_ZLIB, comprimido
+    return HEADER.pack(flags, schema.version) + body
+
+
+def decode(schema, raw):
+    """
+    Devuelve el valor guardado con encode(), o None si falta, es de otra
+    versión del esquema o no se puede leer.
+    """
+    if not isinstance(raw, bytes) or len(raw) < HEADER.size:
+        return None
+    flags, version = HEADER.unpack_from(raw)
+    if version != schema.version:
+        return None
+    body = raw[HEADER.size:]
+    try:
+        if flags & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        if flags & FLAG_MSGPACK:
+            if msgpack is None:
+                return None
+            data = msgpack.unpackb(body, raw=False)
+        else:
+            data = json.loads(body)
+        return schema.load(data)
+    except Exception:
+        logger.warning(f'Valor de caché ilegible para el esquema {schema.name}', exc_info=True)
+        return None
@@ -0,0 +1,171 @@
+"""
+Registro de entradas de caché que se pueden precalentar.
+
+Cada entrada reúne cómo se construye su clave, cómo se calcula su valor y de
+qué etiquetas depende. La vista o el servicio que la usa la lee con get(), y
+el comando precache la recalcula con warm() sin esperar a que llegue tráfico:
+
+    @warmable('productos_populares', tags=['productos'], timeout=60 * 30)
+    def productos_populares():
+        return list(Producto.objects.filter(disponible=True)...)
+
+    productos = productos_populares.get()
+
+Las entradas con argumentos (una por producto, por combinación de
+filtros...) indican en `params` qué combinaciones conviene calentar, y
+`depends_on` fija el orden: una entrada se calienta después de aquellas de
+las que depende (por ejemplo, los relacionados de los productos populares).
+
+Con `schema` (ver cache_values.py) el valor se guarda como datos compactos
+y versionados en lugar de con pickle; get() lo devuelve reconstruido.
+
+get() usa cache_utils.get_or_compute: al caducar una entrada solo una
+petición la recalcula, y con `stale_ttl` las demás siguen recibiendo el
+valor anterior mientras tanto.
+
+Las entradas se registran al importar su módulo; precache importa las vistas
+de todas las aplicaciones para descubrirlas.
+"""
+import functools
+
+from .cache_utils import compute_and_set, get_or_compute
+from .cache_values import decode, encode
+
+# nombre -> WarmableEntry
+_registry = {}
+
+
+class WarmableEntry:
+    """
+    Valor cacheado con su cargador.
+
+    Args:
+        name (str): Nombre único de la entrada
+        loader (callable): Calcula el valor a partir de los argumentos
+        key (str | callable, optional): Clave; una cadena admite format()
+            con los argumentos. Por defecto, el nombre
+        tags (list | callable, optional): Etiquetas (ver cache_utils). Con
+            None el valor se guarda sin etiquetas y se invalida por clave
+        timeout (int, optional): Tiempo de vida en segundos
+        params (callable, optional): Devuelve las tuplas de argumentos que
+            se calientan; sin él se calienta la entrada sin argumentos
+        depends_on (iterable): Entradas que se calientan antes que esta
+        schema (cache_values.Schema, optional): Cómo se guarda el valor; sin
+            él se guarda tal cual (pickle)
+        stale_ttl (int): Segundos que se sirve el valor caducado mientras
+            una petición lo recalcula
+    """
+
+    def __init__(self, name, loader, key=None, tags=None, timeout=None, params=None, depends_on=(),
+                 schema=None, stale_ttl=0):
+        self.name = name
+        self.loader = loader
+        self._key = key or name
+        self._tags = tags
+        self.timeout = timeout
+        self.params = params
+        self.depends_on = tuple(depends_on)
+        self.schema = schema
+        self.stale_ttl = stale_ttl
+        functools.update_wrapper(self, loader)
+
+    def __call__(self, *args):
+        return self.loader(*args)
+
+    def key(self, *args):
+        if callable(self._key):
+            return self._key(*args)
+        return self._key.format(*args)
+
+    def tags(self, *args):
+        return self._tags(*args) if callable(self._tags) else self._tags
+
+    def _compute(self, args, computed):
+        # Guarda el valor original para no reconstruirlo desde lo serializado
+        value = computed['value'] = self.loader(*args)
+        return value if self.schema is None else encode(self.schema, value)
+
+    def get(self, *args):
+        """Devuelve el valor cacheado, calculándolo y guardándolo si falta"""
+        computed = {}
+        stored = get_or_compute(self.key(*args), lambda: self._compute(args, computed), self.timeout,
+                                tags=self.tags(*args), stale_ttl=self.stale_ttl)
+        if 'value' in computed:
+            return computed['value']
+        if self.schema is None:
+            return stored
+        value = decode(self.schema, stored)
+        # Guardado con otra versión del esquema: se recalcula
+        return self.warm(*args) if value is None else value
+
+    def warm(self, *args):
+        """Calcula el valor y lo guarda, aunque ya estuviera en caché"""
+        computed = {}
+        compute_and_set(self.key(*args), lambda: self._compute(args, computed), self.timeout,
+                        tags=self.tags(*args), stale_ttl=self.stale_ttl)
+        return computed['value']
+
+    def warm_params(self):
+        """Tuplas de argumentos a calentar"""
+        if self.params is None:
+            return [()]
+        return [p if isinstance(p, tuple) else (p,) for p in self.params()]
+
+    def __repr__(self):
+        return f'<WarmableEntry {self.name}>'
+
+
+def warmable(name, **options):
+    """
+    Decorador que registra una función como cargador de una entrada.
+
+    Devuelve la WarmableEntry, que se puede seguir llamando como la función
+    original (sin caché) o usar con get() y warm().
+    """
+    def decorator(loader):
+        if name in _registry:
+            raise ValueError(f"Ya hay una entrada de caché registrada como '{name}'")
+        entry = WarmableEntry(name, loader, **options)
+        _registry[name] = entry
+        return entry
+    return decorator
+
+
+def registry():
+    """{nombre: WarmableEntry} de todas las entradas registradas"""
+    return dict(_registry)
+
+
+def warm_order(names=None):
+    """
+    Agrupa las entradas en etapas: cada etapa solo depende de las anteriores,
+    así que las entradas de una misma etapa se pueden calentar a la vez.
+
+    Args:
+        names (iterable, optional): Entradas a incluir (con sus dependencias);
+            por defecto, todas
+
+    Returns:
+        list: listas de WarmableEntry
+
+    Raises:
+        KeyError: Si una entrada o dependencia no existe
+        ValueError: Si hay dependencias circulares
+    """
+    pending = set()
+    stack = list(names if names is not None else _registry)
+    while stack:
+        name = stack.pop()
+        if name not in pending:
+            pending.add(name)
+            stack.extend(_registry[name].depends_on)
+
+    stages, done = [], set()
+    while pending:
+        ready = sorted(n for n in pending if set(_registry[n].depends_on) <= done)
+        if not ready:
+            raise ValueError(f"Dependencias circulares entre: {', '.join(sorted(pending))}")
+        stages.append([_registry[n] for n in ready])
+        done.update(ready)
+        pending.difference_update(ready)
+    return stages
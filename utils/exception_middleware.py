@@ -2,7 +2,8 @@
 
 import json
 import traceback
-from django.http import JsonResponse, HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse, HttpResponse, Http404
 from django.template.loader import render_to_string
 from django.conf import settings
 from utils.logger import log_exception
@@ -29,6 +30,11 @@ class GlobalExceptionMiddleware:
         Returns:
             HttpResponse: Respuesta personalizada para el error
         """
+        # Los 404 y 403 no son errores del servidor: Django los responde
+        # con su código y no deben notificarse a los administradores
+        if isinstance(exception, (Http404, PermissionDenied)):
+            return None
+        
         # Registrar la excepción
         context = {
             'url': request.path,
@@ -9,6 +9,7 @@ import os
 from datetime import datetime
 from django.conf import settings
 from django.core.mail import mail_admins
+from django.db import DatabaseError, connection
 
 # Configurar loggers básicos
 
@@ -57,7 +58,19 @@ def log_exception(exc, context=None, notify=True):
             f"Traceback:\n{traceback.format_exc()}\n\n"
             f"Contexto adicional:\n{json.dumps(context or {}, indent=2)}"
         )
-        mail_admins(subject, message, fail_silently=True)
+        # Fuera de una transacción, el correo sale por la cola de tareas. Dentro
+        # de una, la fila de la tarea se perdería si el error la revierte (y
+        # on_commit no llegaría a ejecutarse), así que se envía directamente;
+        # también si la base de datos no admite la escritura.
+        if connection.in_atomic_block:
+            mail_admins(subject, message, fail_silently=True)
+            return
+        try:
+            from core.tareas import notificar_admins
+            from tareas.cola import encolar
+            encolar(notificar_admins, args=(subject, message), al_confirmar=False)
+        except DatabaseError:
+            mail_admins(subject, message, fail_silently=True)
 
 def log_security_event(event_type, details, level='INFO'):
     """
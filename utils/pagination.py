@@ -0,0 +1,280 @@
+# Paginación por cursor (keyset) para listados grandes
+import datetime
+import hashlib
+import json
+import logging
+from collections.abc import Sequence
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+logger = logging.getLogger('mototienda.performance')
+
+
+class InvalidCursor(Exception):
+    """El cursor recibido está mal formado o pertenece a otra ordenación"""
+    pass
+
+
+# Sal de la firma de los cursores (se añade la de la ordenación)
+CURSOR_SALT = 'utils.pagination.cursor'
+
+
+def _serializar(valor):
+    """Convierte a JSON los tipos habituales en claves de ordenación"""
+    # isoformat conserva los microsegundos; DjangoJSONEncoder los truncaría
+    # y el cursor dejaría de coincidir exactamente con la fila
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, (datetime.datetime, datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    raise TypeError(f'Tipo no serializable en un cursor: {type(valor).__name__}')
+
+
+def _valor_campo(obj, campo):
+    """Obtiene el valor de un campo de ordenación, siguiendo relaciones con '__'"""
+    for parte in campo.split('__'):
+        obj = getattr(obj, parte)
+    if hasattr(obj, 'pk') and not isinstance(obj, (str, int)):
+        # Ordenar por una FK compara por su clave primaria
+        obj = obj.pk
+    return obj
+
+
+def estimar_total(queryset):
+    """
+    Devuelve el número aproximado de filas de un queryset sin COUNT(*).
+
+    En PostgreSQL se usa la estimación del planificador (EXPLAIN), que sale
+    de las estadísticas de la tabla y no recorre las filas. Otros motores
+    no exponen estimaciones fiables, así que se hace el recuento exacto.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def querystring_sin_cursor(params):
+    """
+    Devuelve los parámetros GET codificados sin el cursor ni el número de
+    página, para construir los enlaces de navegación conservando los filtros.
+    """
+    params = params.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    return params.urlencode()
+
+
+class KeysetPage(Sequence):
+    """
+    Página de resultados obtenida con KeysetPaginator.
+
+    Atributos:
+        object_list: Objetos de la página
+        has_next / has_previous: Si hay página siguiente o anterior
+        next_cursor / previous_cursor: Cursores opacos para navegar
+        paginator: El paginador que generó la página
+    """
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f'<KeysetPage de {len(self)} elementos>'
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self.paginator.cursor_para(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self.paginator.cursor_para(self.object_list[0], hacia_atras=True)
+        return None
+
+
+class KeysetPaginator:
+    """
+    Paginador por cursor: cada página se obtiene con un WHERE sobre la clave
+    de ordenación de la última fila vista en lugar de OFFSET, de modo que la
+    página 500 cuesta lo mismo que la primera.
+
+    La ordenación siempre termina en la clave primaria para que el orden sea
+    total; los campos de ordenación no deben admitir NULL.
+
+    Uso:
+        paginator = KeysetPaginator(Pedido.objects.all(), 50,
+                                    ordering=['-fecha_pedido'], contar='estimado')
+        try:
+            pagina = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            pagina = paginator.page()
+
+    Args:
+        queryset: QuerySet a paginar
+        per_page (int): Elementos por página
+        ordering (list, optional): Campos de ordenación; por defecto los del
+            queryset o '-pk'
+        contar (str, optional): 'exacto' (COUNT(*)), 'estimado' (estadísticas
+            del planificador) o None para no contar
+    """
+    def __init__(self, queryset, per_page, ordering=None, contar='exacto'):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.contar = contar
+
+        ordering = list(ordering or queryset.query.order_by or ['-pk'])
+        if not any(campo.lstrip('-') in ('pk', 'id') for campo in ordering):
+            # Desempate por clave primaria en el mismo sentido que el primer campo
+            ordering.append('-pk' if ordering[0].startswith('-') else 'pk')
+        self.ordering = ordering
+
+    @cached_property
+    def firma(self):
+        """Identifica la ordenación para rechazar cursores de otra distinta"""
+        return hashlib.md5('|'.join(self.ordering).encode('utf-8')).hexdigest()[:8]
+
+    @cached_property
+    def count(self):
+        """Total de elementos (aproximado si contar='estimado'), o None"""
+        if self.contar == 'estimado':
+            return estimar_total(self.queryset)
+        if self.contar == 'exacto':
+            return self.queryset.count()
+        return None
+
+    @property
+    def estimado(self):
+        return self.contar == 'estimado'
+
+    # === Cursores ===
+
+    @property
+    def _salt(self):
+        # Un cursor firmado para otra ordenación no pasa la verificación
+        return f'{CURSOR_SALT}:{self.firma}'
+
+    def _campo(self, nombre):
+        """Campo (o anotación) con el que se convierte un valor del cursor"""
+        query = self.queryset.query
+        if nombre in query.annotations:
+            return query.annotations[nombre].output_field
+        modelo = self.queryset.model
+        campo = None
+        for parte in nombre.split('__'):
+            campo = modelo._meta.pk if parte == 'pk' else modelo._meta.get_field(parte)
+            if campo.is_relation:
+                modelo = campo.related_model
+        return campo
+
+    def cursor_para(self, obj, hacia_atras=False):
+        """Devuelve el cursor firmado que apunta justo después (o antes) de `obj`"""
+        datos = {
+            'k': [_serializar(_valor_campo(obj, campo.lstrip('-'))) for campo in self.ordering],
+            'd': 'p' if hacia_atras else 'n',
+        }
+        return signing.dumps(datos, salt=self._salt)
+
+    def _decodificar(self, cursor):
+        """
+        Verifica la firma del cursor y convierte cada valor con su campo, de
+        modo que a los filtros solo llegan valores del tipo correcto.
+        """
+        try:
+            datos = signing.loads(cursor, salt=self._salt)
+            valores, direccion = datos['k'], datos['d']
+        except (signing.BadSignature, ValueError, TypeError, KeyError):
+            raise InvalidCursor('Cursor mal formado o manipulado')
+
+        if direccion not in ('n', 'p') or not isinstance(valores, list) or len(valores) != len(self.ordering):
+            raise InvalidCursor('El cursor no corresponde a esta ordenación')
+        try:
+            valores = [self._campo(campo.lstrip('-')).to_python(valor)
+                       for campo, valor in zip(self.ordering, valores)]
+        except (ValidationError, TypeError, ValueError, FieldDoesNotExist):
+            raise InvalidCursor('Valores del cursor no válidos')
+        if any(valor is None for valor in valores):
+            raise InvalidCursor('Valores del cursor no válidos')
+        return valores, direccion == 'p'
+
+    def _filtro(self, valores, hacia_atras):
+        """
+        Condición "fila posterior a la clave" para una ordenación compuesta:
+        (a > va) OR (a = va AND b > vb) OR ..., con cada comparación en el
+        sentido de su campo e invertida al retroceder.
+        """
+        condicion = Q()
+        iguales = Q()
+        for campo, valor in zip(self.ordering, valores):
+            nombre = campo.lstrip('-')
+            mayor = campo.startswith('-') == hacia_atras
+            condicion |= iguales & Q(**{f'{nombre}__{"gt" if mayor else "lt"}': valor})
+            iguales &= Q(**{nombre: valor})
+        return condicion
+
+    @staticmethod
+    def _invertir(campo):
+        return campo[1:] if campo.startswith('-') else f'-{campo}'
+
+    # === Páginas ===
+
+    def page(self, cursor=None):
+        """
+        Devuelve la página que empieza en `cursor` (la primera si es None).
+
+        Raises:
+            InvalidCursor: Si el cursor no es válido para esta ordenación
+        """
+        if not cursor:
+            objetos = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return KeysetPage(objetos[:self.per_page], self,
+                              has_next=len(objetos) > self.per_page, has_previous=False)
+
+        valores, hacia_atras = self._decodificar(cursor)
+        queryset = self.queryset.filter(self._filtro(valores, hacia_atras))
+
+        if hacia_atras:
+            ordering = [self._invertir(campo) for campo in self.ordering]
+            objetos = list(queryset.order_by(*ordering)[:self.per_page + 1])
+            hay_mas = len(objetos) > self.per_page
+            objetos = objetos[:self.per_page][::-1]
+            return KeysetPage(objetos, self, has_next=True, has_previous=hay_mas)
+
+        objetos = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        return KeysetPage(objetos[:self.per_page], self,
+                          has_next=len(objetos) > self.per_page, has_previous=True)
+
+    def get_page(self, cursor=None):
+        """Como page(), pero un cursor inválido devuelve la primera página"""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            logger.debug("Cursor de paginación inválido, se devuelve la primera página")
+            return self.page()
@@ -0,0 +1,112 @@
+"""
+Seguimiento de cambios en campos de modelos sin consultas extra.
+
+Uso:
+    class Pago(models.Model):
+        status = models.CharField(...)
+        tracker = FieldTracker(['status'])
+
+    pago.tracker.has_changed('status')   # True si difiere del valor cargado
+    pago.tracker.previous('status')      # valor al cargar (o al último save)
+    pago.tracker.changed()               # {campo: valor anterior} de los modificados
+
+Los valores originales se copian al instanciar el modelo (post_init, que
+también se emite al cargarlo de la BD) y se renuevan al terminar save(),
+después de que se hayan ejecutado los receptores de post_save; así estos
+todavía pueden consultar qué cambió. Los campos diferidos con only()/defer()
+no tienen valor original: si se consultan, se lee de la BD solo ese campo.
+"""
+import functools
+
+from django.db.models.signals import post_init
+
+
+class FieldTracker:
+    """Atributo de modelo que registra los valores originales de `fields`"""
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+
+    def contribute_to_class(self, cls, name):
+        self.name = name
+        self.attr_originales = f'_{name}_originales'
+        setattr(cls, name, self)
+        post_init.connect(self._inicializar, sender=cls, weak=False)
+
+        # Renovar los originales después de save() (y de sus señales)
+        save_original = cls.save
+
+        @functools.wraps(save_original)
+        def save(instance, *args, **kwargs):
+            save_original(instance, *args, **kwargs)
+            self._renovar(instance, kwargs.get('update_fields'))
+
+        cls.save = save
+
+    def attnames(self, modelo):
+        """{campo: attname}; para las ForeignKey se sigue el id (usuario -> usuario_id)"""
+        try:
+            return self._attnames
+        except AttributeError:
+            self._attnames = {campo: modelo._meta.get_field(campo).attname for campo in self.fields}
+            return self._attnames
+
+    def _inicializar(self, sender, instance, **kwargs):
+        valores = instance.__dict__
+        valores[self.attr_originales] = {
+            attname: valores[attname] for attname in self.attnames(sender).values() if attname in valores
+        }
+
+    def _renovar(self, instance, update_fields=None):
+        valores = instance.__dict__
+        originales = valores.setdefault(self.attr_originales, {})
+        for campo, attname in self.attnames(type(instance)).items():
+            if (update_fields is None or campo in update_fields) and attname in valores:
+                originales[attname] = valores[attname]
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return CambiosInstancia(self, instance)
+
+
+class CambiosInstancia:
+    """Vista del tracker ligada a una instancia"""
+
+    def __init__(self, tracker, instance):
+        self.tracker = tracker
+        self.instance = instance
+
+    def _original(self, campo):
+        attname = self.tracker.attnames(type(self.instance))[campo]
+        originales = self.instance.__dict__.setdefault(self.tracker.attr_originales, {})
+        if attname not in originales:
+            # Campo diferido al cargar: el valor en la BD es el original
+            if self.instance.pk is None:
+                return None
+            originales[attname] = (type(self.instance)._base_manager
+                                   .filter(pk=self.instance.pk)
+                                   .values_list(attname, flat=True).first())
+        return originales[attname]
+
+    def previous(self, campo):
+        """Valor del campo al cargar la instancia o en el último save()"""
+        return self._original(campo)
+
+    def has_changed(self, campo=None):
+        """
+        Indica si el campo (o cualquiera de los seguidos, si no se indica)
+        ha cambiado. En instancias sin guardar todos cuentan como cambiados.
+        """
+        if campo is None:
+            return bool(self.changed())
+        if self.instance._state.adding:
+            return True
+        attname = self.tracker.attnames(type(self.instance))[campo]
+        if attname not in self.instance.__dict__:
+            return False  # Diferido y sin tocar
+        return self._original(campo) != self.instance.__dict__[attname]
+
+    def changed(self):
+        """{campo: valor anterior} de los campos seguidos que han cambiado"""
+        return {campo: self._original(campo) for campo in self.tracker.fields if self.has_changed(campo)}